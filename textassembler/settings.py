@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
-from configparser import ConfigParser, NoOptionError
+from configparser import ConfigParser, NoOptionError, NoSectionError
 import logging
 import datetime
 import sys
@@ -61,9 +61,57 @@ LN_CLIENT_SECRET = CONFIGS.get("lexisnexis", "CLIENT_SECRET")
 LN_SCOPE = CONFIGS.get("lexisnexis", "SCOPE")
 LN_API_URL = CONFIGS.get("lexisnexis", "API_URL")
 LN_DOWNLOAD_PER_CALL = int(CONFIGS.get("lexisnexis", "DOWNLOAD_PER_CALL"))
+try:
+    LN_DOWNLOAD_PER_CALL_MIN = int(CONFIGS.get("lexisnexis", "DOWNLOAD_PER_CALL_MIN"))
+except NoOptionError:
+    LN_DOWNLOAD_PER_CALL_MIN = 1
+try:
+    LN_DOWNLOAD_PER_CALL_MAX = int(CONFIGS.get("lexisnexis", "DOWNLOAD_PER_CALL_MAX"))
+except NoOptionError:
+    LN_DOWNLOAD_PER_CALL_MAX = LN_DOWNLOAD_PER_CALL
 LN_MAX_RETRY = int(CONFIGS.get("lexisnexis", "MAX_RETRY"))
 LN_TIMEOUT = int(CONFIGS.get("lexisnexis", "TIMEOUT_SECONDS"))
+try:
+    LN_DOWNLOAD_TARGET_SECONDS = int(CONFIGS.get("lexisnexis", "DOWNLOAD_TARGET_SECONDS"))
+except NoOptionError:
+    LN_DOWNLOAD_TARGET_SECONDS = max(LN_TIMEOUT // 3, 1)
+try:
+    LN_DOWNLOAD_MAX_PAGE_MB = int(CONFIGS.get("lexisnexis", "DOWNLOAD_MAX_PAGE_MB"))
+except NoOptionError:
+    LN_DOWNLOAD_MAX_PAGE_MB = 50
+try:
+    LN_POOL_SIZE = int(CONFIGS.get("lexisnexis", "POOL_SIZE"))
+except NoOptionError:
+    LN_POOL_SIZE = 10
+try:
+    LN_CONNECT_RETRIES = int(CONFIGS.get("lexisnexis", "CONNECT_RETRIES"))
+except NoOptionError:
+    LN_CONNECT_RETRIES = 2
+try:
+    LN_LIMITS_SYNC_SECONDS = int(CONFIGS.get("lexisnexis", "LIMITS_SYNC_SECONDS"))
+except NoOptionError:
+    LN_LIMITS_SYNC_SECONDS = 60
+try:
+    LN_TOKEN_REFRESH_SECONDS = int(CONFIGS.get("lexisnexis", "TOKEN_REFRESH_SECONDS"))
+except NoOptionError:
+    LN_TOKEN_REFRESH_SECONDS = 300
+try:
+    API_LOG_BATCH_SIZE = int(CONFIGS.get("lexisnexis", "API_LOG_BATCH_SIZE"))
+except NoOptionError:
+    API_LOG_BATCH_SIZE = 50
+try:
+    API_LOG_FLUSH_SECONDS = int(CONFIGS.get("lexisnexis", "API_LOG_FLUSH_SECONDS"))
+except NoOptionError:
+    API_LOG_FLUSH_SECONDS = 10
 PREVIEW_FORMAT = CONFIGS.get("lexisnexis", "PREVIEW_FORMAT")
+try:
+    PREVIEW_CACHE_SECONDS = int(CONFIGS.get("lexisnexis", "PREVIEW_CACHE_SECONDS"))
+except NoOptionError:
+    PREVIEW_CACHE_SECONDS = 3600
+try:
+    PREVIEW_CACHE_SIZE = int(CONFIGS.get("lexisnexis", "PREVIEW_CACHE_SIZE"))
+except NoOptionError:
+    PREVIEW_CACHE_SIZE = 500
 NUM_MONTHS_KEEP_SEARCHES = int(CONFIGS.get("lexisnexis", "NUM_MONTHS_KEEP_SEARCHES"))
 
 # Processor configs
@@ -71,6 +119,74 @@ DB_WAIT_TIME = int(CONFIGS.get("processor", "DB_WAIT_TIME"))
 STORAGE_WAIT_TIME = int(CONFIGS.get("processor", "STORAGE_WAIT_TIME"))
 LN_WAIT_TIME = int(CONFIGS.get("processor", "LN_WAIT_TIME"))
 NUM_PROCESSOR_RETRIES = int(CONFIGS.get("processor", "NUM_PROCESSOR_RETRIES"))
+try:
+    NUM_DOWNLOAD_WORKERS = int(CONFIGS.get("processor", "NUM_DOWNLOAD_WORKERS"))
+except NoOptionError:
+    NUM_DOWNLOAD_WORKERS = 1
+try:
+    DOWNLOAD_PIPELINE_RESULTS = int(CONFIGS.get("processor", "DOWNLOAD_PIPELINE_RESULTS"))
+except NoOptionError:
+    DOWNLOAD_PIPELINE_RESULTS = 100
+try:
+    DOWNLOAD_PAGES_PER_LEASE = int(CONFIGS.get("processor", "DOWNLOAD_PAGES_PER_LEASE"))
+except NoOptionError:
+    DOWNLOAD_PAGES_PER_LEASE = 10
+try:
+    NUM_COMPRESS_WORKERS = int(CONFIGS.get("processor", "NUM_COMPRESS_WORKERS"))
+except NoOptionError:
+    NUM_COMPRESS_WORKERS = 1
+try:
+    COMPRESS_IO_BUDGET_MB = int(CONFIGS.get("processor", "COMPRESS_IO_BUDGET_MB"))
+except NoOptionError:
+    COMPRESS_IO_BUDGET_MB = 0
+try:
+    NUM_DEFLATE_THREADS = int(CONFIGS.get("processor", "NUM_DEFLATE_THREADS"))
+except NoOptionError:
+    NUM_DEFLATE_THREADS = 1
+try:
+    ZIP_COMPRESS_LEVEL = int(CONFIGS.get("processor", "ZIP_COMPRESS_LEVEL"))
+except NoOptionError:
+    ZIP_COMPRESS_LEVEL = 6
+try:
+    ZSTD_COMPRESS_LEVEL = int(CONFIGS.get("processor", "ZSTD_COMPRESS_LEVEL"))
+except NoOptionError:
+    ZSTD_COMPRESS_LEVEL = 3
+try:
+    ARCHIVE_VOLUME_MB = int(CONFIGS.get("processor", "ARCHIVE_VOLUME_MB"))
+except NoOptionError:
+    ARCHIVE_VOLUME_MB = 0
+try:
+    COMPRESS_CHECKPOINT_MB = int(CONFIGS.get("processor", "COMPRESS_CHECKPOINT_MB"))
+except NoOptionError:
+    COMPRESS_CHECKPOINT_MB = 64
+try:
+    SEGMENT_MB = int(CONFIGS.get("processor", "SEGMENT_MB"))
+except NoOptionError:
+    SEGMENT_MB = 1024
+try:
+    INCREMENTAL_ZIP = CONFIGS.get("processor", "INCREMENTAL_ZIP").lower() == 'true'
+except NoOptionError:
+    INCREMENTAL_ZIP = False
+try:
+    QUEUE_POLL_SECONDS = int(CONFIGS.get("processor", "QUEUE_POLL_SECONDS"))
+except NoOptionError:
+    QUEUE_POLL_SECONDS = 300
+try:
+    NOTIFY_SOCKET_DIR = CONFIGS.get("processor", "NOTIFY_SOCKET_DIR")
+except NoOptionError:
+    NOTIFY_SOCKET_DIR = "/run/textassembler"
+try:
+    SCHEDULER = CONFIGS.get("processor", "SCHEDULER")
+except NoOptionError:
+    SCHEDULER = "fifo"
+try:
+    SCHEDULER_PREFER_SHORT = CONFIGS.get("processor", "SCHEDULER_PREFER_SHORT").lower() == 'true'
+except NoOptionError:
+    SCHEDULER_PREFER_SHORT = False
+try:
+    SCHEDULER_USER_WEIGHTS = {userid: float(weight) for (userid, weight) in CONFIGS.items("scheduler.weights")}
+except NoSectionError:
+    SCHEDULER_USER_WEIGHTS = {}
 
 # API Limits
 try:
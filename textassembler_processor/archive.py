@@ -0,0 +1,248 @@
+'''
+Build the zip file for a search while its results are being downloaded.
+
+Each result is deflated and appended to [Search ID]/.archive/archive.body as a zip entry
+(local file header followed by the compressed data) as soon as it is saved, and the
+name, offset, CRC, and sizes of the entry are added to [Search ID]/.archive/archive.idx.
+Once the search is downloaded, the compression processor only has to append the zip
+central directory (read from the index) to the body and move it into place.
+
+The archive follows the pages of the search the same way as PageStaging (see staging.py):
+before the search record is updated for a page, the body and index are flushed to disk and
+their sizes are added to [Search ID]/.archive/archive.ckpt with the skip value the search
+will have. When the search is picked up again, the body and index are truncated to the sizes
+saved for the skip value on the search record, removing any results from a page that was
+not saved.
+
+When a volume size is given, a new body ([Search ID]/.archive/archive.002.body, etc.) is
+started once the current one would go over it, and each volume is finished as a separate
+zip file that can be opened on its own.
+
+The compression processor uses the same writer to build the zip file for searches whose
+results were saved as separate files.
+'''
+import os
+import json
+import shutil
+import struct
+import time
+import zlib
+from itertools import groupby
+from textassembler_processor.volumes import VolumeWriter, truncate_file
+
+ARCHIVE_DIR = ".archive"
+
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_MAX_ENTRIES = (1 << 16) - 1
+VERSION_DEFLATE = 20
+VERSION_ZIP64 = 45
+CREATE_UNIX = 3
+FLAG_UTF8 = 0x800
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+END_RECORD_64 = struct.Struct("<4sQ2H2L4Q")
+END_LOCATOR_64 = struct.Struct("<4sLQL")
+
+class ArchiveWriter(VolumeWriter):
+    '''
+    Zip file of a search that results are added to as they are downloaded
+    '''
+
+    def __init__(self, base_path, level=zlib.Z_DEFAULT_COMPRESSION, volume_bytes=0):
+        '''
+        Params:
+            base_path (string): The save location for the search, i.e. [STORAGE_LOCATION]/[Search ID]
+            level (int): Compression level for the files added (0-9), 0 to store them without compression
+            volume_bytes (int): Size to start a new volume at, 0 to keep every file in one zip file
+        '''
+        super().__init__(os.path.join(base_path, ARCHIVE_DIR), "archive", volume_bytes)
+        self.level = level
+        self.method = METHOD_STORED if level == 0 else METHOD_DEFLATED
+        self.finished_path = os.path.join(self.store_path, "archive.done")
+
+    @staticmethod
+    def exists(base_path):
+        '''
+        Check if the search has an archive that was started while downloading
+        '''
+        return os.path.isdir(os.path.join(base_path, ARCHIVE_DIR))
+
+    def add(self, name, data):
+        '''
+        Add a file to the archive
+        Params:
+            name (string): Path of the file within the zip
+            data (bytes): Contents of the file
+        '''
+        self.add_compressed(name, *deflate(data, self.level))
+
+    def add_compressed(self, name, compressed, crc, size, modified=None): # pylint: disable=too-many-arguments
+        '''
+        Add a file that has already been deflated (with deflate at the level of the archive) to the archive
+        Params:
+            modified (float): Modification time of the file, defaults to now
+        '''
+        (dos_time, dos_date) = get_dos_time(time.localtime(modified))
+        encoded_name = name.encode("utf-8")
+        flags = 0 if encoded_name == name.encode("ascii", "ignore") else FLAG_UTF8
+        if self.volume_bytes and self.body.tell() > 0 and \
+                self.body.tell() + LOCAL_HEADER.size + len(encoded_name) + len(compressed) > self.volume_bytes:
+            self.next_volume()
+        offset = self.body.tell()
+        self.body.write(LOCAL_HEADER.pack(b"PK\x03\x04", VERSION_DEFLATE, flags, self.method, dos_time, dos_date,
+                                          crc, len(compressed), size, len(encoded_name), 0))
+        self.body.write(encoded_name)
+        self.body.write(compressed)
+        self.index.write((json.dumps([name, offset, crc, len(compressed), size, dos_time, dos_date, self.method,
+                                      len(self.volumes) + 1]) + "\n").encode("utf-8"))
+
+    def finalize(self, zip_path):
+        '''
+        Write the central directory for the results in each volume of the archive and move them
+        to zip_path (or zip_path with _part001, _part002, etc. added when there is more than one volume)
+        Returns:
+            files (list): Paths of the zip files
+        '''
+        self.index.flush()
+        self.body.flush()
+        sizes = self.get_sizes()["volumes"]
+        self.close()
+        with open(self.index_path, 'rb') as flh:
+            # the entries are in the order of the volumes they were written to
+            entries = groupby((json.loads(line) for line in flh), key=lambda entry: entry[8])
+            (next_volume, volume_entries) = next(entries, (None, []))
+            for (volume, size) in enumerate(sizes, 1):
+                with open(self.get_body_path(volume), 'r+b') as body:
+                    truncate_file(body, size)
+                    if volume == next_volume:
+                        write_central_directory(body, volume_entries)
+                        (next_volume, volume_entries) = next(entries, (None, []))
+                    else:
+                        write_central_directory(body, [])
+                    body.flush()
+                    os.fsync(body.fileno())
+
+        # record where the volumes are going, so the moves can be finished if the processor is stopped
+        moves = [(self.get_body_path(volume), zip_path if len(sizes) == 1 else get_part_path(zip_path, volume))
+                 for volume in range(1, len(sizes) + 1)]
+        with open(self.finished_path + ".tmp", 'w') as flh:
+            json.dump(moves, flh)
+            flh.flush()
+            os.fsync(flh.fileno())
+        os.replace(self.finished_path + ".tmp", self.finished_path)
+        return self.finish_moves()
+
+    def is_finalized(self):
+        '''
+        Check if the archive was finalized but its volumes were not all moved into place
+        '''
+        return os.path.isfile(self.finished_path)
+
+    def finish_moves(self):
+        '''
+        Move the finalized volumes into place and remove the archive directory
+        Returns:
+            files (list): Paths of the zip files
+        '''
+        with open(self.finished_path) as flh:
+            moves = json.load(flh)
+        for (body_path, final_path) in moves:
+            if os.path.isfile(body_path):
+                os.replace(body_path, final_path)
+        # move the directory out of the way first, so it is not mistaken for an archive that was not finished
+        removed_path = self.store_path + ".removed"
+        os.replace(self.store_path, removed_path)
+        shutil.rmtree(removed_path)
+        return [final_path for (_, final_path) in moves]
+
+
+def deflate(data, level=zlib.Z_DEFAULT_COMPRESSION):
+    '''
+    Compress the contents of a file for the archive
+    Params:
+        level (int): Compression level (0-9), 0 to leave the data uncompressed
+    Returns:
+        compressed (bytes): The deflated data
+        crc (int): CRC-32 of the data
+        size (int): Size of the data
+    '''
+    if level == 0:
+        return (data, zlib.crc32(data), len(data))
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return (compressor.compress(data) + compressor.flush(), zlib.crc32(data), len(data))
+
+def deflate_files(files, level=zlib.Z_DEFAULT_COMPRESSION):
+    '''
+    Compress the contents of several files for the archive, only compressing the same
+    contents once (i.e. the HTML and TXT formats of a result)
+    Params:
+        files (list): (name, data) for each file
+    Returns:
+        files (list): (name, compressed, crc, size) for each file
+    '''
+    deflated = {}
+    for (_, data) in files:
+        if data not in deflated:
+            deflated[data] = deflate(data, level)
+    return [(name,) + deflated[data] for (name, data) in files]
+
+def get_part_path(file_path, part):
+    '''
+    Add the part number to the name of a file, i.e. results.zip to results_part001.zip
+    '''
+    (base, extension) = (file_path[:-len(".tar.zst")], ".tar.zst") if file_path.endswith(".tar.zst") \
+        else os.path.splitext(file_path)
+    return f"{base}_part{part:03}{extension}"
+
+def get_dos_time(when):
+    '''
+    Get the time and date in the format used by zip files
+    '''
+    (year, month, day, hour, minute, second) = when[:6]
+    year = max(year, 1980)
+    return ((hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day)
+
+def get_central_header(name, offset, crc, compressed_size, size, dos_time, dos_date, method=METHOD_DEFLATED): # pylint: disable=too-many-arguments
+    '''
+    Get the central directory record for an entry in the archive
+    '''
+    encoded_name = name.encode("utf-8")
+    flags = 0 if encoded_name == name.encode("ascii", "ignore") else FLAG_UTF8
+    extra = b""
+    if offset > ZIP64_LIMIT:
+        # only the offset can be too large, each result is much smaller than the limit
+        extra = struct.pack("<2HQ", 1, 8, offset)
+        offset = 0xFFFFFFFF
+    version = VERSION_ZIP64 if extra else VERSION_DEFLATE
+    return CENTRAL_HEADER.pack(b"PK\x01\x02", version, CREATE_UNIX, version, 0, flags, method, dos_time,
+                               dos_date, crc, compressed_size, size, len(encoded_name), len(extra), 0, 0, 0,
+                               0o100644 << 16, offset) + encoded_name + extra
+
+def write_central_directory(flh, entries):
+    '''
+    Write the central directory for the entries of a volume from the index
+    '''
+    start = flh.tell()
+    count = 0
+    for entry in entries:
+        flh.write(get_central_header(*entry[:8]))
+        count = count + 1
+    write_end_records(flh, count, start, flh.tell() - start)
+
+def write_end_records(flh, count, start, size):
+    '''
+    Write the end of central directory record, with the Zip64 records if the archive needs them
+    '''
+    if count > ZIP_MAX_ENTRIES or start > ZIP64_LIMIT or size > ZIP64_LIMIT:
+        end_64 = flh.tell()
+        flh.write(END_RECORD_64.pack(b"PK\x06\x06", END_RECORD_64.size - 12, VERSION_ZIP64, VERSION_ZIP64,
+                                     0, 0, count, count, size, start))
+        flh.write(END_LOCATOR_64.pack(b"PK\x06\x07", 0, end_64, 1))
+        count = min(count, 0xFFFF)
+        size = min(size, 0xFFFFFFFF)
+        start = min(start, 0xFFFFFFFF)
+    flh.write(END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, size, start, 0))
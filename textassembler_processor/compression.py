@@ -0,0 +1,263 @@
+'''
+Compress the downloaded results of a search into a single zip (or tar.zst) file.
+
+These functions only work with the files of the search (no database access), so that
+the compression processor can run them in separate worker processes.
+'''
+import io
+import logging
+import os
+import re
+import shutil
+import signal
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from django.conf import settings
+from textassembler_web.utilities import ARCHIVE_EXTENSIONS
+from textassembler_processor.staging import STAGING_DIR
+from textassembler_processor.archive import ArchiveWriter, ARCHIVE_DIR, deflate_files, get_part_path
+from textassembler_processor.formats import RAW_EXTENSION, get_format_files, is_raw_file
+from textassembler_processor.segments import SegmentStore, SegmentReader, SEGMENT_DIR
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TAR_PARTS_DIR = ".tar_parts" # parts of the tar.zst file being written
+
+def get_files_to_compress(zippath):
+    '''
+    Get the result files saved for the search, followed by the documents saved to its segments
+    Params:
+        zippath (str): Directory of the search
+    returns:
+        files (list): Paths of the files to compress, and the index entries of the documents in the segments
+        total_bytes (int): Size of the files
+    '''
+    files_to_compress = []
+    total_bytes = 0
+    for root, dirs, files in os.walk(zippath):
+        # skip any results that were never saved to the search, the archive built while downloading, and the segments
+        dirs[:] = [dirn for dirn in dirs if dirn not in (STAGING_DIR, SEGMENT_DIR, TAR_PARTS_DIR) and not dirn.startswith(ARCHIVE_DIR)]
+        if root == zippath:
+            # the results are saved under the subdirectories, only the compressed files are in the search directory
+            continue
+        for fln in files:
+            files_to_compress.append(os.path.join(root, fln))
+            total_bytes = total_bytes + os.path.getsize(files_to_compress[-1])
+    # keep the same order every time so compression can resume after the files already added
+    files_to_compress.sort()
+    if SegmentStore.exists(zippath):
+        documents = SegmentReader(zippath).read_index()
+        files_to_compress.extend(documents)
+        total_bytes = total_bytes + sum(entry[4] for entry in documents)
+    return (files_to_compress, total_bytes)
+
+def find_compressed_files(zippath, zipname):
+    '''
+    Get the compressed files for the search that were already moved into place, i.e. when the processor
+    was stopped during the cleanup of the non-compressed files or before the search was saved
+    Params:
+        zippath (str): Directory of the search
+        zipname (str): Name of the zip file (without the extension)
+    returns:
+        files (list): Paths of the compressed files, empty if the search has not finished compressing
+    '''
+    if ArchiveWriter.exists(zippath) or os.path.isdir(os.path.join(zippath, TAR_PARTS_DIR)):
+        # the compressed files are still being written or moved into place
+        return []
+    return sorted(os.path.join(zippath, fln) for fln in os.listdir(zippath)
+                  if fln.startswith(zipname) and fln.endswith(ARCHIVE_EXTENSIONS))
+
+def compress_files(zippath, zipname, files_to_compress, threads=1, archive_format="zip", progress=None, # pylint: disable=too-many-arguments
+                   formats=None):
+    '''
+    Compress the files for the search into zippath/zipname.zip (or .tar.zst), then remove the non-compressed files.
+    If the results were added to an archive while they were downloaded, the archive is finished instead.
+    When ARCHIVE_VOLUME_MB is set, the results are split into zippath/zipname_part001.zip, etc. once they
+    go over that size. Zip files are checkpointed as they are compressed and resumed from the last
+    checkpoint if a previous attempt did not finish. The documents saved in the RAW directory or to
+    the segments of the search are added in each of the formats requested for the search. If the
+    compressed files were already moved into place, only the cleanup is finished.
+    Params:
+        zippath (str): Directory of the search
+        zipname (str): Name of the zip file (without the extension)
+        files_to_compress (list): Paths of the files to compress, from get_files_to_compress
+        threads (int): Number of files to compress at the same time
+        archive_format (str): zip, zip_store (not compressed), or tar.zst
+        progress (function): Called with the number of files compressed and the total at each checkpoint
+        formats (list): Formats to produce from the documents (i.e. HTML, TXT), defaults to HTML
+    returns:
+        files (list): Paths of the compressed files
+    '''
+    if archive_format == "tar.zst" and zstandard is None:
+        logging.warning(f"The zstandard package is not installed, compressing {zippath} as a zip file instead.")
+        archive_format = "zip"
+    volume_bytes = settings.ARCHIVE_VOLUME_MB * 1024 * 1024
+    segments = SegmentReader(zippath)
+
+    try:
+        files = find_compressed_files(zippath, zipname)
+        if files:
+            # a previous attempt finished compressing, the remaining files may already be partially removed
+            logging.info(f"{zippath} was already compressed, finishing the cleanup of non-compressed files")
+        elif archive_format == "tar.zst" and not ArchiveWriter.exists(zippath):
+            files = compress_tar_zst(zippath, os.path.join(zippath, zipname + ".tar.zst"), files_to_compress, threads,
+                                     volume_bytes, formats, segments)
+        else:
+            archive = ArchiveWriter(zippath, 0 if archive_format == "zip_store" else settings.ZIP_COMPRESS_LEVEL, volume_bytes)
+            if archive.is_finalized():
+                # the archive was finished before the processor was stopped
+                files = archive.finish_moves()
+            else:
+                # any files added by a previous attempt after its last checkpoint are removed when it is opened
+                archive.open()
+                if archive.committed.get("members"):
+                    logging.info((f"Resuming compression of {zippath} after {archive.committed['members']} "
+                                  f"of {len(files_to_compress)} files"))
+                try:
+                    add_files(archive, zippath, files_to_compress, threads, progress, formats, segments)
+                    files = archive.finalize(os.path.join(zippath, zipname + ".zip"))
+                finally:
+                    archive.close()
+    finally:
+        segments.close()
+
+    logging.info(f"Completed compression of {zippath} into {len(files)} file(s)")
+
+    #  remove non-compressed files
+    logging.info(f"Started cleanup of non-compressed files for {zippath}")
+    for root, dirs, _ in os.walk(zippath):
+        for dirn in dirs:
+            logging.debug(f"Deleting directory: {os.path.join(root, dirn)}")
+            shutil.rmtree(os.path.join(root, dirn))
+    logging.info(f"Completed cleanup of non-compressed files for {zippath}")
+    return files
+
+def compress_tar_zst(zippath, tar_file, files_to_compress, threads, volume_bytes=0, formats=None, # pylint: disable=too-many-arguments, too-many-locals
+                     segments=None):
+    '''
+    Compress the files into a tar file compressed with Zstandard, starting a new part once the
+    compressed file reaches volume_bytes. The parts are written to the .tar_parts directory of
+    the search first so a partial file is never downloaded, and any parts left by a previous
+    attempt that did not finish are removed.
+    Params:
+        tar_file (str): Path of the file to create
+        threads (int): Number of threads Zstandard compresses with
+        volume_bytes (int): Size to start a new part at, 0 for a single file
+    returns:
+        files (list): Paths of the compressed files
+    '''
+    compressor = zstandard.ZstdCompressor(level=settings.ZSTD_COMPRESS_LEVEL, threads=threads if threads > 1 else 0)
+    parts_path = os.path.join(zippath, TAR_PARTS_DIR)
+    shutil.rmtree(parts_path, ignore_errors=True)
+    os.makedirs(parts_path)
+    parts = []
+    remaining = iter(files_to_compress)
+    fln = next(remaining, None)
+    while fln is not None or not parts:
+        parts.append(os.path.join(parts_path, f"{os.path.basename(tar_file)}.{len(parts) + 1}"))
+        with open(parts[-1], 'wb') as flh:
+            with compressor.stream_writer(flh, closefd=False) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    unflushed = 0
+                    while fln is not None and not (volume_bytes and flh.tell() >= volume_bytes):
+                        (result_files, modified) = read_result_file(zippath, fln, formats, segments)
+                        for (target_name, data) in result_files:
+                            logging.info(f"Adding file to tar: {get_source_name(fln)}. Target Name: {target_name}")
+                            info = tarfile.TarInfo(target_name)
+                            info.size = len(data)
+                            info.mtime = modified
+                            tar.addfile(info, io.BytesIO(data))
+                            # Zstandard holds on to the compressed data, so flush it every so often to know the size
+                            # of the part (it may still go a little over)
+                            unflushed = unflushed + len(data)
+                        if volume_bytes and unflushed >= volume_bytes // 8:
+                            writer.flush(zstandard.FLUSH_BLOCK)
+                            unflushed = 0
+                        fln = next(remaining, None)
+            flh.flush()
+            os.fsync(flh.fileno())
+
+    files = [tar_file] if len(parts) == 1 else [get_part_path(tar_file, num) for num in range(1, len(parts) + 1)]
+    for (part, final_path) in zip(parts, files):
+        os.replace(part, final_path)
+    shutil.rmtree(parts_path)
+    return files
+
+def add_files(archive, zippath, files_to_compress, threads, progress=None, formats=None, segments=None): # pylint: disable=too-many-arguments, too-many-locals
+    '''
+    Add the files to the archive. The files are read and deflated by a pool of threads
+    (zlib releases the GIL while compressing) and written to the archive in order as they
+    are ready, with at most a few files per thread waiting to be written. The archive is
+    checkpointed every COMPRESS_CHECKPOINT_MB, starting after the files already added
+    at its last checkpoint.
+    '''
+    def read_file(fln):
+        (result_files, modified) = read_result_file(zippath, fln, formats, segments)
+        return (deflate_files(result_files, archive.level), modified)
+
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        pending = deque()
+        members = archive.committed.get("members", 0)
+        files = islice(files_to_compress, members, None)
+        unsaved = 0
+        while True:
+            for fln in islice(files, max(threads, 1) * 4 - len(pending)):
+                pending.append((fln, executor.submit(read_file, fln)))
+            if not pending:
+                break
+            (fln, future) = pending.popleft()
+            (deflated, modified) = future.result()
+            for (target_name, compressed, crc, size) in deflated:
+                logging.info(f"Adding file to zip: {get_source_name(fln)}. Target Name: {target_name}")
+                archive.add_compressed(target_name, compressed, crc, size, modified)
+                unsaved = unsaved + size
+            members = members + 1
+            if unsaved >= settings.COMPRESS_CHECKPOINT_MB * 1024 * 1024:
+                archive.checkpoint(members)
+                if progress is not None:
+                    progress(members, len(files_to_compress))
+                unsaved = 0
+
+def read_result_file(zippath, fln, formats=None, segments=None):
+    '''
+    Read a result of the search, producing each of the formats from it if it is a document
+    saved in the RAW directory or to the segments of the search
+    Params:
+        fln (str or list): Path of the result file, or the index entry of a document in the segments
+        segments (SegmentReader): Reader for the segments of the search
+    Returns:
+        files (list): (name within the archive, data) for each file
+        modified (float): When the result was saved
+    '''
+    if not isinstance(fln, str):
+        (file_name, modified) = (fln[1], fln[5])
+        full_text = segments.read(fln)
+    else:
+        target_name = re.sub(zippath+r'/\d+/\d+/\d+/', '', fln)
+        modified = os.path.getmtime(fln)
+        with open(fln, 'rb') as flh:
+            data = flh.read()
+        if not is_raw_file(target_name):
+            return ([(target_name, data)], modified)
+        file_name = os.path.basename(target_name)[:-len(RAW_EXTENSION)]
+        full_text = data.decode("utf-8")
+    return ([(name, text.encode("utf-8")) for (name, text) in get_format_files(file_name, full_text, formats or ["HTML"])],
+            modified)
+
+def get_source_name(fln):
+    '''
+    Get the name to log for a file to compress: its path, or the file name of a document in the segments
+    '''
+    return fln if isinstance(fln, str) else fln[1]
+
+def init_worker():
+    '''
+    Initialize a compression worker process. The worker should stop when the processor
+    is stopped instead of using the handlers it inherited from the processor.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
@@ -0,0 +1,78 @@
+'''
+Synthetic NITF documents in the form returned by the LexisNexis API, used to
+benchmark the processors without calling the API (see the benchmark_nitf and
+run_mock_api commands)
+'''
+import random
+
+WORDS = ("the of and to in a is that for on was with as by at said from it be has are have "
+         "government market company percent year new would will city state officials report "
+         "million week police court president people school health business economy").split()
+
+def generate_corpus(num_documents, paragraphs=20, seed=1):
+    '''
+    Generate NITF documents in the form returned by the LexisNexis API
+    '''
+    rng = random.Random(seed)
+    return [generate_document(rng, max(1, int(rng.gauss(paragraphs, paragraphs / 3)))) for _ in range(num_documents)]
+
+def generate_document(rng, num_paragraphs):
+    '''
+    Generate a single NITF document with the given number of paragraphs
+    '''
+    headline = generate_sentence(rng, 4, 12)
+    title = headline if rng.random() < 0.8 else generate_sentence(rng, 4, 12)
+    doc_id = f"urn:contentItem:{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}-00{rng.randint(10, 99)}-0000-00000-00"
+    parts = ['<entry xmlns="http://www.w3.org/2005/Atom">',
+             f'<id>{doc_id}</id>',
+             f'<title>{title}</title>',
+             f'<published>2019-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}T00:00:00Z</published>',
+             '<author><name>LexisNexis</name></author>',
+             '<content type="application/xml"><articleDoc xmlns="" xml:lang="en">',
+             '<articleDocHead><itemInfo><sourceSectionInfo>',
+             f'<positionSection>{rng.choice(["NEWS", "BUSINESS", "SPORTS", "OPINION"])}</positionSection>',
+             f'<positionSequence>Pg. A{rng.randint(1, 20)}</positionSequence>',
+             f'</sourceSectionInfo><wordCount number="{rng.randint(100, 2000)}"/></itemInfo></articleDocHead>',
+             '<nitf:body xmlns:nitf="http://iptc.org/std/NITF/2006-10-18/">\n<nitf:body.head>']
+    if rng.random() < 0.3:
+        parts.append(f'<h1>{headline}</h1>')
+    parts.extend([f'<nitf:hedline><nitf:hl1>{headline}</nitf:hl1></nitf:hedline>',
+                  f'<nitf:byline><author><person><nameText>{generate_sentence(rng, 2, 3)}</nameText></person></author></nitf:byline>',
+                  '</nitf:body.head>\n<nitf:body.content><bodyText>\n'])
+    for num in range(num_paragraphs):
+        lede = ' nitf:lede="true"' if num == 0 else ''
+        parts.append(f'<p{lede}>{generate_paragraph(rng)}</p>\n')
+    if rng.random() < 0.2:
+        parts.append('<!-- end of body text -->')
+    parts.extend(['</bodyText></nitf:body.content>\n',
+                  f'<nitf:body.end><graphic><caption>{generate_sentence(rng, 5, 15)}</caption></graphic></nitf:body.end>',
+                  '</nitf:body>',
+                  f'<metadata><dc:metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier identifierScheme="PGUID">{doc_id}</dc:identifier>',
+                  '<dc:source sourceScheme="productContentSetIdentifier">6742</dc:source></dc:metadata></metadata>',
+                  '</articleDoc></content></entry>'])
+    return "".join(parts)
+
+def generate_paragraph(rng):
+    '''
+    Generate a paragraph of text with some inline markup and character references
+    '''
+    sentences = []
+    for _ in range(rng.randint(2, 6)):
+        sentence = generate_sentence(rng, 6, 25)
+        choice = rng.random()
+        if choice < 0.1:
+            sentence = f'&#8220;{sentence},&#8221; {rng.choice(WORDS)} said'
+        elif choice < 0.15:
+            sentence = f'{sentence} &amp; {rng.choice(WORDS)}'
+        elif choice < 0.2:
+            sentence = f'<emphasis typeStyle="it">{sentence}</emphasis>'
+        elif choice < 0.22:
+            sentence = f'{sentence}<br/>caf&eacute; &quot;{rng.choice(WORDS)}&quot;'
+        sentences.append(sentence + ".")
+    return " ".join(sentences)
+
+def generate_sentence(rng, min_words, max_words):
+    '''
+    Generate a capitalized sentence of random words
+    '''
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))).capitalize()
@@ -0,0 +1,55 @@
+'''
+Produce the formats a user asked for (HTML, TXT, TXT Only) from the document returned
+by LexisNexis.
+
+The HTML and TXT formats are the same text, and TXT Only is derived from it, so each
+result is saved once in the RAW directory of the search while it is downloaded and the
+requested formats are produced from it when the search is compressed. Searches that
+are added to the zip file while downloading produce the formats right away instead.
+'''
+import logging
+import os
+from textassembler_web.utilities import log_error, create_error_message
+from textassembler_processor.nitf import remove_html
+
+RAW_DIR = "RAW" # directory the downloaded documents are saved in
+RAW_EXTENSION = ".html"
+FORMAT_EXTENSIONS = {"HTML": ".html", "TXT": ".txt", "TXT Only": ".txt"}
+
+def get_format_files(file_name, full_text, formats):
+    '''
+    Get the files for the result in each of the formats
+    Params:
+        file_name (str): Name of the result file (without the extension)
+        full_text (str): The document returned by LexisNexis
+        formats (list): Names of the formats to produce
+    returns:
+        files (list): (path within the search, text) for each format
+    '''
+    files = []
+    for format_name in formats:
+        if format_name not in FORMAT_EXTENSIONS:
+            logging.warning(f"Unknown format {format_name} for {file_name}, it will not be saved.")
+            continue
+        text = full_text
+        if format_name == "TXT Only":
+            try:
+                text = remove_html(full_text)
+            except Exception as exp: # pylint: disable=broad-except
+                log_error((f"Unable to create TXT Only output for filename {file_name}. "
+                           f"Error. {create_error_message(exp, os.path.basename(__file__))}"))
+                ## write the original text to the file instead
+        files.append((os.path.join(format_name, file_name + FORMAT_EXTENSIONS[format_name]), text))
+    return files
+
+def get_raw_path(save_location, file_name):
+    '''
+    Get the path to save the document for a result to
+    '''
+    return os.path.join(save_location, RAW_DIR, file_name + RAW_EXTENSION)
+
+def is_raw_file(target_name):
+    '''
+    Check if a result file (relative to its save location) is a document saved in the RAW directory
+    '''
+    return os.path.dirname(target_name) == RAW_DIR and target_name.endswith(RAW_EXTENSION)
@@ -0,0 +1,40 @@
+'''
+Compare the speed and output of the TXT Only conversion against the original
+BeautifulSoup implementation on a synthetic corpus of NITF documents
+'''
+import time
+from django.core.management.base import BaseCommand
+from textassembler_processor.nitf import remove_html, remove_html_soup
+from textassembler_processor.corpus import generate_corpus
+
+class Command(BaseCommand):
+    '''
+    Benchmark the NITF to text conversion
+    '''
+    help = "Compare the TXT Only conversion against the original BeautifulSoup implementation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--documents', type=int, default=500, help='Number of documents to convert (Default = 500)')
+        parser.add_argument('-p', '--paragraphs', type=int, default=20, help='Average number of paragraphs per document (Default = 20)')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for generating the documents (Default = 1)')
+
+    def handle(self, *args, **options):
+        corpus = generate_corpus(options['documents'], options['paragraphs'], options['seed'])
+        size = sum(len(doc) for doc in corpus)
+        self.stdout.write(f"Converting {len(corpus)} documents ({size / 1024 / 1024:.1f} MB)")
+
+        timings = {}
+        outputs = {}
+        for convert in (remove_html_soup, remove_html):
+            start_time = time.perf_counter()
+            outputs[convert.__name__] = [convert(doc) for doc in corpus]
+            timings[convert.__name__] = time.perf_counter() - start_time
+            self.stdout.write((f"{convert.__name__}: {timings[convert.__name__]:.2f} seconds, "
+                               f"{len(corpus) / timings[convert.__name__]:.0f} documents per second"))
+
+        mismatches = sum(1 for (old, new) in zip(outputs['remove_html_soup'], outputs['remove_html']) if old != new)
+        self.stdout.write(f"Speedup: {timings['remove_html_soup'] / timings['remove_html']:.1f}x")
+        if mismatches:
+            self.stderr.write(f"{mismatches} of {len(corpus)} documents had different output")
+        else:
+            self.stdout.write("All documents had the same output")
@@ -0,0 +1,327 @@
+'''
+Measure the processors end to end against the mock LexisNexis API: download searches
+with process_queue, compress them with compress_searches, and remove them with
+delete_searches, reporting the throughput, CPU, memory, and database queries of each.
+'''
+import datetime
+import multiprocessing
+import os
+import resource
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from unittest import mock
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from django.utils import timezone
+from textassembler_web import ln_api
+from textassembler_web.models import CallTypeChoice, ARCHIVE_FORMATS
+from textassembler_processor.mock_api import serve_in_process, WINDOW_SECONDS
+from textassembler_processor.management.commands import process_queue, compress_searches, delete_searches
+from textassembler_processor.management.commands.run_mock_api import add_mock_arguments, get_mock_options
+
+BENCHMARK_USER = "benchmark"
+
+class Command(BaseCommand):
+    '''
+    Benchmark the download, compression, and deletion processors
+    '''
+    help = ("Run the processors end to end against a local mock of the LexisNexis API. "
+            "Only run this against a development database with no other processors running.")
+
+    def __init__(self):
+        self.searches = apps.get_model('textassembler_web', 'searches')
+        self.counter = QueryCounter()
+        self.search_ids = []
+        super().__init__()
+
+    def add_arguments(self, parser):
+        add_mock_arguments(parser)
+        parser.add_argument('--searches', type=int, default=4, help='Number of searches to download (Default = 4)')
+        parser.add_argument('-w', '--workers', type=int, default=settings.NUM_DOWNLOAD_WORKERS,
+                            help=f'Number of searches to download in parallel (Default = {settings.NUM_DOWNLOAD_WORKERS})')
+        parser.add_argument('--compress-workers', type=int, default=settings.NUM_COMPRESS_WORKERS,
+                            help=f'Number of searches to compress in parallel (Default = {settings.NUM_COMPRESS_WORKERS})')
+        parser.add_argument('--compress-threads', type=int, default=settings.NUM_DEFLATE_THREADS,
+                            help=f'Number of files to compress in parallel within a search (Default = {settings.NUM_DEFLATE_THREADS})')
+        parser.add_argument('--formats', type=str,
+                            help='Comma separated formats to download (Default = all of the available formats)')
+        parser.add_argument('--archive-format', type=str, default="zip", choices=[value for (value, _) in ARCHIVE_FORMATS],
+                            help='Type of file to compress the searches into (Default = zip)')
+        parser.add_argument('--incremental-zip', action='store_true',
+                            help='Add the results to the zip file while downloading (Default = INCREMENTAL_ZIP)')
+        parser.add_argument('--max-seconds', type=int, default=3600,
+                            help='Stop a processor that has not finished after this many seconds (Default = 3600)')
+        parser.add_argument('--keep', action='store_true', help='Keep the files and log records from the benchmark')
+
+    def handle(self, *args, **options):
+        pending = self.searches.objects.filter(date_completed_compression__isnull=True, failed_date__isnull=True)
+        if pending.exists() or self.searches.objects.filter(deleted=True).exists():
+            raise CommandError("The benchmark can only be run when there are no other searches waiting to be processed.")
+        mock_options = get_mock_options(options)
+        formats = self.get_formats(options['formats'])
+
+        work_dir = tempfile.mkdtemp(prefix="tassembler_benchmark_")
+        storage = os.path.join(work_dir, "storage")
+        os.makedirs(storage)
+        handlers = (signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM))
+        saved_limits = {limits.limit_type: limits for limits in apps.get_model('textassembler_web', 'api_limits').objects.all()}
+
+        connections.close_all() # do not share the database connection with the mock server process
+        (server, url) = start_mock_api(mock_options)
+        try:
+            with override_settings(LN_API_URL=f"{url}/v1/", LN_TOKEN_URL=f"{url}/oauth/v2/token",
+                                   LN_CLIENT_ID=BENCHMARK_USER, LN_CLIENT_SECRET=BENCHMARK_USER,
+                                   STORAGE_LOCATION=storage, NOTIFY_SOCKET_DIR=work_dir,
+                                   MAINTAINER_EMAILS=[], NOTIF_EMAIL_DOMAIN="", EMAIL_MAINTAINERS_ON_API_ERROR=False,
+                                   INCREMENTAL_ZIP=options['incremental_zip'] or settings.INCREMENTAL_ZIP), \
+                 mock.patch.object(ln_api, "get_next_run_time", lambda when: when):
+                # downloads are only allowed during the run window, which does not apply to the mock API
+                set_limits(mock_options["limits"])
+                self.create_searches(options['searches'], mock_options["results"], formats, options['archive_format'])
+                self.stdout.write((f"Benchmarking {options['searches']} searches of {mock_options['results']} results "
+                                   f"in {', '.join(formats)} with {options['workers']} worker(s) against {url}"))
+
+                connection_created.connect(self.counter.install)
+                self.report(self.run_download(options), get_mock_stats(url))
+                self.report(self.run_compress(options))
+                self.report(self.run_delete(options))
+        finally:
+            connection_created.disconnect(self.counter.install)
+            signal.signal(signal.SIGINT, handlers[0])
+            signal.signal(signal.SIGTERM, handlers[1])
+            server.terminate()
+            server.join()
+            self.cleanup(saved_limits, url, options['keep'])
+            if not options['keep']:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            else:
+                self.stdout.write(f"Kept the benchmark files in {work_dir}")
+
+    def get_formats(self, names):
+        '''
+        Get the formats to download the searches in
+        '''
+        available_formats = apps.get_model('textassembler_web', 'available_formats')
+        formats = [fmt.format_name for fmt in available_formats.objects.all().order_by('format_id')]
+        if names:
+            unknown = [name.strip() for name in names.split(",") if name.strip() not in formats]
+            if unknown:
+                raise CommandError(f"Unknown format(s): {', '.join(unknown)}. Available formats: {', '.join(formats)}")
+            formats = [name.strip() for name in names.split(",")]
+        if not formats:
+            raise CommandError("There are no available formats to download the searches in.")
+        return formats
+
+    def create_searches(self, num_searches, num_results, formats, archive_format):
+        '''
+        Queue the searches to download
+        '''
+        available_formats = apps.get_model('textassembler_web', 'available_formats')
+        download_formats = apps.get_model('textassembler_web', 'download_formats')
+        for num in range(num_searches):
+            search = self.searches.objects.create(userid=BENCHMARK_USER, query=f"benchmark search {num + 1}",
+                                                  num_results_in_search=num_results, archive_format=archive_format)
+            for fmt in available_formats.objects.filter(format_name__in=formats):
+                download_formats.objects.create(search_id=search, format_id=fmt)
+            self.search_ids.append(search.search_id)
+
+    def run_download(self, options):
+        '''
+        Download the searches with process_queue
+        '''
+        searches = self.searches.objects.filter(search_id__in=self.search_ids)
+        stats = self.run_stage("download", process_queue.Command(), {"workers": options['workers']}, options['max_seconds'],
+                               lambda: not searches.filter(date_completed__isnull=True, failed_date__isnull=True).exists())
+        stats["documents"] = sum(search.num_results_downloaded for search in searches)
+        stats["failed"] = searches.filter(failed_date__isnull=False).count()
+        return stats
+
+    def run_compress(self, options):
+        '''
+        Compress the downloaded searches with compress_searches
+        '''
+        searches = self.searches.objects.filter(search_id__in=self.search_ids)
+        command_options = {"workers": options['compress_workers'], "threads": options['compress_threads']}
+        stats = self.run_stage("compress", compress_searches.Command(), command_options, options['max_seconds'],
+                               lambda: not searches.filter(date_completed__isnull=False, date_completed_compression__isnull=True,
+                                                           failed_date__isnull=True).exists())
+        stats["documents"] = sum(search.num_results_downloaded for search in searches.filter(date_completed_compression__isnull=False))
+        stats["bytes"] = sum(os.path.getsize(os.path.join(root, fln))
+                             for (root, _, files) in os.walk(settings.STORAGE_LOCATION) for fln in files)
+        return stats
+
+    def run_delete(self, options):
+        '''
+        Delete the searches with delete_searches
+        '''
+        searches = self.searches.objects.filter(search_id__in=self.search_ids)
+        documents = sum(search.num_results_downloaded for search in searches)
+        searches.update(deleted=True)
+        stats = self.run_stage("delete", delete_searches.Command(), {}, options['max_seconds'],
+                               lambda: not searches.exists())
+        stats["documents"] = documents
+        return stats
+
+    def run_stage(self, name, command, options, max_seconds, is_done): # pylint: disable=too-many-arguments
+        '''
+        Run the processor until is_done returns True (checked from another thread), or
+        for max_seconds, measuring the time, CPU, memory, and database queries it used
+        '''
+        finished = threading.Event()
+        stats = {"stage": name, "timed_out": False}
+
+        def watch():
+            self.counter.ignore_thread()
+            try:
+                deadline = time.time() + max_seconds
+                while not finished.wait(0.5):
+                    if is_done() or time.time() > deadline:
+                        stats["timed_out"] = time.time() > deadline
+                        command.sig_term(None, None)
+                        break
+            finally:
+                connection.close()
+
+        connections.close_all()
+        self.counter.reset()
+        start_usage = get_cpu_seconds()
+        start_time = time.perf_counter()
+        watcher = threading.Thread(target=watch, name=f"benchmark-{name}")
+        watcher.start()
+        try:
+            command.handle(**options)
+        finally:
+            finished.set()
+            watcher.join()
+
+        stats["seconds"] = time.perf_counter() - start_time
+        stats["cpu_seconds"] = get_cpu_seconds() - start_usage
+        stats["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kilobytes on Linux
+        stats["queries"] = self.counter.count
+        return stats
+
+    def report(self, stats, mock_stats=None):
+        '''
+        Print the results of a stage
+        '''
+        documents = stats["documents"]
+        self.stdout.write(f"{stats['stage']}:{' (stopped after --max-seconds)' if stats['timed_out'] else ''}")
+        self.stdout.write(f"  {documents} documents in {stats['seconds']:.1f} seconds "
+                          f"({documents / max(stats['seconds'], 0.001):.1f} documents/sec)")
+        self.stdout.write(f"  CPU: {stats['cpu_seconds']:.1f} seconds ({100 * stats['cpu_seconds'] / max(stats['seconds'], 0.001):.0f}%), "
+                          f"peak RSS: {stats['max_rss_mb']:.0f} MB")
+        self.stdout.write(f"  DB queries: {stats['queries']} ({stats['queries'] / max(documents, 1):.2f} per document)")
+        if stats.get("failed"):
+            self.stdout.write(f"  Failed searches: {stats['failed']}")
+        if "bytes" in stats:
+            self.stdout.write(f"  Compressed size: {stats['bytes'] / 1024 / 1024:.1f} MB")
+        if mock_stats is not None:
+            codes = ", ".join(f"{code}: {count}" for (code, count) in sorted(mock_stats["codes"].items()))
+            self.stdout.write(f"  API calls: {mock_stats['calls']} ({codes}), "
+                              f"{mock_stats['bytes'] / 1024 / 1024:.1f} MB, {mock_stats['results']} results")
+
+    def cleanup(self, saved_limits, url, keep):
+        '''
+        Restore the API limits and remove the records added by the benchmark
+        '''
+        api_limits = apps.get_model('textassembler_web', 'api_limits')
+        api_tokens = apps.get_model('textassembler_web', 'api_tokens')
+        api_log = apps.get_model('textassembler_processor', 'api_log')
+        for limits in api_limits.objects.all():
+            if limits.limit_type in saved_limits:
+                saved_limits[limits.limit_type].save()
+            else:
+                limits.delete()
+        api_tokens.objects.filter(client_id=BENCHMARK_USER).delete()
+        if not keep:
+            self.searches.objects.filter(search_id__in=self.search_ids).delete()
+            api_log.objects.filter(request_url__startswith=url).delete()
+
+
+class QueryCounter:
+    '''
+    Counts the queries run on every database connection opened after it is installed
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.count = 0
+
+    def install(self, sender, connection, **kwargs): # pylint: disable=unused-argument, redefined-outer-name
+        '''
+        Add the counter to a new connection (connection_created signal receiver)
+        '''
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def ignore_thread(self):
+        '''
+        Do not count the queries from the current thread
+        '''
+        self.local.ignore = True
+
+    def reset(self):
+        '''
+        Start counting from zero
+        '''
+        with self.lock:
+            self.count = 0
+
+    def __call__(self, execute, sql, params, many, context): # pylint: disable=too-many-arguments
+        if not getattr(self.local, "ignore", False):
+            with self.lock:
+                self.count = self.count + 1
+        return execute(sql, params, many, context)
+
+
+def start_mock_api(options):
+    '''
+    Start the mock API in a separate process so it does not count towards the CPU used by the processors
+    returns:
+        process (multiprocessing.Process): The server process
+        url (str): Base URL of the server
+    '''
+    (receiver, sender) = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=serve_in_process, args=(options, sender), name="mock-api", daemon=True)
+    process.start()
+    if not receiver.poll(30):
+        process.terminate()
+        raise CommandError("The mock API did not start.")
+    return (process, receiver.recv())
+
+def get_cpu_seconds():
+    '''
+    Get the CPU time used by the process and the worker processes it has finished waiting on
+    (the mock API process is not waited on until the benchmark is done)
+    '''
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(use.ru_utime + use.ru_stime for use in usage)
+
+def get_mock_stats(url):
+    '''
+    Get the calls made to the mock API
+    '''
+    return requests.get(f"{url}/mock/stats", timeout=10).json()
+
+def set_limits(limits):
+    '''
+    Start with the limits of the mock API for each type of call
+    '''
+    api_limits = apps.get_model('textassembler_web', 'api_limits')
+    now = timezone.now()
+    for (limit_type, service) in ((CallTypeChoice.SRH, "search"), (CallTypeChoice.DWL, "download"), (CallTypeChoice.SRC, "sources")):
+        values = {}
+        for (window, limit, seconds) in zip(("minute", "hour", "day"), limits[service], WINDOW_SECONDS):
+            values[f"limit_per_{window}"] = limit
+            values[f"remaining_per_{window}"] = limit
+            values[f"reset_on_{window}"] = now + datetime.timedelta(seconds=seconds)
+        api_limits.objects.update_or_create(limit_type=limit_type, defaults=values)
@@ -2,20 +2,23 @@
 Process completed searches to compress results
 '''
 import logging
+import multiprocessing
 import signal
+import threading
 import time
 import os
-import zipfile
-import shutil
-import re
+from functools import partial
+from queue import Queue, Empty
 from django.core.management.base import BaseCommand
-from django.db import OperationalError
+from django.db import OperationalError, connection
 from django.apps import apps
 from django.conf import settings
 from django.utils import timezone
+from textassembler_web.notifications import QueueListener, COMPRESS
 from textassembler_web.utilities import log_error, create_error_message, send_user_notification
+from textassembler_processor.compression import get_files_to_compress, compress_files, init_worker
 
-class Command(BaseCommand):
+class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
     '''
     Compress completed searches
     '''
@@ -25,26 +28,69 @@ class Command(BaseCommand):
         self.terminate = False
         self.cur_search = None
         self.searches = None
+        self.download_formats = None
+        self.listener = None
+        self.pool = None # worker processes, when compressing more than one search at a time
+        self.threads = 1 # number of files to compress at the same time within a search
+        self.running = {} # search id: (search, result, total bytes) for the searches being compressed by the pool
+        self.finished = Queue() # IDs of the running searches the pool has finished
+        self.waiting = {} # search id: (files, total bytes) for the searches waiting for the I/O budget
+        self.progress = None # progress of the searches the pool is compressing, to be saved by the main process
+        self.progress_saver = None
         self.retry_counts = {"storage":0, "database":0, "filesystem":0}
 
         super().__init__()
 
+    def add_arguments(self, parser):
+        # Optional argument to compress multiple searches at the same time
+        parser.add_argument('-w', '--workers', type=int,
+                            help=f'Number of searches to compress in parallel (Default = {settings.NUM_COMPRESS_WORKERS})')
+        # Optional argument to compress the files of a search with multiple threads
+        parser.add_argument('-t', '--threads', type=int,
+                            help=f'Number of files to compress in parallel within a search (Default = {settings.NUM_DEFLATE_THREADS})')
+
     def handle(self, *args, **options): # pylint: disable=too-many-branches
         signal.signal(signal.SIGINT, self.sig_term)
         signal.signal(signal.SIGTERM, self.sig_term)
 
         self.terminate = False
         self.cur_search = None
+        num_workers = max(int(options['workers']) if options.get('workers') else settings.NUM_COMPRESS_WORKERS, 1)
+        self.threads = max(int(options['threads']) if options.get('threads') else settings.NUM_DEFLATE_THREADS, 1)
 
         # Grab the necessary models
         self.searches = apps.get_model('textassembler_web', 'searches')
+        self.download_formats = apps.get_model('textassembler_web', 'download_formats')
 
-        logging.info("Starting compression processing.")
+        logging.info(f"Starting compression processing with {num_workers} worker(s) and {self.threads} thread(s) per search.")
+        if num_workers > 1:
+            connection.close() # do not share the database connection with the worker processes
+            self.progress = multiprocessing.Queue()
+            self.pool = multiprocessing.Pool(num_workers, initializer=init_progress_worker, initargs=(self.progress,))
+            self.progress_saver = threading.Thread(target=self.save_pool_progress, name="compress-progress")
+            self.progress_saver.start()
+        self.listener = QueueListener(COMPRESS)
+        self.release_claims()
+        idle = False
+        mark = self.listener.mark()
         while not self.terminate:
-            time.sleep(1) # take a quick break!
+            # wait until notified of new work (or a worker finishing) if there was nothing to do,
+            # otherwise take a quick break!
+            self.listener.wait(mark, settings.QUEUE_POLL_SECONDS if idle else 1)
+            mark = self.listener.mark()
+            idle = False
+            if self.terminate:
+                break
             try:
+                # save the searches the workers have finished
+                self.finish_running()
+                if len(self.running) >= num_workers or self.terminate:
+                    idle = True
+                    continue
+
                 (queue, cont) = self.get_queue()
                 if cont or not queue or self.terminate:
+                    idle = True
                     continue
 
                 # verify the storage location is accessibly
@@ -52,34 +98,22 @@ class Command(BaseCommand):
                 if cont or self.terminate:
                     continue
 
-                # get the next item from the queue
+                # get the next items from the queue
                 ## we are doing this again in case the search has been deleted
-                ## while waiting for the API to be available
+                ## while waiting for the storage to be available
                 (queue, cont) = self.get_queue()
-                if cont or not queue or self.terminate:
-                    continue
-                self.cur_search = queue[0]
-
-                # mark the search record as started compression
-                cont = self.set_start_time()
                 if cont or not queue or self.terminate:
                     continue
 
-                cont = self.compress_search()
-                if cont or self.terminate:
-                    continue
-
-                ## save the results to the database
-                (cont, send_email) = self.update_search_with_results()
-                if cont or self.terminate:
-                    continue
-
-                #  send email notification
-                #   sending this after the DB save in case that fails for some reason
-                #   this is to prevent users from receiving multiple notifications
-                if send_email:
-                    send_user_notification(self.cur_search.userid, self.cur_search.query,
-                                           self.cur_search.date_submitted, self.cur_search.num_results_downloaded)
+                # start as many searches as there are free workers, as long as the
+                # searches being compressed at the same time are within the I/O budget
+                for search in queue:
+                    if len(self.running) >= num_workers or self.terminate:
+                        break
+                    self.cur_search = search
+                    brk = self.start_compression()
+                    if brk:
+                        break
 
             except Exception as exp: # pylint: disable=broad-except
                 # This scenario shouldn't happen, but handling it just in case
@@ -90,13 +124,20 @@ class Command(BaseCommand):
                 continue
 
         # any cleanup after terminate
+        if self.pool is not None:
+            self.progress_saver.join()
+            # the searches that were not finished will be compressed again the next time
+            self.pool.terminate()
+            self.pool.join()
+            self.release_claims(list(self.running))
+        self.listener.close()
         logging.info("Stopped compression processing.")
 
     def get_queue(self):
         '''
         Check if there are items in the queueu to process that have
         completed downloading their results and haven't already
-        completed compression.
+        completed compression (or been claimed by a worker).
         Returns:
             queue (list): Items to be processed
             cont (bool): If the loop should continue or not
@@ -105,7 +146,8 @@ class Command(BaseCommand):
         # that have completed downloading results and haven't already completed compression
         try:
             queue = self.searches.objects.filter(
-                date_completed__isnull=False, date_completed_compression__isnull=True, failed_date__isnull=True, deleted=False).order_by('-update_date')
+                date_completed__isnull=False, date_started_compression__isnull=True, date_completed_compression__isnull=True,
+                failed_date__isnull=True, deleted=False).order_by('-update_date')
             self.retry_counts["database"] = 0
             if not queue:
                 return (None, True)
@@ -139,16 +181,39 @@ class Command(BaseCommand):
         self.retry_counts["storage"] = 0
         return False
 
-    def set_start_time(self):
+    def release_claims(self, search_ids=None):
+        '''
+        Release the searches claimed for compression that were not finished, so they
+        will be compressed again. Without search IDs, releases any claims left from
+        the last time the processor was stopped.
+        '''
+        claimed = self.searches.objects.filter(date_started_compression__isnull=False, date_completed_compression__isnull=True)
+        if search_ids is not None:
+            claimed = claimed.filter(search_id__in=search_ids)
+        try:
+            released = claimed.update(date_started_compression=None)
+            if released:
+                logging.info(f"Released {released} search(es) that had not finished compressing.")
+        except OperationalError as ex:
+            logging.warning(f"Failed to release the searches that had not finished compressing. {ex}")
+
+    def claim_search(self, num_files):
         '''
-        Set the start time for the compression to now
+        Set the start time for the compression to now, unless the search was already claimed,
+        and get the formats to produce the results in
+        Params:
+            num_files (int): Number of result files to compress
         Returns:
-            continue (bool): If you need to continue the loop
+            continue (bool): If you need to continue the loop (i.e. the search was not claimed)
         '''
-        self.cur_search.update_date = timezone.now()
-        self.cur_search.date_started_compression = timezone.now()
+        now = timezone.now()
         try:
-            self.cur_search.save()
+            formats = [fmt.format_id.format_name for fmt in self.download_formats.objects.filter(
+                search_id=self.cur_search.search_id).select_related('format_id').order_by('id')]
+            claimed = self.searches.objects.filter(
+                search_id=self.cur_search.search_id, date_started_compression__isnull=True,
+                date_completed_compression__isnull=True, deleted=False).update(
+                    date_started_compression=now, update_date=now, num_files_to_compress=num_files)
         except OperationalError as ex:
             if self.retry_counts["database"] <= settings.NUM_PROCESSOR_RETRIES:
                 logging.error(f"Failed to update the start time in the database.")
@@ -158,50 +223,120 @@ class Command(BaseCommand):
                 log_error(f"Stopping. Failed to set the start time in the database for {self.cur_search.search_id}. {ex}")
                 self.terminate = True
             return True
+        if not claimed:
+            return True
+        self.cur_search.update_date = now
+        self.cur_search.date_started_compression = now
+        self.cur_search.num_files_to_compress = num_files
+        self.cur_search.formats = formats
         return False
 
-    def compress_search(self):
+    def start_compression(self):
         '''
-        Compresses the search results
+        Claim the current search and compress it, or hand it to a worker if there is a pool
         Returns:
-            cont (bool): If the loop should continue
+            brk (bool): If no more searches should be started until a running one finishes
         '''
+        zippath = os.path.join(settings.STORAGE_LOCATION, str(self.cur_search.search_id))
+        zipname = settings.APP_NAME.replace(" ", "") + "_" + self.cur_search.date_submitted.strftime("%Y%m%d_%H%M%S")
         try:
-            # compress the files for the search
-            zippath = os.path.join(settings.STORAGE_LOCATION, str(self.cur_search.search_id))
-            zipname = settings.APP_NAME.replace(" ", "") + "_" + self.cur_search.date_submitted.strftime("%Y%m%d_%H%M%S")
-            logging.info(f"Starting compression of search {self.cur_search.search_id}.")
-            files_to_compress = []
-            for root, dirs, files in os.walk(zippath):
-                for fln in files:
-                    files_to_compress.append(os.path.join(root, fln))
-            with zipfile.ZipFile(os.path.join(zippath, zipname + ".zip"), 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for fln in files_to_compress:
-                    target_name = re.sub(zippath+r'/\d+/\d+/\d+/', '', fln)
-                    logging.info(f"Adding file to zip: {fln}. Target Name: {target_name}")
-                    zipf.write(fln, target_name)
-
-            logging.info(f"Completed compression of search {self.cur_search.search_id}")
-
-            #  remove non-compressed files
-            logging.info(f"Started cleanup of non-compressed files for search {self.cur_search.search_id}")
-            for root, dirs, files in os.walk(zippath):
-                for dirn in dirs:
-                    logging.debug(f"Deleting directory: {os.path.join(root, dirn)}")
-                    shutil.rmtree(os.path.join(root, dirn))
-
-            logging.info(f"Completed cleanup of non-compressed files for search {self.cur_search.search_id}")
-            self.retry_counts["filesystem"] = 0
+            # the files do not change once the search has finished downloading, so a search
+            # waiting for the I/O budget is not walked again each time it is checked
+            (files_to_compress, total_bytes) = self.waiting.pop(self.cur_search.search_id, None) or \
+                get_files_to_compress(zippath)
         except OSError as ex:
-            if self.retry_counts["filesystem"] <= settings.NUM_PROCESSOR_RETRIES:
-                logging.error(f"Failed to compress the search: {self.cur_search.search_id}. {ex}")
-                self.retry_counts["filesystem"] = self.retry_counts["filesystem"] + 1
-            else:
-                log_error(f"Stopping. Failed to compress the search for {self.cur_search.search_id}. {create_error_message(ex, os.path.basename(__file__))}")
-                self.terminate = True
+            self.handle_filesystem_error(ex)
             return True
+
+        # wait for the running searches if this one would go over the I/O budget
+        running_bytes = sum(total for (_, _, total) in self.running.values())
+        if self.running and settings.COMPRESS_IO_BUDGET_MB and \
+                running_bytes + total_bytes > settings.COMPRESS_IO_BUDGET_MB * 1024 * 1024:
+            self.waiting = {self.cur_search.search_id: (files_to_compress, total_bytes)}
+            return True
+
+        if self.claim_search(len(files_to_compress)):
+            return False
+        logging.info(f"Starting compression of search {self.cur_search.search_id} ({len(files_to_compress)} files).")
+
+        progress = partial(save_progress if self.pool is None else send_progress, self.cur_search.search_id)
+        if self.pool is None:
+            try:
+                files = compress_files(zippath, zipname, files_to_compress, self.threads, self.cur_search.archive_format, progress,
+                                       self.cur_search.formats)
+                self.finish_compression(self.cur_search, files=files)
+            except OSError as ex:
+                self.finish_compression(self.cur_search, ex)
+            return False
+
+        search_id = self.cur_search.search_id
+        def on_finished(_):
+            self.finished.put(search_id)
+            self.listener.wake()
+        result = self.pool.apply_async(compress_files, (zippath, zipname, files_to_compress, self.threads,
+                                                        self.cur_search.archive_format, progress, self.cur_search.formats),
+                                       callback=on_finished, error_callback=on_finished)
+        self.running[search_id] = (self.cur_search, result, total_bytes)
         return False
 
+    def finish_running(self):
+        '''
+        Save the results of the searches the workers have finished compressing
+        '''
+        while not self.terminate:
+            try:
+                (search, result, _) = self.running.pop(self.finished.get_nowait())
+            except Empty:
+                break
+            try:
+                # the callback is made just before the result is set, so this may wait for a moment
+                self.finish_compression(search, files=result.get())
+            except OSError as ex:
+                self.finish_compression(search, ex)
+
+    def finish_compression(self, search, error=None, files=None):
+        '''
+        Save the compressed search and notify the user, or release the search to be
+        compressed again if the compression failed
+        Params:
+            files (list): The compressed files created for the search
+        '''
+        self.cur_search = search
+        if error is not None:
+            self.release_claims([search.search_id])
+            self.handle_filesystem_error(error)
+            return
+
+        logging.info(f"Completed compression of search {search.search_id}")
+        search.archive_parts = len(files) if files else 1
+        search.num_files_compressed = search.num_files_to_compress
+        self.retry_counts["filesystem"] = 0
+
+        ## save the results to the database
+        while True:
+            (cont, send_email) = self.update_search_with_results()
+            if not cont or self.terminate:
+                break
+        if cont:
+            return
+
+        #  send email notification
+        #   sending this after the DB save in case that fails for some reason
+        #   this is to prevent users from receiving multiple notifications
+        if send_email:
+            send_user_notification(search.userid, search.query, search.date_submitted, search.num_results_downloaded)
+
+    def handle_filesystem_error(self, ex):
+        '''
+        Handle a failure to compress the current search
+        '''
+        if self.retry_counts["filesystem"] <= settings.NUM_PROCESSOR_RETRIES:
+            logging.error(f"Failed to compress the search: {self.cur_search.search_id}. {ex}")
+            self.retry_counts["filesystem"] = self.retry_counts["filesystem"] + 1
+        else:
+            log_error(f"Stopping. Failed to compress the search for {self.cur_search.search_id}. {create_error_message(ex, os.path.basename(__file__))}")
+            self.terminate = True
+
     def update_search_with_results(self):
         '''
         Save the compression with the final results
@@ -217,7 +352,9 @@ class Command(BaseCommand):
                 send_email = True
             else:
                 send_email = False
-            self.cur_search.save()
+            # only save the compression fields, the search may have been changed while it was compressing
+            self.cur_search.save(update_fields=["update_date", "date_started_compression", "date_completed_compression",
+                                                "user_notified", "archive_parts", "num_files_compressed"])
             self.retry_counts["database"] = 0
             return (False, send_email)
         except OperationalError as ex:
@@ -231,8 +368,56 @@ class Command(BaseCommand):
                 self.terminate = True
             return (True, False)
 
+    def save_pool_progress(self):
+        '''
+        Save the progress sent by the pool workers until the processor is stopped. This runs in
+        its own thread so the progress is saved while the main loop waits for the workers.
+        '''
+        while not self.terminate:
+            try:
+                (search_id, num_compressed, num_files) = self.progress.get(timeout=1)
+            except Empty:
+                continue
+            save_progress(search_id, num_compressed, num_files)
+            # the thread can go a long time between checkpoints, so do not keep the connection open
+            connection.close()
+
     def sig_term(self, _, __):
         '''
         Handle user interuption
         '''
         self.terminate = True
+        if self.listener is not None:
+            self.listener.wake()
+
+
+PROGRESS = None # queue the pool worker sends the progress of its search to the main process through
+
+def init_progress_worker(progress):
+    '''
+    Initialize a compression worker process that sends its progress to the progress queue
+    '''
+    global PROGRESS # pylint: disable=global-statement
+    PROGRESS = progress
+    init_worker()
+
+def send_progress(search_id, num_compressed, num_files):
+    '''
+    Send the number of files compressed for the search at a checkpoint to the main process,
+    which saves it to the database
+    '''
+    PROGRESS.put((search_id, num_compressed, num_files))
+
+def save_progress(search_id, num_compressed, num_files):
+    '''
+    Save the number of files compressed for the search at a checkpoint. A failure only logs
+    a warning since the progress is saved again at the next checkpoint.
+    '''
+    logging.info(f"Compressed {num_compressed} out of {num_files} files for search {search_id}")
+    try:
+        # skip the searches that were finished while the progress was waiting to be saved
+        apps.get_model('textassembler_web', 'searches').objects.filter(
+            search_id=search_id, date_completed_compression__isnull=True).update(
+                num_files_compressed=num_compressed, update_date=timezone.now())
+    except OperationalError as ex:
+        logging.warning(f"Failed to save the compression progress for search {search_id}. {ex}")
@@ -13,7 +13,8 @@ from django.apps import apps
 from django.conf import settings
 from django.utils import timezone
 from django.db.models import Q
-from textassembler_web.utilities import log_error, create_error_message
+from textassembler_web.notifications import QueueListener, DELETE
+from textassembler_web.utilities import log_error, create_error_message, find_archive_files
 
 class Command(BaseCommand):
     '''
@@ -25,6 +26,7 @@ class Command(BaseCommand):
         self.terminate = False
         self.cur_search = None
         self.searches = None
+        self.listener = None
         self.retry_counts = {"storage":0, "database":0, "filesystem":0}
 
         super().__init__()
@@ -43,12 +45,22 @@ class Command(BaseCommand):
         self.searches = apps.get_model('textassembler_web', 'searches')
 
         logging.info(f"Starting deletion processing. Removing searches more than {settings.NUM_MONTHS_KEEP_SEARCHES} months old or marked as deleted")
+        self.listener = QueueListener(DELETE)
+        idle = False
+        mark = self.listener.mark()
         while not self.terminate:
-            time.sleep(1) # take a quick break!
+            # wait until notified of new work if there was nothing to do,
+            # otherwise take a quick break!
+            self.listener.wait(mark, settings.QUEUE_POLL_SECONDS if idle else 1)
+            mark = self.listener.mark()
+            idle = False
+            if self.terminate:
+                break
             try:
                 # check that there are items in the queue to be deleted based on date completed/failed
                 (queue, cont) = self.get_queue()
                 if cont or not queue or self.terminate:
+                    idle = True
                     continue
 
 
@@ -82,6 +94,7 @@ class Command(BaseCommand):
                 continue
 
         # any cleanup after terminate
+        self.listener.close()
         logging.info("Stopped compression processing.")
 
     def get_queue(self):
@@ -134,18 +147,20 @@ class Command(BaseCommand):
         '''
         logging.info(f"Started removal of files for search {self.cur_search.search_id}")
         save_location = os.path.join(settings.STORAGE_LOCATION, str(self.cur_search.search_id))
-        zip_path = find_zip_file(self.cur_search.search_id)
+        archive_files = find_archive_files(self.cur_search.search_id)
 
         if os.path.isdir(save_location):
             try:
                 shutil.rmtree(save_location)
             except OSError as ex1:
                 log_error(f"Could not delete files for search {self.cur_search.search_id}. {ex1}", self.cur_search)
-        if zip_path != None and os.path.exists(zip_path):
+        for archive_file in archive_files:
+            if not os.path.exists(archive_file):
+                continue
             try:
-                os.remove(zip_path)
+                os.remove(archive_file)
             except OSError as ex2:
-                log_error(f"Could not delete the zipped file for search {self.cur_search.search_id}. {ex2}", self.cur_search)
+                log_error(f"Could not delete the compressed file for search {self.cur_search.search_id}. {ex2}", self.cur_search)
         if os.path.isdir(save_location):
             try:
                 os.rmdir(save_location)
@@ -179,14 +194,5 @@ class Command(BaseCommand):
         Handles user termination of the process.
         '''
         self.terminate = True
-
-def find_zip_file(search_id):
-    '''
-    For the given search ID, it will locate the full path for the zip file
-    '''
-    filepath = os.path.join(settings.STORAGE_LOCATION, str(search_id))
-    for root, _, files in os.walk(filepath):
-        for name in files:
-            if name.endswith("zip"):
-                return os.path.join(root, name)
-    return None
+        if self.listener is not None:
+            self.listener.wake()
@@ -6,17 +6,28 @@ import logging
 import signal
 import os
 import json
+import threading
+from queue import Queue, Empty
 from datetime import datetime
-from requests.exceptions import ReadTimeout
-from bs4 import BeautifulSoup # pylint: disable=import-error
+from requests.exceptions import ReadTimeout, ConnectionError as RequestsConnectionError
+from urllib3.exceptions import ReadTimeoutError
 from django.core.management.base import BaseCommand
 from django.apps import apps
 from django.conf import settings
 from django.utils import timezone
-from django.db import OperationalError
+from django.db import OperationalError, connection
 from textassembler_web.ln_api import LNAPI
-from textassembler_web.path_util import get_path
+from textassembler_web.api_log_buffer import API_LOG
+from textassembler_web.path_util import PathAllocator
 from textassembler_web.utilities import log_error, create_error_message, send_user_notification
+from textassembler_web.notifications import QueueListener, notify, DOWNLOAD, COMPRESS
+from textassembler_processor.schedulers import get_scheduler
+from textassembler_processor.page_sizer import PageSizer
+from textassembler_processor.staging import PageStaging
+from textassembler_processor.archive import ArchiveWriter, deflate_files
+from textassembler_processor.segments import SegmentStore
+from textassembler_processor.search_plan import SearchPlan
+from textassembler_processor.formats import RAW_DIR, get_format_files, get_raw_path
 
 class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
     '''
@@ -24,40 +35,97 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
     '''
     help = "Process the search queue downloading results from LexisNexis"
 
-    def __init__(self):
-        self.terminate = False
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else DownloadPool() # state shared with the other download workers
         self.error = False
         self.cur_search = None
         self.retry_counts = {"storage":0, "database":0, "api":0, "auth":0, "filesystem":0}
         self.api = None
-        self.set_formats = None
-        self.set_filters = None
-        self.created_files = [] # track the files that have been created before a DB save occurs
-        self.cur_path = None # the current path being saved to
+        self.plan = None # compiled download request for the current search
+        self.staging = None # stages the files of a page until the search record is saved
+        self.allocator = None # allocates the path to save each result to
+        self.timed_out = False # if the last download call failed due to a timeout
 
         # Grab the necessary models
         self.searches = apps.get_model('textassembler_web', 'searches')
-        self.filters = apps.get_model('textassembler_web', 'filters')
-        self.download_formats = apps.get_model('textassembler_web', 'download_formats')
         self.available_formats = apps.get_model('textassembler_web', 'available_formats')
+        self.page_log = apps.get_model('textassembler_processor', 'download_page_log')
 
         super().__init__()
 
-    def handle(self, *args, **options): # (we need the if-statements to process the continues) pylint: disable=too-many-branches
+    @property
+    def terminate(self):
+        '''
+        If processing should stop. This is shared by all the download workers
+        so that a failure in one of them will stop the service.
+        '''
+        return self.pool.stop_event.is_set()
+
+    @terminate.setter
+    def terminate(self, value):
+        if value:
+            self.pool.stop_event.set()
+        else:
+            self.pool.stop_event.clear()
+
+    def add_arguments(self, parser):
+        # Optional argument to download multiple searches at the same time
+        parser.add_argument('-w', '--workers', type=int,
+                            help=f'Number of searches to download in parallel (Default = {settings.NUM_DOWNLOAD_WORKERS})')
+        # Optional argument to override the scheduler used to pick the next search
+        parser.add_argument('-s', '--scheduler', type=str,
+                            help=f'Scheduler used to pick the next search to download: fifo, fair (Default = {settings.SCHEDULER})')
+
+    def handle(self, *args, **options):
         '''
         Handles the command to process the queue
         '''
         signal.signal(signal.SIGINT, self.sig_term)
         signal.signal(signal.SIGTERM, self.sig_term)
 
+        num_workers = int(options['workers']) if options.get('workers') else settings.NUM_DOWNLOAD_WORKERS
+
+        logging.info(f"Starting queue processing with {max(num_workers, 1)} worker(s) using the {options.get('scheduler') or settings.SCHEDULER} scheduler.")
+        self.pool.listener = QueueListener(DOWNLOAD)
+        self.pool.scheduler = get_scheduler(options.get('scheduler'))
+        if num_workers <= 1:
+            self.process_queue()
+        else:
+            # Each worker gets its own command instance to track the search it is working on,
+            # but they all share the same pool so they do not pick up the same search or go
+            # over the download limits together
+            threads = []
+            for i in range(num_workers):
+                worker = Command(pool=self.pool)
+                threads.append(threading.Thread(target=worker.process_queue, name=f"download-worker-{i + 1}"))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.pool.listener.close()
+        API_LOG.flush()
+        logging.info("Stopped queue processing.")
 
-        logging.info("Starting queue processing.")
+    def process_queue(self): # (we need the if-statements to process the continues) pylint: disable=too-many-branches, too-many-statements
+        '''
+        Download results for the searches in the queue until terminated
+        '''
         self.api = LNAPI()
+        idle = False
+        mark = self.pool.listener.mark()
         while not self.terminate:
-            time.sleep(1) # take a quick break to free up CPU usage
+            # wait until a search is queued if there was nothing to do,
+            # otherwise take a quick break to free up CPU usage
+            self.pool.listener.wait(mark, settings.QUEUE_POLL_SECONDS if idle else 1)
+            mark = self.pool.listener.mark()
+            idle = False
+            if self.terminate:
+                break
+            self.cur_search = None
             try:
                 (queue, cont) = self.get_queue()
                 if cont or not queue:
+                    idle = True
                     continue
 
                 # verify the storage location is accessibly
@@ -75,51 +143,32 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
                 if self.terminate:
                     continue
 
-                # continue loop if there are no downloads remaining
-                #   (this could happen if some other search sneaks in on the UI
-                #   before this process wakes)
-                if self.api.check_when_available('download') > timezone.now():
-                    continue
-
                 # get the next item from the queue
                 ## we are doing this again in case the search has been deleted
                 ## while waiting for the API to be available
                 (queue, cont) = self.get_queue()
                 if cont or not queue:
                     continue
-                self.cur_search = queue[0]
+                ## skip any searches another worker is already downloading
+                self.cur_search = self.pool.lease(queue)
+                if self.cur_search is None:
+                    idle = True
+                    continue
 
                 logging.info(f"Downloading items for search: {self.cur_search.search_id}. Skip Value: {self.cur_search.skip_value}.")
 
                 # check if this is a new search and set the start time
                 cont = self.set_start_time()
-                if cont or not queue:
-                    continue
-
-                # download next 10 items for the current search
-                start_time = time.time()
-                ## retrieve relavent search fields
-                self.set_search_filters()
-
-                ## call the download function with the parameters
-                (results, cont) = self.get_next_results()
                 if cont:
                     continue
 
-                if "error_message" in results:
-                    cont = self.handle_results_error(results)
-                    if cont:
-                        continue
+                ## retrieve relavent search fields
+                self.plan = self.pool.get_search_plan(self.cur_search)
 
-                ## save the results to the server
-                (cont, brk) = self.save_results(results)
+                # download the next pages for the current search
+                brk = self.download_pages()
                 if brk:
                     break
-                if cont:
-                    continue
-
-                ## save the results to the database
-                self.update_search_with_results(results, start_time)
 
             except Exception as exp: # pylint: disable=broad-except
                 # This scenario shouldn't happen, but handling it just in case
@@ -128,21 +177,222 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
                            f"(search id={'N/A' if self.cur_search is None else self.cur_search.search_id}.",
                            f" {create_error_message(exp, os.path.basename(__file__))}"))
                 self.terminate = True # stop the service since something is horribly wrong
+            finally:
+                self.pool.release(self.cur_search)
 
         # any cleanup after terminate
-        remove_files(self.created_files, "After terminate flag is processed.") # remove any created files since the error since the DB will not reflect these
-        logging.info("Stopped queue processing.")
+        connection.close() # each worker thread has its own database connection
 
     def sig_term(self, _, __):
         '''
         Handles command termination
         '''
         self.terminate = True
+        if self.pool.listener is not None:
+            self.pool.listener.wake() # stop waiting for new searches
+
+    def download_pages(self): # pylint: disable=too-many-branches
+        '''
+        Download the next pages of results for the current search. The results are
+        fetched from the API in a separate thread and handed over one at a time as they
+        are read from the response, so the next results are being downloaded while the
+        previous ones are saved, with at most DOWNLOAD_PIPELINE_RESULTS results waiting.
+        Returns:
+            brk (bool): If the loop should break
+        '''
+        base_path = os.path.join(settings.STORAGE_LOCATION, str(self.cur_search.search_id))
+        # add the results to the zip file as they are saved if the search was started that way
+        archive = None
+        if ArchiveWriter.exists(base_path) or \
+                (settings.INCREMENTAL_ZIP and self.cur_search.skip_value == 0 and self.cur_search.archive_format != "tar.zst"):
+            archive = ArchiveWriter(base_path, 0 if self.cur_search.archive_format == "zip_store" else settings.ZIP_COMPRESS_LEVEL,
+                                    settings.ARCHIVE_VOLUME_MB * 1024 * 1024)
+        # otherwise save the documents to segments, unless the search was started with a file per result
+        segments = None
+        if archive is None and (SegmentStore.exists(base_path) or self.cur_search.skip_value == 0):
+            segments = SegmentStore(base_path, settings.SEGMENT_MB * 1024 * 1024)
+        self.staging = PageStaging(base_path, archive, segments)
+        try:
+            # finish or undo any page left from a previous run before adding to the search
+            self.staging.recover(self.cur_search.skip_value)
+        except OSError as ex:
+            self.handle_filesystem_error(ex)
+            self.staging.close()
+            return False
+
+        pages = Queue(maxsize=max(settings.DOWNLOAD_PIPELINE_RESULTS, 1))
+        stop_fetching = threading.Event()
+        fetcher = threading.Thread(target=self.fetch_pages, args=(pages, stop_fetching),
+                                   name=f"{threading.current_thread().name}-fetch")
+        fetcher.start()
+
+        brk = False
+        last_saved = 0
+        try:
+            # continue saving results where the search left off
+            self.allocator = PathAllocator(base_path, self.cur_search.last_save_dir, self.cur_search.last_save_dir_count,
+                                           [RAW_DIR])
+
+            while True:
+                item = pages.get()
+                if item is None:
+                    break # no more pages were fetched
+                (item_type, value) = item
+
+                if item_type == "result":
+                    ## save the result to the server
+                    (cont, brk) = self.save_result(value)
+                    if brk or cont:
+                        break
+
+                elif item_type == "page":
+                    ## save the results of the page to the database
+                    ### only count the time since the previous page was saved since the fetches overlap
+                    (results, start_time) = value
+                    cont = self.update_search_with_results(results, max(start_time, last_saved))
+                    last_saved = time.time()
+                    if cont or self.cur_search.date_completed is not None:
+                        break
+
+                elif item_type == "error":
+                    self.handle_results_error(value)
+                    break
+
+                else:
+                    break # the page could not be read completely
+        finally:
+            # stop the fetcher and discard any results it fetched that will not be saved,
+            # they will be downloaded again the next time the search is picked up
+            stop_fetching.set()
+            while fetcher.is_alive():
+                try:
+                    pages.get(timeout=0.1)
+                except Empty:
+                    pass
+            fetcher.join()
+
+            # remove the files from a page that was not finished since the DB will not reflect these
+            self.staging.abort()
+            self.staging.close()
+        return brk
+
+    def fetch_pages(self, pages, stop_fetching):
+        '''
+        Fetch pages of results for the current search from the API, adding each result
+        to the pages queue to be saved followed by the page itself once it has been read.
+        Stops after DOWNLOAD_PAGES_PER_LEASE pages so other searches get a turn, when the
+        search has no more results, or when there are no downloads remaining.
+        '''
+        skip = self.cur_search.skip_value
+        num_results_in_search = None
+        try:
+            sizer = self.pool.get_page_sizer(self.cur_search)
+            for _ in range(max(settings.DOWNLOAD_PAGES_PER_LEASE, 1)):
+                if stop_fetching.is_set() or self.terminate:
+                    break
+                if num_results_in_search is not None and skip >= num_results_in_search:
+                    break
+
+                # stop if there are no downloads remaining
+                #   (this could happen if some other search sneaks in on the UI
+                #   or another worker used the last download before this process wakes)
+                if not self.api.reserve('download'):
+                    break
+
+                ## use the count from the search record until the API has returned one
+                total = num_results_in_search if num_results_in_search is not None else self.cur_search.num_results_in_search
+                page_size = sizer.get_page_size(max(total - skip, 0) if total else None, self.api.calls_remaining('download'))
+                start_time = time.time()
+                (results, cont) = self.get_next_results(skip, page_size)
+                if cont:
+                    if self.timed_out:
+                        sizer.record_timeout(page_size)
+                        self.log_page(sizer, skip, page_size, time.time() - start_time)
+                    break
+                self.pool.scheduler.record(self.cur_search)
+
+                if "error_message" in results:
+                    pages.put(("error", results))
+                    break
+
+                (cont, wait_seconds) = self.read_results(results, pages, stop_fetching)
+                # do not count the time spent waiting on the results to be saved
+                seconds = time.time() - start_time - wait_seconds
+                if cont:
+                    if self.timed_out:
+                        sizer.record_timeout(page_size)
+                        self.log_page(sizer, skip, page_size, seconds, results)
+                    pages.put(("incomplete", None))
+                    break
+                sizer.record_page(page_size, results.num_results, seconds, results.num_bytes)
+                self.log_page(sizer, skip, page_size, seconds, results)
+
+                pages.put(("page", (results, start_time)))
+                num_results_in_search = results['@odata.count']
+                if not results.num_results:
+                    break # there are no more results
+                # the API may return fewer results than were asked for
+                skip = skip + results.num_results
+        except Exception as exp: # pylint: disable=broad-except
+            log_error((f"An unexpected error occurred while fetching results ",
+                       f"(search id={self.cur_search.search_id}.",
+                       f" {create_error_message(exp, os.path.basename(__file__))}"))
+            self.terminate = True # stop the service since something is horribly wrong
+        finally:
+            pages.put(None)
+            connection.close() # the fetcher thread has its own database connection
+
+    def read_results(self, results, pages, stop_fetching):
+        '''
+        Read the results from the response, adding each one to the pages queue as soon as it is decoded
+        Returns:
+            cont (bool): If the page could not be read completely
+            wait_seconds (float): Time spent waiting for room in the pages queue
+        '''
+        wait_seconds = 0
+        try:
+            for result in results:
+                if stop_fetching.is_set() or self.terminate:
+                    break
+                put_time = time.time()
+                pages.put(("result", result))
+                wait_seconds = wait_seconds + time.time() - put_time
+            if not results.complete:
+                return (True, wait_seconds)
+            if "@odata.count" not in results:
+                raise ValueError("The response did not include the @odata.count.")
+            self.retry_counts["api"] = 0
+            return (False, wait_seconds)
+        except Exception as exp: # pylint: disable=broad-except
+            self.handle_download_exception(exp)
+        return (True, wait_seconds)
+
+    def log_page(self, sizer, skip, page_size, seconds, results=None): # pylint: disable=too-many-arguments
+        '''
+        Record the page size used for a download call and the page size picked from it.
+        The log is only used to diagnose the page sizes, so the download continues if it can not be saved.
+        '''
+        try:
+            self.page_log.objects.create(
+                search_id=self.cur_search,
+                skip_value=skip,
+                page_size=page_size,
+                num_results=results.num_results if results is not None and results.complete else None,
+                response_seconds=round(seconds, 3),
+                response_bytes=results.num_bytes if results is not None else None,
+                timed_out=self.timed_out,
+                next_page_size=sizer.page_size,
+                reason=sizer.reason)
+        except OperationalError as ex:
+            logging.warning(f"Unable to save the page log for search {self.cur_search.search_id}. {ex}")
+            connection.close() # reconnect for the next query in case the connection was lost
 
     def update_search_with_results(self, results, start_time):
         '''
         If there were no errors, update the search in the database
         with the run results for that set of downloads.
+        Returns:
+            cont (bool): If no more results should be saved for the search
         '''
         try:
             if not self.error:
@@ -151,25 +401,35 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
                 # step if the termination was due to a failure
 
                 ## update the search in the database
-                logging.info(f"Finished saving next {settings.LN_DOWNLOAD_PER_CALL} results for search: {self.cur_search.search_id}")
-                self.cur_search.skip_value = self.cur_search.skip_value + settings.LN_DOWNLOAD_PER_CALL
+                logging.info(f"Finished saving next {results.num_results} results for search: {self.cur_search.search_id}")
+                ## continue after the results that were returned, which may be fewer than were asked for
+                self.cur_search.skip_value = self.cur_search.skip_value + results.num_results
                 self.cur_search.update_date = timezone.now()
                 self.cur_search.run_time_seconds = self.cur_search.run_time_seconds + int(round(time.time() - start_time, 0))
                 self.cur_search.num_results_in_search = results['@odata.count']
-                self.cur_search.num_results_downloaded = self.cur_search.num_results_downloaded + len(results["value"])
-                ## check if the search is complete
-                if self.cur_search.num_results_downloaded >= self.cur_search.num_results_in_search:
+                self.cur_search.num_results_downloaded = self.cur_search.num_results_downloaded + results.num_results
+                ## check if the search is complete (an empty page means there are no more results)
+                if self.cur_search.num_results_downloaded >= self.cur_search.num_results_in_search or not results.num_results:
                     logging.info(f"Completed downloading all results for search: {self.cur_search.search_id}")
                     self.cur_search.date_completed = timezone.now()
+                    self.pool.forget(self.cur_search)
 
-                ## save the search record
+                ## move the files into place, then save the search record
+                self.staging.prepare(self.cur_search.skip_value)
                 self.cur_search.save()
+                self.staging.commit()
+                if self.cur_search.date_completed is not None:
+                    notify(COMPRESS) # let the compression processor know it has work
 
-                self.created_files = []
                 self.retry_counts["database"] = 0
+                self.retry_counts["filesystem"] = 0
+            return self.error
+        except OSError as ex:
+            self.handle_filesystem_error(ex)
+            return True
         except OperationalError as ex:
-            # remove any created files since the error since the DB will not reflect these
-            remove_files(self.created_files, "After OperationalErrorr updating the search record in the DB.")
+            # the page will be committed or rolled back the next time the search is picked up,
+            # depending on if the search record was saved
             if self.retry_counts["database"] <= settings.NUM_PROCESSOR_RETRIES:
                 time.sleep(settings.DB_WAIT_TIME) # wait and re-try (giving this more time in case db server is being rebooted)
                 self.retry_counts["database"] = self.retry_counts["database"] + 1
@@ -178,94 +438,70 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
                            f"(search id={'N/A' if self.cur_search is None else self.cur_search.search_id}.",
                            f" {create_error_message(ex, os.path.basename(__file__))}"))
                 self.terminate = True
+            return True
 
-    def save_results(self, results):
+    def save_result(self, result):
         '''
-        Save the results to the server
+        Save a result to the server
         Return:
             cont (bool): If the loop should continue
             brk (bool): If the loop should break
         '''
-        # remove any created files since the error since the DB will not reflect these
-        remove_files(self.created_files, "Before saving next batch of files")
-
-        for result in results["value"]:
-            # Set the path to save the result in
-            base_path = os.path.join(settings.STORAGE_LOCATION, str(self.cur_search.search_id))
-            if self.cur_search.last_save_dir:
-                base_path = os.path.join(base_path, self.cur_search.last_save_dir)
-            save_location = get_path(base_path)
-
-            if self.terminate:
-                return (False, True)
+        if self.terminate:
+            return (False, True)
 
-            if "Document" not in result or "Content" not in result["Document"] or "ResultId" not in result:
-                log_error(f"WARNING: Could not parse result value from search for ID: {self.cur_search.search_id}.", json.dumps(result))
-                return (True, False)
+        if "Document" not in result or "Content" not in result["Document"] or "ResultId" not in result:
+            log_error(f"WARNING: Could not parse result value from search for ID: {self.cur_search.search_id}.", json.dumps(result))
+            return (True, False)
 
-            full_text = result["Document"]["Content"]
-            file_name = result["ResultId"].replace("urn:contentItem:", "")
-            unique_timestamp = datetime.now().strftime('%d%H%M%S%f')
-            file_name = f"{unique_timestamp}_{file_name}"
-            try:
-                for fmt in self.set_formats:
-                    save_path = os.path.join(save_location, fmt.format_id.format_name)
-                    if not os.path.exists(save_path):
-                        os.makedirs(save_path)
-                    if fmt.format_id.format_name == "HTML":
-                        self.save_html(save_path, file_name, full_text)
-                    elif fmt.format_id.format_name == "TXT":
-                        self.save_txt(save_path, file_name, full_text)
-                    elif fmt.format_id.format_name == "TXT Only":
-                        self.save_txt_only(save_path, file_name, full_text)
-                self.cur_search.last_save_dir = save_location.replace(base_path + "/", "") # only save the relative path
-                self.retry_counts["filesystem"] = 0
-            except OSError as ex:
-                if self.retry_counts["filesystem"] <= settings.NUM_PROCESSOR_RETRIES:
-                    logging.error((f"Failed to save downloaded results to the server for search {self.cur_search.search_id}. ",
-                                   f"{create_error_message(ex, os.path.basename(__file__))}"))
-                    self.retry_counts["filesystem"] = self.retry_counts["filesystem"] + 1
-                else:
-                    self.terminate = True
-                    self.error = True
-                # remove any created files since the error since the DB will not reflect these
-                remove_files(self.created_files, "After OSError saving the files.")
-                return (True, False)
+        full_text = result["Document"]["Content"]
+        file_name = result["ResultId"].replace("urn:contentItem:", "")
+        unique_timestamp = datetime.now().strftime('%d%H%M%S%f')
+        file_name = f"{unique_timestamp}_{file_name}"
+        try:
+            if self.staging.archive is not None:
+                self.add_to_archive(file_name, full_text)
+            elif self.staging.segments is not None:
+                self.staging.segments.add(result["ResultId"], file_name, full_text)
+            else:
+                self.save_raw(self.allocator.next_path(), file_name, full_text)
+            self.cur_search.last_save_dir = self.allocator.last_save_dir # only save the relative path
+            self.cur_search.last_save_dir_count = self.allocator.file_count
+            self.retry_counts["filesystem"] = 0
+        except OSError as ex:
+            self.handle_filesystem_error(ex)
+            # remove any created files since the error since the DB will not reflect these
+            self.staging.abort()
+            return (True, False)
         return (False, False)
 
-    def save_html(self, save_path, file_name, full_text):
+    def handle_filesystem_error(self, ex):
         '''
-        Save the full_text as an HTML
+        Handle a failure to write the results to the server, stopping the processor if it continues to fail
         '''
-        file_path = os.path.join(save_path, file_name + ".html")
-        with open(file_path, 'w') as flh:
-            flh.write(full_text)
-            self.created_files.append(file_path)
-
-    def save_txt(self, save_path, file_name, full_text):
+        if self.retry_counts["filesystem"] <= settings.NUM_PROCESSOR_RETRIES:
+            logging.error((f"Failed to save downloaded results to the server for search {self.cur_search.search_id}. ",
+                           f"{create_error_message(ex, os.path.basename(__file__))}"))
+            self.retry_counts["filesystem"] = self.retry_counts["filesystem"] + 1
+        else:
+            self.terminate = True
+            self.error = True
+
+    def save_raw(self, save_location, file_name, full_text):
         '''
-        Save the full_text as a txt
+        Stage the document for the result until the page is saved. It is saved once, and the
+        formats requested for the search are produced from it when the search is compressed.
         '''
-        file_path = os.path.join(save_path, file_name + ".txt")
-        with open(file_path, 'w') as flh:
+        with open(self.staging.stage(get_raw_path(save_location, file_name), self.cur_search.skip_value), 'w') as flh:
             flh.write(full_text)
-            self.created_files.append(file_path)
 
-    def save_txt_only(self, save_path, file_name, full_text):
+    def add_to_archive(self, file_name, full_text):
         '''
-        Convert the full_text to strip html characters and save as a txt
+        Add the result to the zip file for the search in each of the formats requested
         '''
-        try:
-            cleaned_full_text = remove_html(full_text)
-        except Exception as exp: # pylint: disable=broad-except
-            log_error((f"Unable to create TXT Only output for search {self.cur_search.search_id}, "
-                       f"filename {file_name}. Error. {create_error_message(exp, os.path.basename(__file__))}"))
-            cleaned_full_text = full_text ## write the original text to the file instead
-
-        file_path = os.path.join(save_path, file_name + ".txt")
-        with open(file_path, 'w') as flh:
-            flh.write(cleaned_full_text)
-            self.created_files.append(file_path)
+        files = [(name, text.encode("utf-8")) for (name, text) in get_format_files(file_name, full_text, self.plan.formats)]
+        for (name, compressed, crc, size) in deflate_files(files, self.staging.archive.level):
+            self.staging.archive.add_compressed(name, compressed, crc, size)
 
     def handle_results_error(self, results):
         '''
@@ -316,20 +552,29 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
             send_user_notification(self.cur_search.userid, self.cur_search.query, self.cur_search.date_submitted, 0, True)
         return True
 
-    def get_next_results(self):
+    def get_next_results(self, skip, page_size):
         '''
-        Get the next set of results from the API
+        Get the page of page_size results from the API starting at the skip value
         Returns:
-            results (list): Results from the API for the cur_search
+            results (ResultStream): Results from the API for the cur_search, read as they are iterated
             cont (bool): If the loop should continue
         '''
+        self.timed_out = False
         try:
-            results = self.api.download(self.cur_search.query, \
-                self.set_filters, "" if self.cur_search.sort_order is None else self.cur_search.sort_order.sort_value, settings.LN_DOWNLOAD_PER_CALL, \
-                self.cur_search.skip_value)
-            self.retry_counts["api"] = 0
+            results = self.api.download_page(self.plan.params, page_size, skip, stream=True, reserved=True)
+            if "error_message" in results:
+                self.retry_counts["api"] = 0
             return (results, False)
-        except ReadTimeout as rte:
+        except Exception as exp: # pylint: disable=broad-except
+            self.handle_download_exception(exp)
+        return (None, True) # not adding to retry count since it wasn't a problem with the search
+
+    def handle_download_exception(self, exp):
+        '''
+        Handle a failure to download results from the API, stopping the processor if it continues to fail
+        '''
+        self.timed_out = is_timeout(exp)
+        if self.timed_out:
             if self.retry_counts["api"] <= settings.NUM_PROCESSOR_RETRIES:
                 logging.error((f"Failed to download the results from the API due to a ReadTimeout.",
                                f"If this continues, consider raising the TIMEOUT_SECONDS ",
@@ -339,11 +584,10 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
             else:
                 log_error((f"Stopping processing. Failed {self.retry_counts['api']} attempt(s) to downloaded ",
                            f"results from the API for search {self.cur_search.search_id} due to API timeout. ",
-                           f"{create_error_message(rte, os.path.basename(__file__))}"))
+                           f"{create_error_message(exp, os.path.basename(__file__))}"))
                 self.error = True
                 self.terminate = True
-            self.retry_counts["api"] = self.retry_counts["api"] + 1
-        except Exception as exp: # pylint: disable=broad-except
+        else:
             if self.retry_counts["api"] <= settings.NUM_PROCESSOR_RETRIES:
                 logging.error((f"Failed to downloaded results from the API ",
                                f"for {self.cur_search.search_id}. ",
@@ -356,23 +600,27 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
                            f"{create_error_message(exp, os.path.basename(__file__))}"))
                 self.error = True
                 self.terminate = True
-            self.retry_counts["api"] = self.retry_counts["api"] + 1
-        return (None, True) # not adding to retry count since it wasn't a problem with the search
+        self.retry_counts["api"] = self.retry_counts["api"] + 1
 
     def wait_for_download(self):
         '''
-        Will wait for an open download window before returning, checking periodically
+        Will wait for an open download window before returning
         '''
 
         avail_time = self.api.check_when_available('download')
         if avail_time > timezone.now():
             logging.info(f"No downloads remaining. Must wait until {avail_time.strftime('%c')} until next available download window is available.")
-            # Check if we can download every 10 seconds instead of waiting the full wait_time to
-            # be able to handle sig_term triggering (i.e. we don't want to sleep for an hour before
-            # a kill command is processed)
-            while self.api.check_when_available('download') > timezone.now() and not self.terminate:
+            # Sleep until exactly when the run window opens or the limits reset, waking up
+            # right away if the processor is stopped. The time is planned again after waking
+            # in case another process used the downloads in the meantime, and at least every
+            # QUEUE_POLL_SECONDS so the database connection is not dropped for being idle.
+            while not self.terminate:
                 try:
-                    time.sleep(10)
+                    avail_time = self.api.check_when_available('download')
+                    seconds = (avail_time - timezone.now()).total_seconds()
+                    if seconds <= 0:
+                        break
+                    self.pool.stop_event.wait(min(seconds, settings.QUEUE_POLL_SECONDS))
                     self.retry_counts["database"] = 0
                 except OperationalError as ex:
                     if self.retry_counts["database"] <= settings.NUM_PROCESSOR_RETRIES:
@@ -473,60 +721,84 @@ class Command(BaseCommand): # pylint: disable=too-many-instance-attributes
             return True
         return False
 
-    def set_search_filters(self):
-        '''
-        Set the filters for the search to use in the API call
-        '''
-        all_filters = self.filters.objects.filter(search_id=self.cur_search)
-        self.set_formats = self.download_formats.objects.filter(search_id=self.cur_search)
-        self.set_filters = {}
-        for fltr in all_filters:
-            if fltr.filter_name not in self.set_filters:
-                self.set_filters[fltr.filter_name] = []
-            self.set_filters[fltr.filter_name].append(fltr.filter_value)
-
 
-def remove_html(text):
+class DownloadPool:
     '''
-    Strip HTML from a given text
+    State shared between the download workers: the stop flag, the scheduler, and the
+    searches each worker is currently downloading. The download calls are shared
+    through the rate limiter of the API.
     '''
-    output = []
 
-    bsp = BeautifulSoup(text, "html.parser")
-
-    headline = bsp.h1.string if bsp.h1 is not None and bsp.h1.string is not None else ""
-    # check another place for headline
-    if not headline:
-        headline = bsp.find('nitf:hedline').text if bsp.find('nitf:hedline') is not None else ""
-
-    title = bsp.title.string if bsp.title is not None and bsp.title.string is not None else ""
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.listener = None # notifications of new searches being queued
+        self.scheduler = None # picks which search to download next
+        self.lock = threading.Lock()
+        self.leased = set()
+        self.page_sizers = {} # page size for each search, by search id
+        self.plans = {} # compiled download request for each search, by search id
+
+    def lease(self, queue):
+        '''
+        Claim the next search, in the order given by the scheduler, that no other worker is downloading
+        Returns:
+            search (searches): The claimed search, None if all are claimed
+        '''
+        with self.lock:
+            for search in self.scheduler.order(queue):
+                if search.search_id not in self.leased:
+                    self.leased.add(search.search_id)
+                    return search
+        return None
+
+    def release(self, search):
+        '''
+        Allow other workers to pick up the search again
+        '''
+        if search is None:
+            return
+        with self.lock:
+            self.leased.discard(search.search_id)
 
-    # write the title and headline
-    output.append(title)
-    if title != headline: # prevent duplicate output to file
-        output.append(headline)
+    def get_search_plan(self, search):
+        '''
+        Get the compiled download request for the search, building it again only if the search changed
+        '''
+        with self.lock:
+            plan = self.plans.get(search.search_id)
+        if plan is None or not plan.is_current(search):
+            plan = SearchPlan(search)
+            with self.lock:
+                self.plans[search.search_id] = plan
+        return plan
+
+    def forget(self, search):
+        '''
+        Remove the state kept for a search once it has been downloaded
+        '''
+        with self.lock:
+            self.page_sizers.pop(search.search_id, None)
+            self.plans.pop(search.search_id, None)
 
-    text = bsp.find('nitf:body').text if bsp.find('nitf:body') is not None else ""
-    output.append(text)
-    full_output = "\n\n".join(output)
+    def get_page_sizer(self, search):
+        '''
+        Get the page sizer for the search, starting from the last page size used for it
+        '''
+        with self.lock:
+            if search.search_id in self.page_sizers:
+                return self.page_sizers[search.search_id]
+        last_page = apps.get_model('textassembler_processor', 'download_page_log').objects \
+            .filter(search_id=search.search_id).order_by('-log_id').first()
+        with self.lock:
+            return self.page_sizers.setdefault(search.search_id,
+                                               PageSizer(None if last_page is None else last_page.next_page_size))
 
-    return full_output
 
-def remove_files(files_to_remove=None, message=""):
+def is_timeout(exp):
     '''
-    Removes the list of files from the filesystem
-    Params:
-        files_to_remove (array): list of full filepaths to delete
-        message (string): message to print before removing files
+    Check if the exception is from the API taking too long to respond, either
+    before the response started or while it was being read
     '''
-    if not files_to_remove:
-        return # nothing to remove
-
-    logging.warning(f"Removing {len(files_to_remove)} from the server. {message}")
-    for file_to_remove in files_to_remove:
-        if os.path.isfile(file_to_remove):
-            logging.warning(f"Deleting {file_to_remove}.")
-            try:
-                os.remove(file_to_remove)
-            except OSError as ose:
-                log_error(f"Failed to delete {file_to_remove} from the server. {create_error_message(ose, os.path.basename(__file__))}")
+    if isinstance(exp, ReadTimeout):
+        return True
+    return isinstance(exp, RequestsConnectionError) and bool(exp.args) and isinstance(exp.args[0], ReadTimeoutError)
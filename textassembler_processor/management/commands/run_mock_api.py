@@ -0,0 +1,91 @@
+'''
+Run the local stand-in for the LexisNexis API
+'''
+import logging
+import signal
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from textassembler_processor.mock_api import MockAPIServer
+
+class Command(BaseCommand):
+    '''
+    Serve the mock LexisNexis API until stopped
+    '''
+    help = "Run a local stand-in for the LexisNexis API with synthetic results"
+
+    def __init__(self):
+        self.stopped = threading.Event()
+        super().__init__()
+
+    def add_arguments(self, parser):
+        add_mock_arguments(parser)
+        parser.add_argument('--host', type=str, default="127.0.0.1", help='Host to listen on (Default = 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=8089, help='Port to listen on (Default = 8089)')
+
+    def handle(self, *args, **options):
+        signal.signal(signal.SIGINT, self.sig_term)
+        signal.signal(signal.SIGTERM, self.sig_term)
+
+        server = MockAPIServer((options['host'], options['port']), **get_mock_options(options)).start()
+        logging.info(f"Mock LexisNexis API listening on {server.url}")
+        self.stdout.write((f"Set TOKEN_URL = {server.url}/oauth/v2/token and API_URL = {server.url}/v1/ "
+                           f"in the [lexisnexis] section of the configuration to use it."))
+        self.stopped.wait()
+        server.stop()
+        logging.info("Stopped the mock LexisNexis API.")
+
+    def sig_term(self, _, __):
+        '''
+        Handle user interuption
+        '''
+        self.stopped.set()
+
+
+def add_mock_arguments(parser):
+    '''
+    Add the arguments for the behavior of the mock server to the parser
+    '''
+    parser.add_argument('--results', type=int, default=1000, help='Results in every search (Default = 1000)')
+    parser.add_argument('--paragraphs', type=int, default=20, help='Average paragraphs per document (Default = 20)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds before every response (Default = 0.05)')
+    parser.add_argument('--latency-per-result', type=float, default=0.002,
+                        help='Additional seconds per document downloaded (Default = 0.002)')
+    parser.add_argument('--error-rate-429', type=float, default=0.0, help='Fraction of calls that return a 429 (Default = 0)')
+    parser.add_argument('--error-rate-5xx', type=float, default=0.0, help='Fraction of calls that return a 5xx error (Default = 0)')
+    parser.add_argument('--timeout-rate', type=float, default=0.0,
+                        help='Fraction of calls that do not respond for --timeout-seconds (Default = 0)')
+    parser.add_argument('--timeout-seconds', type=int, default=120,
+                        help='Seconds a timed out call takes to respond (Default = 120)')
+    parser.add_argument('--download-limits', type=str, default="100/1500/12000",
+                        help='Downloads allowed per minute/hour/day (Default = 100/1500/12000)')
+    parser.add_argument('--search-limits', type=str, default="100/1500/12000",
+                        help='Searches allowed per minute/hour/day (Default = 100/1500/12000)')
+    parser.add_argument('--seed', type=int, help='Seed for the injected failures')
+
+def get_mock_options(options):
+    '''
+    Get the options for MockAPIServer from the parsed arguments
+    '''
+    return {
+        "results": options['results'],
+        "paragraphs": options['paragraphs'],
+        "latency": options['latency'],
+        "latency_per_result": options['latency_per_result'],
+        "error_rate_429": options['error_rate_429'],
+        "error_rate_5xx": options['error_rate_5xx'],
+        "timeout_rate": options['timeout_rate'],
+        "timeout_seconds": options['timeout_seconds'],
+        "seed": options['seed'],
+        "limits": {"search": parse_limits(options['search_limits']),
+                   "download": parse_limits(options['download_limits']),
+                   "sources": (10, 100, 1000)},
+    }
+
+def parse_limits(value):
+    '''
+    Parse limits given as minute/hour/day
+    '''
+    limits = tuple(int(limit) for limit in value.split("/"))
+    if len(limits) != 3:
+        raise CommandError(f"Limits must be given as minute/hour/day: {value}")
+    return limits
@@ -4,6 +4,7 @@ Update the searchable sources available in the interface
 import time
 import logging
 from django.utils import timezone
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.apps import apps
 from django.db import transaction
@@ -96,9 +97,9 @@ class Command(BaseCommand):
         avail_time = self.api.check_when_available('sources')
         if avail_time > timezone.now():
             logging.info(f"No sources calls remaining. Must wait until {avail_time.strftime('%c')} until next available call is available.")
-            # Check if we can download every 10 seconds instead of waiting the full wait_time to
-            # be able to handle sig_term triggering (i.e. we don't want to sleep for an hour before
-            # a kill command is processed)
-            while self.api.check_when_available('sources') > timezone.now():
-                time.sleep(10)
+            # Sleep until the limits reset, checking again at least every LIMITS_SYNC_SECONDS
+            # in case another process changed them
+            while avail_time > timezone.now():
+                time.sleep(min((avail_time - timezone.now()).total_seconds(), settings.LN_LIMITS_SYNC_SECONDS))
+                avail_time = self.api.check_when_available('sources')
             logging.info("Resuming processing")
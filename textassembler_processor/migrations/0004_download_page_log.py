@@ -0,0 +1,31 @@
+# Generated by Django 2.2.9 on 2026-10-17 19:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_web', '0020_searches_last_save_dir_count'),
+        ('textassembler_processor', '0003_delete_limits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='download_page_log',
+            fields=[
+                ('log_id', models.AutoField(primary_key=True, serialize=False)),
+                ('skip_value', models.IntegerField()),
+                ('page_size', models.IntegerField()),
+                ('num_results', models.IntegerField(null=True)),
+                ('response_seconds', models.FloatField()),
+                ('response_bytes', models.BigIntegerField(null=True)),
+                ('timed_out', models.BooleanField(default=False)),
+                ('next_page_size', models.IntegerField()),
+                ('reason', models.CharField(max_length=50)),
+                ('request_date', models.DateTimeField(auto_now=True)),
+                ('search_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='textassembler_web.searches')),
+            ],
+        ),
+    ]
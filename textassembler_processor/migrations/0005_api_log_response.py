@@ -0,0 +1,29 @@
+# Generated by Django 2.2.9 on 2026-10-17 16:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_processor', '0004_download_page_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='api_log',
+            name='response_bytes',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='api_log',
+            name='response_seconds',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='api_log',
+            name='request_date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,325 @@
+'''
+Local stand-in for the LexisNexis API, used to measure the processors without using
+any of the real API limits (see the run_mock_api and benchmark_processor commands).
+
+It serves the calls LNAPI makes:
+    POST /oauth/v2/token                    Client credentials token
+    GET  /v1/News?$search&$expand=Document  Full text of the results ($top and $skip)
+    GET  /v1/News?$search&$expand=PostFilters
+                                            Preview of the results with post filters
+    GET  /v1/Sources                        Searchable sources ($top and $skip)
+    GET  /mock/stats                        Calls made to the server so far (not part of the API)
+
+Every search has the same number of results, and each result is a synthetic NITF
+document generated from the search term and its position, so the same page always
+has the same content. The responses have the X-RateLimit-* headers for the
+per minute/hour/day windows of each type of call, and a 429 is returned once a
+window runs out. Latency, 429s, 5xx errors, and timeouts can be added to the calls.
+'''
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from textassembler_processor.corpus import generate_document, generate_sentence
+
+WINDOW_SECONDS = (60, 3600, 86400) # per minute, hour, and day
+ERROR_CODES = (500, 502, 503)
+
+class MockAPIServer(ThreadingHTTPServer):
+    '''
+    HTTP server pretending to be the LexisNexis API
+    '''
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), **options):
+        '''
+        Params:
+            address (tuple): Host and port to listen on, port 0 picks a free port
+            options: Any of the attributes of MockOptions to change from the defaults
+        '''
+        super().__init__(address, MockAPIHandler)
+        self.options = MockOptions(**options)
+        self.rng = random.Random(self.options.seed)
+        self.lock = threading.Lock()
+        self.limits = {service: WindowLimits(limits) for (service, limits) in self.options.limits.items()}
+        self.stats = {"calls": 0, "results": 0, "bytes": 0, "codes": {}}
+        self.thread = None
+
+    @property
+    def url(self):
+        '''
+        Base URL of the server
+        '''
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        '''
+        Serve requests in a background thread
+        '''
+        self.thread = threading.Thread(target=self.serve_forever, name="mock-api", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stop serving requests started with start
+        '''
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def pick_failure(self):
+        '''
+        Randomly pick a failure to inject into a call, based on the configured rates
+        returns: "429", "5xx", "timeout", or None
+        '''
+        with self.lock:
+            draw = self.rng.random()
+        for (failure, rate) in (("429", self.options.error_rate_429), ("5xx", self.options.error_rate_5xx),
+                                ("timeout", self.options.timeout_rate)):
+            if draw < rate:
+                return failure
+            draw = draw - rate
+        return None
+
+    def record(self, code, num_results, num_bytes):
+        '''
+        Count a call made to the server
+        '''
+        with self.lock:
+            self.stats["calls"] = self.stats["calls"] + 1
+            self.stats["results"] = self.stats["results"] + num_results
+            self.stats["bytes"] = self.stats["bytes"] + num_bytes
+            self.stats["codes"][str(code)] = self.stats["codes"].get(str(code), 0) + 1
+
+
+def serve_in_process(options, sender):
+    '''
+    Run the mock server until the process is terminated, sending its URL back through the pipe
+    Params:
+        options (dict): Options for the server
+        sender (multiprocessing.Connection): Pipe to send the URL of the server through
+    '''
+    server = MockAPIServer(**options)
+    sender.send(server.url)
+    server.serve_forever()
+
+
+class MockOptions: # pylint: disable=too-many-instance-attributes, too-few-public-methods
+    '''
+    Behavior of the mock server
+    '''
+
+    def __init__(self, **options):
+        self.results = 1000 # results in every search
+        self.paragraphs = 20 # average paragraphs per document
+        self.sources = 250 # searchable sources
+        self.latency = 0.05 # seconds before every response
+        self.latency_per_result = 0.002 # additional seconds per document downloaded
+        self.error_rate_429 = 0.0 # fraction of calls that return a 429
+        self.error_rate_5xx = 0.0 # fraction of calls that return a 500, 502, or 503
+        self.timeout_rate = 0.0 # fraction of calls that do not respond for timeout_seconds
+        self.timeout_seconds = 120
+        self.token_seconds = 86400 # how long access tokens are valid
+        self.seed = None # seed for the injected failures
+        # calls allowed per minute/hour/day for each type of call
+        self.limits = {"search": (100, 1500, 12000), "download": (100, 1500, 12000), "sources": (10, 100, 1000)}
+        for (name, value) in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown mock API option: {name}")
+            setattr(self, name, value)
+
+
+class WindowLimits:
+    '''
+    Calls remaining in the per minute/hour/day windows of a type of call. The windows
+    start when the server starts and reset every window length.
+    '''
+
+    def __init__(self, limits):
+        self.limits = tuple(limits)
+        self.lock = threading.Lock()
+        now = time.time()
+        self.reset_on = [now + seconds for seconds in WINDOW_SECONDS]
+        self.remaining = list(self.limits)
+
+    def take(self, use=True):
+        '''
+        Take a call out of every window
+        Params:
+            use (bool): If the call should be taken, otherwise only the headers are returned
+        returns:
+            allowed (bool): If there were calls remaining in every window
+            headers (dict): X-RateLimit-* headers after the call
+        '''
+        with self.lock:
+            now = time.time()
+            for (idx, seconds) in enumerate(WINDOW_SECONDS):
+                while self.reset_on[idx] <= now:
+                    self.reset_on[idx] = self.reset_on[idx] + seconds
+                    self.remaining[idx] = self.limits[idx]
+            allowed = min(self.remaining) > 0
+            if allowed and use:
+                self.remaining = [remaining - 1 for remaining in self.remaining]
+            return (allowed, self.headers())
+
+    def headers(self):
+        '''
+        Get the X-RateLimit-* headers for the current state of the windows
+        '''
+        return {"X-RateLimit-Limit": "/".join(str(limit) for limit in self.limits),
+                "X-RateLimit-Remaining": "/".join(str(max(remaining, 0)) for remaining in self.remaining),
+                "X-RateLimit-Reset": "/".join(str(math.ceil(reset_on)) for reset_on in self.reset_on)}
+
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    '''
+    Handles a single call to the mock server
+    '''
+    protocol_version = "HTTP/1.1" # keep the connections open like the real API
+    server_version = "MockLexisNexis/1.0"
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        logging.debug(f"Mock API: {format % args}")
+
+    def do_POST(self): # pylint: disable=invalid-name
+        '''
+        Handle the token request
+        '''
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        if not self.path.startswith("/oauth/v2/token"):
+            self.send_json(404, {"error": "Not Found", "message": f"Unknown resource {self.path}"})
+            return
+        # the expiration is part of the token so tokens stored by the processors are still
+        # accepted after the mock server is restarted
+        access_token = f"mock.{int(time.time() + self.server.options.token_seconds)}.{uuid.uuid4().hex}"
+        self.send_json(200, {"access_token": access_token, "token_type": "Bearer",
+                             "expires_in": self.server.options.token_seconds})
+
+    def do_GET(self): # pylint: disable=invalid-name
+        '''
+        Handle the News and Sources calls
+        '''
+        url = urlsplit(self.path)
+        params = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+        resource = url.path.rstrip("/").split("/")[-1]
+
+        if url.path.startswith("/mock/stats"):
+            with self.server.lock:
+                self.send_json(200, self.server.stats)
+            return
+        if resource not in ("News", "Sources"):
+            self.send_json(404, {"error": "Not Found", "message": f"Unknown resource {url.path}"})
+            return
+        if not self.is_authorized():
+            self.send_json(401, {"error": "Unauthorized", "message": "The access token is missing or has expired"})
+            return
+
+        service = "sources" if resource == "Sources" else "search"
+        if resource == "News" and params.get("$expand") == "Document":
+            service = "download"
+
+        failure = self.server.pick_failure()
+        if failure == "timeout":
+            time.sleep(self.server.options.timeout_seconds)
+            self.send_json(504, {"error": "Gateway Timeout", "message": "The request timed out"})
+            return
+        if failure == "5xx":
+            time.sleep(self.server.options.latency)
+            self.send_json(random.choice(ERROR_CODES), {"error": "Server Error", "message": "An injected server error"})
+            return
+
+        (allowed, headers) = self.server.limits[service].take(use=failure is None)
+        if failure == "429" or not allowed:
+            self.send_json(429, {"error": "Too Many Requests", "message": "Rate limit exceeded"}, headers)
+            return
+
+        top = int(params.get("$top", 10))
+        skip = int(params.get("$skip", 0))
+        if service == "sources":
+            body = get_sources(self.server.options.sources, top, skip)
+        else:
+            body = get_news(params.get("$search", ""), self.server.options.results, top, skip,
+                            self.server.options.paragraphs if service == "download" else 0)
+        time.sleep(self.server.options.latency +
+                   (self.server.options.latency_per_result * len(body["value"]) if service == "download" else 0))
+        self.send_json(200, body, headers, len(body["value"]))
+
+    def is_authorized(self):
+        '''
+        Check that the call has an access token from the token endpoint that has not expired
+        '''
+        parts = self.headers.get("Authorization", "").split(".")
+        return len(parts) == 3 and parts[0] == "Bearer mock" and parts[1].isdigit() and int(parts[1]) > time.time()
+
+    def send_json(self, code, body, headers=None, num_results=0):
+        '''
+        Send the response as JSON
+        '''
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json;odata.metadata=minimal")
+        self.send_header("Content-Length", str(len(content)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+        if not self.path.startswith("/mock/stats"):
+            self.server.record(code, num_results, len(content))
+
+
+def get_news(term, total, top, skip, paragraphs):
+    '''
+    Get a page of results for the search term
+    Params:
+        term (str): Search term the results are generated from
+        total (int): Results in the search
+        top (int): Results in the page
+        skip (int): Results before the page
+        paragraphs (int): Average paragraphs in the full text, or 0 for the preview without the full text
+    '''
+    results = []
+    for position in range(skip, min(skip + max(top, 0), total)):
+        rng = random.Random(f"{term}/{position}")
+        result_id = f"urn:contentItem:MOCK-{rng.randint(1000, 9999)}-{position:07}-00000-00"
+        result = {"ResultId": result_id,
+                  "Title": generate_sentence(rng, 4, 12),
+                  "Date": f"2019-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}T00:00:00Z",
+                  "Overview": generate_sentence(rng, 20, 40)}
+        if paragraphs:
+            num_paragraphs = max(1, int(rng.gauss(paragraphs, paragraphs / 3)))
+            result["Document"] = {"DocumentId": result_id, "Content": generate_document(rng, num_paragraphs)}
+        else:
+            result["PostFilters"] = get_post_filters(term, total)
+        results.append(result)
+    return {"@odata.context": "MockLexisNexis/$metadata#News", "@odata.count": total, "value": results}
+
+def get_post_filters(term, total):
+    '''
+    Get the post filters included with each preview result
+    '''
+    link = f"News?$search={term}&$expand=PostFilters&$filter="
+    return [{"PostFilterId": "publicationtype", "FilterItems": [
+        {"Name": "Newspapers", "Count": total // 2,
+         "SearchResults@odata.navigationLink": f"{link}PublicationType%20eq%20'TmV3c3BhcGVycw=='"},
+        {"Name": "Web-based Publications", "Count": total - total // 2,
+         "SearchResults@odata.navigationLink": f"{link}PublicationType%20eq%20'V2ViLWJhc2VkIFB1YmxpY2F0aW9ucw=='"}]},
+            {"PostFilterId": "language", "FilterItems": [
+                {"Name": "English", "Count": total,
+                 "SearchResults@odata.navigationLink": f"{link}Language%20eq%20LexisNexis.ServicesApi.Language'English'"}]}]
+
+def get_sources(total, top, skip):
+    '''
+    Get a page of the searchable sources
+    '''
+    sources = [{"Id": f"MOCK{position:05}", "Name": f"Mock Source {position}"}
+               for position in range(skip, min(skip + max(top, 0), total))]
+    return {"@odata.context": "MockLexisNexis/$metadata#Sources", "@odata.count": total, "value": sources}
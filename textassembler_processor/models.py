@@ -2,6 +2,7 @@
 Database models for the processor
 '''
 from django.db import models
+from django.utils import timezone
 
 class api_log(models.Model): # pylint: disable=invalid-name
     '''
@@ -13,4 +14,23 @@ class api_log(models.Model): # pylint: disable=invalid-name
     response_code = models.CharField(max_length=10)
     num_results = models.IntegerField()
     is_download = models.BooleanField() # set to true if download, false if search
+    request_date = models.DateTimeField(default=timezone.now) # set when the call is made since the rows are written in batches
+    response_seconds = models.FloatField(null=True) # time from the request until the response was read
+    response_bytes = models.BigIntegerField(null=True) # size of the response body
+
+class download_page_log(models.Model): # pylint: disable=invalid-name
+    '''
+    Log of each page of results downloaded for a search, with the page size used
+    and how the next page size was picked from it
+    '''
+    log_id = models.AutoField(primary_key=True)
+    search_id = models.ForeignKey('textassembler_web.searches', on_delete=models.CASCADE)
+    skip_value = models.IntegerField()
+    page_size = models.IntegerField() # $top requested
+    num_results = models.IntegerField(null=True) # null if the page was not downloaded
+    response_seconds = models.FloatField()
+    response_bytes = models.BigIntegerField(null=True)
+    timed_out = models.BooleanField(default=False)
+    next_page_size = models.IntegerField()
+    reason = models.CharField(max_length=50) # why the next page size was picked
     request_date = models.DateTimeField(auto_now=True)
@@ -0,0 +1,325 @@
+'''
+Convert the NITF (News Industry Text Format) HTML returned by LexisNexis to plain
+text for the TXT Only format.
+
+The text is made up of the title, the headline, and the body of the document. This
+used to be done by building a full BeautifulSoup tree for each document and then
+searching it for each of the elements, which was the main CPU cost of downloading a
+search. The NITFTextExtractor instead reads the document in a single pass, keeping
+only the stack of open tags and the text of the elements it needs, while following
+the same parsing rules as BeautifulSoup's html.parser tree builder (as of the
+beautifulsoup4 version in requirements.txt) so the output is the same.
+
+Most of the time spent by html.parser goes to its own tokenizing, so well-formed
+documents are tokenized with a single regular expression instead, which only
+accepts markup that html.parser would split into the same events. If a document
+has anything else (i.e. a script, an unterminated entity, or an unquoted attribute)
+it is read again with html.parser.
+
+remove_html_soup is the original BeautifulSoup implementation, kept to compare the
+output and speed against (see the benchmark_nitf command).
+'''
+import re
+from html.entities import codepoint2name
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup # pylint: disable=import-error
+
+# Rules from the BeautifulSoup html.parser tree builder
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+EMPTY_ELEMENT_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+                      'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+                      'image', 'isindex', 'nextid', 'spacer'}
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+ENTITIES = {name: chr(codepoint) for (codepoint, name) in codepoint2name.items()}
+
+# Markup the fast tokenizer accepts. Each alternative produces the same event html.parser would.
+# Only ASCII whitespace is allowed within tags since html.parser treats other spaces differently.
+TOKEN = re.compile(r'''
+    (?P<text>[^<&]+)
+    |(?P<start><(?P<start_name>[a-zA-Z][-.:a-zA-Z0-9_]*)
+        (?:[ \t\n\r\f]+[a-zA-Z_:][-.:a-zA-Z0-9_]*(?:[ \t\n\r\f]*=[ \t\n\r\f]*(?:"[^"]*"|'[^']*'))?)*
+        [ \t\n\r\f]*(?P<startend>/?)>)
+    |(?P<end></(?P<end_name>[a-zA-Z][-.:a-zA-Z0-9_]*)[ \t\n\r\f]*>)
+    |(?P<comment><!--(?P<comment_data>(?!-?>)(?:[^-]|-(?!-))*)-->)
+    |(?P<decl><!(?P<decl_data>[dD][oO][cC][tT][yY][pP][eE][^>]*)>)
+    |(?P<charref>&\#(?P<charref_name>[0-9]+|[xX][0-9a-fA-F]+);)
+    |(?P<entityref>&(?P<entityref_name>[a-zA-Z][-.a-zA-Z0-9]*);)
+''', re.VERBOSE)
+# Elements html.parser does not parse the contents of
+RAW_TEXT_ELEMENTS = ('script', 'style')
+ESCAPABLE_RAW_TEXT_ELEMENTS = ('title', 'textarea')
+
+# Elements needed for the output. The title and headline use the single string
+# directly inside the element, the hedline and body use all of the text within them.
+STRING_ELEMENTS = ('title', 'h1')
+TEXT_ELEMENTS = ('nitf:hedline', 'nitf:body')
+
+def remove_html(text):
+    '''
+    Strip HTML from a given text
+    '''
+    extractor = NITFTextExtractor()
+    if not extractor.feed_fast(text):
+        # start over, reading the full document with html.parser
+        extractor = NITFTextExtractor()
+        extractor.feed(text)
+    extractor.close()
+
+    headline = extractor.get_string('h1')
+    # check another place for headline
+    if not headline:
+        headline = extractor.get_text('nitf:hedline')
+
+    title = extractor.get_string('title')
+
+    # write the title and headline
+    output = [title]
+    if title != headline: # prevent duplicate output to file
+        output.append(headline)
+
+    output.append(extractor.get_text('nitf:body'))
+    return "\n\n".join(output)
+
+def remove_html_soup(text):
+    '''
+    Strip HTML from a given text using BeautifulSoup
+    '''
+    output = []
+
+    bsp = BeautifulSoup(text, "html.parser")
+
+    headline = bsp.h1.string if bsp.h1 is not None and bsp.h1.string is not None else ""
+    # check another place for headline
+    if not headline:
+        headline = bsp.find('nitf:hedline').text if bsp.find('nitf:hedline') is not None else ""
+
+    title = bsp.title.string if bsp.title is not None and bsp.title.string is not None else ""
+
+    # write the title and headline
+    output.append(title)
+    if title != headline: # prevent duplicate output to file
+        output.append(headline)
+
+    text = bsp.find('nitf:body').text if bsp.find('nitf:body') is not None else ""
+    output.append(text)
+    full_output = "\n\n".join(output)
+
+    return full_output
+
+
+def is_closed_by(text, pos, tag):
+    '''
+    Check if the text at the position is the end tag for the tag
+    '''
+    return pos >= 0 and text[pos:pos + len(tag) + 2].lower() == f"</{tag}"
+
+
+class NITFTextExtractor(HTMLParser):
+    '''
+    Single pass extraction of the title, headline, and body text of a NITF document.
+
+    The contents of the first title and h1 elements are kept as nested lists (a list
+    per element containing its strings and child element lists) to find the single
+    string inside them. The strings within the first nitf:hedline and nitf:body
+    elements are collected while those elements are open.
+    '''
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = [] # (name, contents list if kept, text list if collecting) of each open tag
+        self.data = [] # pieces of the current string
+        self.preserve_whitespace = 0 # number of open pre/textarea tags
+        self.already_closed_empty_element = []
+        self.elements = {} # contents of the first title and h1 elements
+        self.texts = {} # strings of the first nitf:hedline and nitf:body elements
+        self.collecting = [] # text lists of the open nitf:hedline and nitf:body elements
+
+    def feed_fast(self, text): # pylint: disable=too-many-branches
+        '''
+        Read the full document using the fast tokenizer
+        Returns:
+            read (bool): False if the document has markup the fast tokenizer does not handle
+        '''
+        # the handlers are looked up once since this runs for every token of every document
+        data = self.data
+        start_tag = self.handle_starttag
+        startend_tag = self.handle_startendtag
+        end_tag = self.handle_endtag
+        pos = 0
+        for match in TOKEN.finditer(text):
+            if match.start() != pos:
+                return False
+            pos = match.end()
+            token = match.lastgroup
+            if token == "text":
+                data.append(match.group())
+            elif token == "start":
+                tag = match.group("start_name").lower()
+                if tag in RAW_TEXT_ELEMENTS:
+                    return False
+                if tag in ESCAPABLE_RAW_TEXT_ELEMENTS and not is_closed_by(text, text.find("<", pos), tag):
+                    return False # newer versions of html.parser do not parse markup inside these
+                if match.group("startend"):
+                    startend_tag(tag, [])
+                else:
+                    start_tag(tag, [])
+            elif token == "end":
+                end_tag(match.group("end_name").lower())
+            elif token == "entityref":
+                self.handle_entityref(match.group("entityref_name"))
+            elif token == "charref":
+                self.handle_charref(match.group("charref_name"))
+            elif token == "comment":
+                self.handle_comment(match.group("comment_data"))
+            else:
+                self.handle_decl(match.group("decl_data"))
+        return pos == len(text)
+
+    def close(self):
+        super().close()
+        self.end_data()
+        while self.stack:
+            self.pop_tag()
+
+    def get_string(self, name):
+        '''
+        Get the single string inside the first element with the given name, or an empty
+        string if it contains anything else
+        '''
+        contents = self.elements.get(name)
+        while contents is not None and len(contents) == 1:
+            if isinstance(contents[0], str):
+                return contents[0]
+            contents = contents[0]
+        return ""
+
+    def get_text(self, name):
+        '''
+        Get all of the text inside the first element with the given name
+        '''
+        return "".join(self.texts.get(name, []))
+
+    def end_data(self, text_type="text"):
+        '''
+        Finish the current string, adding it to the elements it is in
+        '''
+        if not self.data:
+            return
+        data = "".join(self.data)
+        self.data.clear()
+        if not self.preserve_whitespace and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+
+        # comments, doctypes, etc. are not part of the text but are still part of the contents
+        if text_type in ("text", "cdata"):
+            for text in self.collecting:
+                text.append(data)
+        if self.stack and self.stack[-1][1] is not None:
+            self.stack[-1][1].append(data)
+
+    def pop_tag(self):
+        '''
+        Close the most recently opened tag
+        '''
+        (name, _, text) = self.stack.pop()
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace = self.preserve_whitespace - 1
+        if text is not None:
+            self.collecting = [collecting for collecting in self.collecting if collecting is not text]
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True): # pylint: disable=arguments-differ
+        self.end_data()
+
+        contents = None
+        if self.stack and self.stack[-1][1] is not None:
+            contents = []
+            self.stack[-1][1].append(contents)
+        if tag in STRING_ELEMENTS and tag not in self.elements:
+            contents = [] if contents is None else contents
+            self.elements[tag] = contents
+
+        text = None
+        if tag in TEXT_ELEMENTS and tag not in self.texts:
+            text = self.texts[tag] = []
+            self.collecting.append(text)
+
+        self.stack.append((tag, contents, text))
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace = self.preserve_whitespace + 1
+
+        if handle_empty_element and tag in EMPTY_ELEMENT_TAGS:
+            # html.parser does not send end tag events for empty-element tags,
+            # and an explicit closing tag for it later on is ignored
+            self.handle_endtag(tag, check_already_closed=False)
+            self.already_closed_empty_element.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag, check_already_closed=True): # pylint: disable=arguments-differ
+        if check_already_closed and tag in self.already_closed_empty_element:
+            self.already_closed_empty_element.remove(tag)
+            return
+        self.end_data()
+        # close every tag up to the most recent one with the name,
+        # which is every open tag if there is none with the name
+        while self.stack:
+            if self.stack[-1][0] == tag:
+                self.pop_tag()
+                break
+            self.pop_tag()
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_charref(self, name):
+        if name.startswith(('x', 'X')):
+            real_name = int(name.lstrip('xX'), 16)
+        else:
+            real_name = int(name)
+
+        data = None
+        if real_name < 256:
+            # numeric entities sometimes reference Windows-1252 instead of Unicode code points
+            try:
+                data = bytearray([real_name]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(real_name)
+            except (ValueError, OverflowError):
+                pass
+        self.data.append(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        self.data.append(ENTITIES.get(name, f"&{name}"))
+
+    def handle_comment(self, data):
+        self.end_data()
+        self.data.append(data)
+        self.end_data("comment")
+
+    def handle_decl(self, decl):
+        self.end_data()
+        if decl.startswith("DOCTYPE "):
+            decl = decl[len("DOCTYPE "):]
+        elif decl == 'DOCTYPE':
+            decl = ''
+        self.data.append(decl)
+        self.end_data("doctype")
+
+    def unknown_decl(self, data):
+        text_type = "declaration"
+        if data.upper().startswith('CDATA['):
+            text_type = "cdata"
+            data = data[len('CDATA['):]
+        self.end_data()
+        self.data.append(data)
+        self.end_data(text_type)
+
+    def handle_pi(self, data):
+        self.end_data()
+        self.data.append(data)
+        self.end_data("pi")
@@ -0,0 +1,119 @@
+'''
+Picks the number of results to request per download call ($top) for a search.
+
+Each download call counts against the API limits no matter how many results it
+returns, so larger pages get more documents out of the limits. But larger pages
+also take longer and are more likely to hit the API timeout. The page size for each
+search starts at DOWNLOAD_PER_CALL and is adjusted after every page, between
+DOWNLOAD_PER_CALL_MIN and DOWNLOAD_PER_CALL_MAX:
+    - grows (by up to half each page) while pages take less than DOWNLOAD_TARGET_SECONDS
+    - shrinks to what should fit in DOWNLOAD_TARGET_SECONDS when a page is slower than that
+    - is cut in half when a download call times out
+    - is capped so a page is expected to be under DOWNLOAD_MAX_PAGE_MB
+    - allows pages up to half of the API timeout when there are not enough download calls
+      remaining in the current limits to finish the search at the current size
+'''
+from django.conf import settings
+
+SMOOTHING = 0.5 # weight given to the latest page in the per-result averages
+
+class PageSizer:
+    '''
+    Page size for a single search, adjusted from the pages downloaded for it
+    '''
+
+    def __init__(self, page_size=None):
+        '''
+        Params:
+            page_size (int): Size to start at, i.e. the last size used for the search
+        '''
+        self.page_size = self.clamp(page_size or settings.LN_DOWNLOAD_PER_CALL)
+        self.seconds_per_result = None
+        self.bytes_per_result = None
+        self.reason = "initial"
+
+    def clamp(self, page_size): # pylint: disable=no-self-use
+        '''
+        Keep the page size within the allowed range
+        '''
+        return int(max(settings.LN_DOWNLOAD_PER_CALL_MIN, min(settings.LN_DOWNLOAD_PER_CALL_MAX, page_size)))
+
+    def get_page_size(self, results_remaining=None, calls_remaining=None):
+        '''
+        Get the number of results to request in the next download call
+        Params:
+            results_remaining (int): Number of results left to download for the search, if known
+            calls_remaining (int): Number of download calls left in the current API limits, if known
+        Returns:
+            page_size (int): $top to use for the call
+        '''
+        if results_remaining is None or calls_remaining is None or self.seconds_per_result is None:
+            return self.page_size
+        if calls_remaining * self.page_size >= results_remaining:
+            return self.page_size
+
+        # Running out of calls, so take as many results from each call as can be done safely
+        quota_size = self.clamp(self.limit_by_size((settings.LN_TIMEOUT / 2) / self.seconds_per_result))
+        if quota_size > self.page_size:
+            self.page_size = quota_size
+            self.reason = "quota"
+        return self.page_size
+
+    def limit_by_size(self, page_size):
+        '''
+        Cap the page size so the response is expected to stay under DOWNLOAD_MAX_PAGE_MB
+        '''
+        if self.bytes_per_result:
+            return min(page_size, (settings.LN_DOWNLOAD_MAX_PAGE_MB * 1024 * 1024) / self.bytes_per_result)
+        return page_size
+
+    def record_page(self, page_size, num_results, seconds, num_bytes):
+        '''
+        Adjust the page size from a page that was downloaded
+        Params:
+            page_size (int): $top used for the call
+            num_results (int): Number of results returned
+            seconds (float): Time taken to download the page
+            num_bytes (int): Size of the response
+        Returns:
+            page_size (int): The page size to use next
+        '''
+        if num_results <= 0:
+            return self.page_size
+
+        self.seconds_per_result = average(self.seconds_per_result, seconds / num_results)
+        self.bytes_per_result = average(self.bytes_per_result, num_bytes / num_results)
+        target_size = self.limit_by_size(settings.LN_DOWNLOAD_TARGET_SECONDS / self.seconds_per_result)
+
+        if seconds > settings.LN_DOWNLOAD_TARGET_SECONDS:
+            self.page_size = self.clamp(min(target_size, page_size - 1))
+            self.reason = "slow"
+        elif num_results < page_size:
+            self.reason = "last page" # a short page does not say anything about larger ones
+        else:
+            new_size = self.clamp(min(target_size, max(page_size * 1.5, page_size + 1)))
+            if new_size > page_size:
+                self.reason = "fast"
+            elif new_size < page_size:
+                self.reason = "size"
+            else:
+                self.reason = "steady"
+            self.page_size = new_size
+        return self.page_size
+
+    def record_timeout(self, page_size):
+        '''
+        Back off after a download call timed out
+        Returns:
+            page_size (int): The page size to use next
+        '''
+        self.page_size = self.clamp(page_size // 2)
+        self.reason = "timeout"
+        return self.page_size
+
+
+def average(current, value):
+    '''
+    Exponentially weighted average of the values seen so far
+    '''
+    return value if current is None else (1 - SMOOTHING) * current + SMOOTHING * value
@@ -0,0 +1,104 @@
+'''
+Schedulers used by the queue processor to decide which search to download next.
+
+The scheduler is set with the SCHEDULER config (or the --scheduler argument of
+process_queue) and can be one of the built-in names below, or the dotted path to
+a class with the same interface:
+    fifo: each search gets a turn in the order it was last updated (default)
+    fair: weighted fair queuing between users, so a user with many queued searches
+          gets the same share of the downloads as a user with one search
+
+If SCHEDULER_PREFER_SHORT is enabled, searches with the fewest results left to
+download are picked first (within each user's share for the fair scheduler), so
+small searches are not stuck waiting behind very large ones.
+'''
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+def get_scheduler(name=None):
+    '''
+    Create the scheduler with the given name, defaulting to the SCHEDULER config
+    '''
+    name = name or settings.SCHEDULER
+    schedulers = {"fifo": FifoScheduler, "fair": FairShareScheduler}
+    scheduler_class = schedulers[name] if name in schedulers else import_string(name)
+    return scheduler_class(prefer_short=settings.SCHEDULER_PREFER_SHORT, weights=settings.SCHEDULER_USER_WEIGHTS)
+
+def results_remaining(search):
+    '''
+    Number of results left to download for the search
+    '''
+    return max((search.num_results_in_search or 0) - (search.num_results_downloaded or 0), 0)
+
+class FifoScheduler:
+    '''
+    Download the searches in the order of the queue, which is sorted by the
+    last time progress was made on them
+    '''
+
+    def __init__(self, prefer_short=False, weights=None): # pylint: disable=unused-argument
+        self.prefer_short = prefer_short
+        self.lock = threading.Lock()
+
+    def order(self, queue):
+        '''
+        Sort the queue in the order the searches should be downloaded
+        Returns:
+            queue (list): searches in priority order
+        '''
+        queue = list(queue)
+        if self.prefer_short:
+            # the sort is stable, so searches with the same number remaining keep their turn order
+            queue.sort(key=results_remaining)
+        return queue
+
+    def record(self, search, num_calls=1):
+        '''
+        Record the number of download calls made for the search
+        '''
+
+
+class FairShareScheduler(FifoScheduler):
+    '''
+    Weighted fair queuing between users. Each user has a virtual time that moves
+    forward by 1/weight for each download call made for their searches, and the
+    searches of the user with the lowest virtual time go first. The weight of a
+    user defaults to 1 and can be set in the [scheduler.weights] config section.
+    '''
+
+    def __init__(self, prefer_short=False, weights=None):
+        super().__init__(prefer_short, weights)
+        self.weights = weights or {}
+        self.virtual_times = {}
+
+    def get_weight(self, userid):
+        '''
+        Get the share weight for the user
+        '''
+        weight = float(self.weights.get(userid, 1))
+        return weight if weight > 0 else 1
+
+    def order(self, queue):
+        queue = super().order(queue)
+        with self.lock:
+            # Users that have not had anything queued do not get to save up their unused
+            # share, they start at the same virtual time as the furthest behind active user
+            active = {search.userid for search in queue}
+            known = [vtime for (userid, vtime) in self.virtual_times.items() if userid in active]
+            floor = min(known) if known else 0
+            self.virtual_times = {userid: max(self.virtual_times.get(userid, floor), floor) for userid in active}
+
+            # Interleave the searches from each user, with a user's Nth search queued
+            # as if the user had already had N more turns
+            keys = {}
+            position = {}
+            for (index, search) in enumerate(queue):
+                turn = position.get(search.userid, 0)
+                position[search.userid] = turn + 1
+                keys[search.search_id] = (self.virtual_times[search.userid] + turn / self.get_weight(search.userid), index)
+        return sorted(queue, key=lambda search: keys[search.search_id])
+
+    def record(self, search, num_calls=1):
+        with self.lock:
+            self.virtual_times[search.userid] = self.virtual_times.get(search.userid, 0) + num_calls / self.get_weight(search.userid)
@@ -0,0 +1,49 @@
+'''
+Everything needed to download the pages of a search that does not change while it is
+being downloaded: the API parameters (search term, $filter, and $orderby) and the
+formats to save the results in. The plan is built once per search from the filters and
+download_formats tables, and each page only adds its $top and $skip.
+'''
+from django.apps import apps
+from textassembler_web.ln_api import get_download_params
+
+class SearchPlan: # pylint: disable=too-few-public-methods
+    '''
+    Compiled download request for a search
+    '''
+
+    def __init__(self, search):
+        '''
+        Params:
+            search (searches): The search to build the plan for
+        '''
+        filters = apps.get_model('textassembler_web', 'filters')
+        download_formats = apps.get_model('textassembler_web', 'download_formats')
+
+        self.search_id = search.search_id
+        self.version = get_version(search)
+
+        self.set_filters = {}
+        for fltr in filters.objects.filter(search_id=search.search_id).order_by('id'):
+            if fltr.filter_name not in self.set_filters:
+                self.set_filters[fltr.filter_name] = []
+            self.set_filters[fltr.filter_name].append(fltr.filter_value)
+        self.formats = [fmt.format_id.format_name for fmt in
+                        download_formats.objects.filter(search_id=search.search_id).select_related('format_id').order_by('id')]
+
+        sort_order = "" if search.sort_order is None else search.sort_order.sort_value
+        self.params = get_download_params(search.query, self.set_filters, sort_order)
+
+    def is_current(self, search):
+        '''
+        Check if the plan was built from the current values of the search
+        '''
+        return self.search_id == search.search_id and self.version == get_version(search)
+
+
+def get_version(search):
+    '''
+    The fields of the search record the plan is built from. The filters and formats
+    of a search can not be changed once it is saved, so they are not included.
+    '''
+    return (search.query, search.sort_order_id)
@@ -0,0 +1,124 @@
+'''
+Save the documents of a search to a few large segment files instead of a file per result.
+
+Each document is appended to [Search ID]/.segments/segment.body (or segment.002.body, etc.
+once the current segment reaches SEGMENT_MB) and its ResultId, file name, segment, offset,
+length, and the time it was saved are added to the index, [Search ID]/.segments/segment.idx.
+The segments follow the pages of the search the same way as the zip file built while
+downloading (see volumes.py), so the documents of a page that was not saved are removed
+when the search is picked up again.
+
+The compression processor reads the documents back in the order they were saved, and a
+single document can be looked up by its ResultId with SegmentReader.get. A search only
+has a handful of files no matter how many results it has, so compressing and deleting it
+does not have to go through millions of small files.
+'''
+import os
+import json
+import threading
+import time
+from textassembler_processor.volumes import VolumeWriter
+
+SEGMENT_DIR = ".segments"
+
+class SegmentStore(VolumeWriter):
+    '''
+    Segment files of a search that the documents are added to as they are downloaded
+    '''
+
+    def __init__(self, base_path, volume_bytes=0):
+        '''
+        Params:
+            base_path (string): The save location for the search, i.e. [STORAGE_LOCATION]/[Search ID]
+            volume_bytes (int): Size to start a new segment at, 0 to keep every document in one segment
+        '''
+        super().__init__(os.path.join(base_path, SEGMENT_DIR), "segment", volume_bytes)
+
+    @staticmethod
+    def exists(base_path):
+        '''
+        Check if the documents of the search are saved to segments
+        '''
+        return os.path.isdir(os.path.join(base_path, SEGMENT_DIR))
+
+    def add(self, result_id, file_name, text):
+        '''
+        Add a document to the segments
+        Params:
+            result_id (string): ResultId of the document from LexisNexis
+            file_name (string): Name of the result file (without the extension)
+            text (string): The document returned by LexisNexis
+        '''
+        data = text.encode("utf-8")
+        if self.volume_bytes and self.body.tell() > 0 and self.body.tell() + len(data) > self.volume_bytes:
+            self.next_volume()
+        offset = self.body.tell()
+        self.body.write(data)
+        self.index.write((json.dumps([result_id, file_name, len(self.volumes) + 1, offset, len(data),
+                                      int(time.time())]) + "\n").encode("utf-8"))
+
+
+class SegmentReader:
+    '''
+    Read the documents saved to the segments of a search. The documents can be read
+    from several threads at the same time.
+    '''
+
+    def __init__(self, base_path):
+        '''
+        Params:
+            base_path (string): The save location for the search, i.e. [STORAGE_LOCATION]/[Search ID]
+        '''
+        self.store = SegmentStore(base_path)
+        self.segments = {} # file descriptor of each segment that has been read from
+        self.lookup = None # index entry for each ResultId, loaded by the first lookup
+        self.lock = threading.Lock()
+
+    def read_index(self):
+        '''
+        Get the documents in the index, in the order they were saved, up to the last page
+        saved (or about to be saved) on the search record
+        Returns:
+            entries (list): [ResultId, file name, segment, offset, length, time saved] for each document
+        '''
+        checkpoint = self.store.find_checkpoint(None)
+        if not checkpoint["index"]:
+            return []
+        with open(self.store.index_path, 'rb') as flh:
+            return [json.loads(line) for line in flh.read(checkpoint["index"]).splitlines()]
+
+    def read(self, entry):
+        '''
+        Read a document from the segments
+        Params:
+            entry (list): The entry for the document in the index
+        Returns:
+            text (string): The document returned by LexisNexis
+        '''
+        (segment, offset, length) = entry[2:5]
+        with self.lock:
+            if segment not in self.segments:
+                self.segments[segment] = os.open(self.store.get_body_path(segment), os.O_RDONLY)
+            fdesc = self.segments[segment]
+        return os.pread(fdesc, length, offset).decode("utf-8")
+
+    def get(self, result_id):
+        '''
+        Look up a single document by its ResultId
+        Returns:
+            text (string): The document, or None if it was not saved
+        '''
+        with self.lock:
+            if self.lookup is None:
+                self.lookup = {entry[0]: entry for entry in self.read_index()}
+        entry = self.lookup.get(result_id)
+        return None if entry is None else self.read(entry)
+
+    def close(self):
+        '''
+        Close the segments that were read from
+        '''
+        with self.lock:
+            for fdesc in self.segments.values():
+                os.close(fdesc)
+            self.segments = {}
@@ -0,0 +1,206 @@
+'''
+Write-ahead staging of downloaded results so a page of results is either saved
+completely (files and search progress) or not at all, even if the processor is
+killed part way through.
+
+The files for a page are written to [Search ID]/.staging/page_[skip]/ while it is
+being downloaded. Before the search record is updated, a manifest listing each
+staged file and its final location is written to [Search ID]/.staging/page_[skip].json
+and the files are moved to their final location. Once the search record is saved,
+the manifest is removed.
+
+If the processor stops before the manifest is removed, the next time the search
+is picked up the manifest is compared to the skip value saved on the search: if
+the search record was saved the page is committed (finishing any moves), otherwise
+the page is rolled back (removing its files). Pages without a manifest were never
+finished and are removed.
+
+When the results are added to an archive as they are downloaded (see archive.py), or the
+documents are saved to segments (see segments.py), they are prepared, committed, aborted,
+and recovered along with the staged files.
+'''
+import os
+import json
+import logging
+import shutil
+from textassembler_web.utilities import log_error
+
+STAGING_DIR = ".staging"
+
+class PageStaging:
+    '''
+    Staging area for the pages of results of a search
+    '''
+
+    def __init__(self, base_path, archive=None, segments=None):
+        '''
+        Params:
+            base_path (string): The save location for the search, i.e. [STORAGE_LOCATION]/[Search ID]
+            archive (ArchiveWriter): Archive the results of the search are added to, if any
+            segments (SegmentStore): Segments the documents of the search are saved to, if any
+        '''
+        self.base_path = base_path
+        self.archive = archive
+        self.segments = segments
+        self.staging_path = os.path.join(base_path, STAGING_DIR)
+        self.page = None # skip value of the page being written
+        self.files = [] # (staged path, final path) for each file of the page
+        self.prepared = False # if the manifest for the page has been written
+
+    def get_page_path(self):
+        '''
+        Directory the files of the current page are staged in
+        '''
+        return os.path.join(self.staging_path, f"page_{self.page}")
+
+    def get_manifest_path(self, page):
+        '''
+        Path of the manifest for the given page
+        '''
+        return os.path.join(self.staging_path, f"page_{page}.json")
+
+    def stage(self, final_path, skip_value):
+        '''
+        Get the path to write a file to until the page is committed
+        Params:
+            final_path (string): Where the file should end up
+            skip_value (int): Skip value of the page the file is for
+        Returns:
+            staged_path (string): Where to write the file
+        '''
+        if self.page is None:
+            self.page = skip_value
+            os.makedirs(self.get_page_path(), exist_ok=True)
+        staged_path = os.path.join(self.get_page_path(), str(len(self.files)))
+        self.files.append((staged_path, final_path))
+        return staged_path
+
+    def prepare(self, skip_value):
+        '''
+        Write the manifest for the page and move its files to their final location.
+        This must be done before the search record is updated with the skip_value.
+        Params:
+            skip_value (int): The skip value the search will have once the page is saved
+        '''
+        for store in self.get_stores():
+            store.prepare(skip_value)
+        if self.page is None:
+            return # nothing was written for the page
+
+        manifest = {"skip_value": skip_value,
+                    "files": [[os.path.relpath(staged, self.base_path), os.path.relpath(final, self.base_path)]
+                              for (staged, final) in self.files]}
+        manifest_path = self.get_manifest_path(self.page)
+        with open(manifest_path + ".tmp", 'w') as flh:
+            json.dump(manifest, flh)
+            flh.flush()
+            os.fsync(flh.fileno())
+        os.replace(manifest_path + ".tmp", manifest_path)
+        sync_dir(self.staging_path)
+        self.prepared = True
+
+        for (staged, final) in self.files:
+            os.replace(staged, final)
+
+    def commit(self):
+        '''
+        Remove the manifest once the search record has been saved
+        '''
+        for store in self.get_stores():
+            store.commit()
+        if self.page is not None:
+            try:
+                os.remove(self.get_manifest_path(self.page))
+                shutil.rmtree(self.get_page_path(), ignore_errors=True)
+            except OSError as ose:
+                # the page will be committed again the next time the search is downloaded
+                logging.warning(f"Failed to remove the manifest for page {self.page} in {self.staging_path}. {ose}")
+        self.reset()
+
+    def abort(self):
+        '''
+        Remove the files of a page that will not be saved. If the manifest was already
+        written it is left to be committed or rolled back when the search is picked up again,
+        since it is not known if the search record was saved.
+        '''
+        for store in self.get_stores():
+            store.abort()
+        if self.page is not None and not self.prepared:
+            logging.warning(f"Removing {len(self.files)} staged file(s) for page {self.page} in {self.staging_path}.")
+            shutil.rmtree(self.get_page_path(), ignore_errors=True)
+        self.reset()
+
+    def get_stores(self):
+        '''
+        The archive and segments the results are added to, if any
+        '''
+        return [store for store in (self.archive, self.segments) if store is not None]
+
+    def close(self):
+        '''
+        Close the files of the archive and segments
+        '''
+        for store in self.get_stores():
+            store.close()
+
+    def reset(self):
+        '''
+        Start a new page
+        '''
+        self.page = None
+        self.files = []
+        self.prepared = False
+
+    def recover(self, skip_value):
+        '''
+        Commit or roll back any pages left from a previous run.
+        Params:
+            skip_value (int): The skip value currently saved on the search record
+        '''
+        for store in self.get_stores():
+            store.open(skip_value)
+        if not os.path.isdir(self.staging_path):
+            return
+        for entry in sorted(os.listdir(self.staging_path)):
+            if not entry.endswith(".json"):
+                continue
+            manifest_path = os.path.join(self.staging_path, entry)
+            with open(manifest_path) as flh:
+                manifest = json.load(flh)
+            files = [(os.path.join(self.base_path, staged), os.path.join(self.base_path, final))
+                     for (staged, final) in manifest["files"]]
+            if skip_value >= manifest["skip_value"]:
+                logging.warning(f"Committing {len(files)} file(s) for {entry} left in {self.staging_path}.")
+                for (staged, final) in files:
+                    if os.path.isfile(staged):
+                        os.replace(staged, final)
+            else:
+                logging.warning(f"Rolling back {len(files)} file(s) for {entry} left in {self.staging_path}.")
+                for (staged, final) in files:
+                    remove_file(staged)
+                    remove_file(final)
+            os.remove(manifest_path)
+        # anything left belongs to pages that were never finished
+        shutil.rmtree(self.staging_path)
+
+
+def remove_file(file_path):
+    '''
+    Remove a file from the server if it exists
+    '''
+    if os.path.isfile(file_path):
+        logging.warning(f"Deleting {file_path}.")
+        try:
+            os.remove(file_path)
+        except OSError as ose:
+            log_error(f"Failed to delete {file_path} from the server. {ose}")
+
+def sync_dir(dir_path):
+    '''
+    Make sure the entries in a directory have been written to disk
+    '''
+    dir_fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
@@ -1,3 +1,613 @@
 '''
 Test cases for the processor
 '''
+import multiprocessing
+import os
+import re
+import tarfile
+import tempfile
+import threading
+import time
+from datetime import timedelta
+import zipfile
+from unittest import skipUnless
+from unittest.mock import patch
+from types import SimpleNamespace
+from queue import Queue
+import requests
+from django.db import OperationalError
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from textassembler_processor.schedulers import FifoScheduler, FairShareScheduler
+from textassembler_processor.page_sizer import PageSizer
+from textassembler_processor.staging import PageStaging, STAGING_DIR
+from textassembler_processor.nitf import remove_html, remove_html_soup
+from textassembler_processor.corpus import generate_corpus
+from textassembler_processor.mock_api import MockAPIServer
+from textassembler_processor.compression import get_files_to_compress, compress_files, zstandard, TAR_PARTS_DIR
+from textassembler_processor.archive import ArchiveWriter, ARCHIVE_DIR
+from textassembler_processor.management.commands.process_queue import Command as QueueCommand
+from textassembler_processor.management.commands.compress_searches import Command as CompressCommand, \
+    init_progress_worker, send_progress
+from textassembler_processor.formats import get_raw_path
+from textassembler_processor.segments import SegmentStore, SegmentReader
+
+
+def make_search(search_id, userid, num_results_in_search=100, num_results_downloaded=0):
+    return SimpleNamespace(search_id=search_id, userid=userid, num_results_in_search=num_results_in_search,
+                           num_results_downloaded=num_results_downloaded)
+
+
+class SchedulerTestCase(SimpleTestCase):
+
+    def testFifoKeepsQueueOrder(self):
+        queue = [make_search(1, "a"), make_search(2, "a"), make_search(3, "b")]
+        self.assertEqual([s.search_id for s in FifoScheduler().order(queue)], [1, 2, 3])
+
+    def testPreferShortOrdersByResultsRemaining(self):
+        queue = [make_search(1, "a", 500000), make_search(2, "b", 200), make_search(3, "c", 1000, 900)]
+        ordered = FifoScheduler(prefer_short=True).order(queue)
+        self.assertEqual([s.search_id for s in ordered], [3, 2, 1])
+
+    def testFairShareInterleavesUsers(self):
+        # user a has many searches queued ahead of user b's only search
+        queue = [make_search(i, "a") for i in range(1, 6)] + [make_search(6, "b")]
+        scheduler = FairShareScheduler()
+        self.assertEqual([s.search_id for s in scheduler.order(queue)][:2], [1, 6])
+
+        # once user a has used more downloads, user b goes first
+        scheduler.record(queue[0], 3)
+        self.assertEqual(scheduler.order(queue)[0].search_id, 6)
+
+    def testFairShareWeights(self):
+        queue = [make_search(1, "a"), make_search(2, "b")]
+        scheduler = FairShareScheduler(weights={"a": 2})
+        scheduler.order(queue)
+        # two calls for a weigh the same as one call for b
+        scheduler.record(queue[0], 2)
+        scheduler.record(queue[1], 1)
+        self.assertEqual(scheduler.order(queue)[0].search_id, 1)
+
+    def testFairShareDoesNotBankIdleTime(self):
+        scheduler = FairShareScheduler()
+        busy = make_search(1, "a")
+        for _ in range(10):
+            scheduler.order([busy])
+            scheduler.record(busy)
+        # user b was not queued while a was downloading, so b should not get 10 turns in a row
+        newcomer = make_search(2, "b")
+        scheduler.order([busy, newcomer])
+        scheduler.record(newcomer)
+        self.assertEqual(scheduler.order([busy, newcomer])[0].search_id, 1)
+
+
+@override_settings(LN_DOWNLOAD_PER_CALL=10, LN_DOWNLOAD_PER_CALL_MIN=2, LN_DOWNLOAD_PER_CALL_MAX=50,
+                   LN_DOWNLOAD_TARGET_SECONDS=10, LN_DOWNLOAD_MAX_PAGE_MB=1, LN_TIMEOUT=30)
+class PageSizerTestCase(SimpleTestCase):
+
+    def testGrowsWhileFast(self):
+        sizer = PageSizer()
+        self.assertEqual(sizer.record_page(10, 10, 1, 1000), 15)
+        self.assertEqual(sizer.reason, "fast")
+        for _ in range(10):
+            sizer.record_page(sizer.page_size, sizer.page_size, 1, 1000)
+        self.assertEqual(sizer.page_size, 50)
+
+    def testShrinksWhenSlow(self):
+        sizer = PageSizer(40)
+        # 1 second per result, so 10 results should fit in the target time
+        self.assertEqual(sizer.record_page(40, 40, 40, 1000), 10)
+        self.assertEqual(sizer.reason, "slow")
+
+    def testBacksOffOnTimeout(self):
+        sizer = PageSizer(10)
+        self.assertEqual(sizer.record_timeout(10), 5)
+        self.assertEqual(sizer.record_timeout(5), 2)
+        self.assertEqual(sizer.record_timeout(2), 2)
+
+    def testLimitsResponseSize(self):
+        sizer = PageSizer(10)
+        # 200KB per result, so only 5 fit in 1MB
+        self.assertEqual(sizer.record_page(10, 10, 1, 10 * 200 * 1024), 5)
+        self.assertEqual(sizer.reason, "size")
+
+    def testGrowsWhenShortOnCalls(self):
+        sizer = PageSizer(10)
+        sizer.record_page(10, 10, 2, 1000) # 0.2 seconds per result
+        size = sizer.page_size
+        self.assertEqual(sizer.get_page_size(results_remaining=1000, calls_remaining=100), size)
+        # 15 seconds (half the timeout) allows 75 results, capped at the max
+        self.assertEqual(sizer.get_page_size(results_remaining=1000, calls_remaining=5), 50)
+        self.assertEqual(sizer.reason, "quota")
+
+
+class PageResults(dict):
+    '''
+    Page of results read from the API
+    '''
+
+
+@patch("textassembler_processor.management.commands.process_queue.notify")
+class SavePageTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.command = QueueCommand(SimpleNamespace(forget=lambda search: None, stop_event=threading.Event()))
+        self.command.staging = SimpleNamespace(prepare=lambda skip_value: None, commit=lambda: None)
+        self.command.cur_search = SimpleNamespace(search_id=1, skip_value=0, run_time_seconds=0, num_results_in_search=0,
+                                                  num_results_downloaded=0, date_completed=None, save=lambda: None)
+
+    def savePage(self, num_results, count=250):
+        results = PageResults({"@odata.count": count})
+        results.num_results = num_results
+        self.command.update_search_with_results(results, time.time())
+
+    def testContinuesAfterShortPage(self, _):
+        # asked for 100 results, but the API only returned 60
+        self.savePage(60)
+        self.assertEqual(self.command.cur_search.skip_value, 60)
+        self.savePage(100)
+        self.assertEqual(self.command.cur_search.skip_value, 160)
+        self.assertIsNone(self.command.cur_search.date_completed)
+        self.savePage(90)
+        self.assertEqual(self.command.cur_search.num_results_downloaded, 250)
+        self.assertIsNotNone(self.command.cur_search.date_completed)
+
+    def testCompletesOnEmptyPage(self, _):
+        self.savePage(60)
+        self.savePage(0)
+        self.assertEqual(self.command.cur_search.skip_value, 60)
+        self.assertIsNotNone(self.command.cur_search.date_completed)
+
+    @patch("textassembler_processor.management.commands.process_queue.log_error")
+    def testStopsSavingWhenFetchFails(self, *_):
+        def get_page_sizer(search):
+            raise OperationalError("server has gone away")
+        self.command.pool.get_page_sizer = get_page_sizer
+        pages = Queue()
+        self.command.fetch_pages(pages, threading.Event())
+        self.assertIsNone(pages.get(timeout=1))
+        self.assertTrue(self.command.terminate)
+
+    @override_settings(QUEUE_POLL_SECONDS=300)
+    def testWaitsAtMostThePollInterval(self, _):
+        avail_time = timezone.now() + timedelta(days=4)
+        self.command.api = SimpleNamespace(check_when_available=lambda call_type: avail_time)
+        waits = []
+        def wait(seconds):
+            waits.append(seconds)
+            self.command.terminate = len(waits) == 2
+        with patch.object(self.command.pool.stop_event, "wait", wait):
+            self.command.wait_for_download()
+        self.assertEqual(waits, [300, 300])
+
+    def testContinuesWhenPageLogFails(self, _):
+        def create(**kwargs):
+            raise OperationalError("server has gone away")
+        self.command.page_log = SimpleNamespace(objects=SimpleNamespace(create=create))
+        sizer = SimpleNamespace(page_size=100, reason="")
+        with self.assertLogs(level="WARNING"):
+            self.command.log_page(sizer, 0, 100, 1.0)
+        self.assertFalse(self.command.terminate)
+
+
+class PageStagingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base_path = self.tmp_dir.name
+        os.makedirs(os.path.join(self.base_path, "1/1/1/TXT"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stagePage(self, staging, skip_value, names):
+        finals = []
+        for name in names:
+            final = os.path.join(self.base_path, "1/1/1/TXT", name)
+            with open(staging.stage(final, skip_value), 'w') as flh:
+                flh.write(name)
+            finals.append(final)
+        return finals
+
+    def testCommitMovesFiles(self):
+        staging = PageStaging(self.base_path)
+        finals = self.stagePage(staging, 0, ["a.txt", "b.txt"])
+        self.assertFalse(any(os.path.exists(final) for final in finals))
+        staging.prepare(10)
+        staging.commit()
+        self.assertTrue(all(os.path.isfile(final) for final in finals))
+        self.assertEqual(os.listdir(os.path.join(self.base_path, STAGING_DIR)), [])
+
+    def testAbortRemovesUnpreparedPage(self):
+        staging = PageStaging(self.base_path)
+        finals = self.stagePage(staging, 0, ["a.txt"])
+        staging.abort()
+        self.assertFalse(os.path.exists(finals[0]))
+        self.assertEqual(os.listdir(os.path.join(self.base_path, STAGING_DIR)), [])
+
+    def testRecoverRollsForwardSavedPage(self):
+        staging = PageStaging(self.base_path)
+        finals = self.stagePage(staging, 10, ["a.txt", "b.txt"])
+        staging.prepare(20)
+        staging.abort() # stopped before knowing if the search record was saved
+
+        # the search record was saved with the new skip value
+        PageStaging(self.base_path).recover(20)
+        self.assertTrue(all(os.path.isfile(final) for final in finals))
+        self.assertFalse(os.path.exists(os.path.join(self.base_path, STAGING_DIR)))
+
+    def testRecoverRollsBackUnsavedPage(self):
+        staging = PageStaging(self.base_path)
+        finals = self.stagePage(staging, 10, ["a.txt", "b.txt"])
+        staging.prepare(20)
+        staging.abort()
+        # a page that was still being downloaded
+        self.stagePage(PageStaging(self.base_path), 20, ["c.txt"])
+
+        # the search record still has the skip value from before the page
+        PageStaging(self.base_path).recover(10)
+        self.assertFalse(any(os.path.exists(final) for final in finals))
+        self.assertEqual(os.listdir(os.path.join(self.base_path, "1/1/1/TXT")), [])
+        self.assertFalse(os.path.exists(os.path.join(self.base_path, STAGING_DIR)))
+
+
+class CompressionTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.zippath = os.path.join(self.tmp_dir.name, "12")
+        for (path, text) in (("1/1/1/TXT/a.txt", "a"), ("1/1/2/TXT/b.txt", "bb"), ("1/1/2/HTML/b.html", "<b>"),
+                             (f"{STAGING_DIR}/1/1/3/TXT/unsaved.txt", "x")):
+            os.makedirs(os.path.dirname(os.path.join(self.zippath, path)), exist_ok=True)
+            with open(os.path.join(self.zippath, path), 'w') as flh:
+                flh.write(text)
+
+    def testSkipsStagedFiles(self):
+        (files, total_bytes) = get_files_to_compress(self.zippath)
+        self.assertEqual(len(files), 3)
+        self.assertEqual(total_bytes, 6)
+
+    def testCompressesAndRemovesFiles(self):
+        (files, _) = get_files_to_compress(self.zippath)
+        compress_files(self.zippath, "results", files)
+        self.assertEqual(os.listdir(self.zippath), ["results.zip"])
+        with zipfile.ZipFile(os.path.join(self.zippath, "results.zip")) as zipf:
+            self.assertEqual(sorted(zipf.namelist()), ["HTML/b.html", "TXT/a.txt", "TXT/b.txt"])
+            self.assertEqual(zipf.read("TXT/b.txt"), b"bb")
+
+    def testCompressesWithThreads(self):
+        for i in range(50):
+            with open(os.path.join(self.zippath, "1/1/1/TXT", f"{i:02}.txt"), 'w') as flh:
+                flh.write(str(i) * 1000)
+        (files, _) = get_files_to_compress(self.zippath)
+        compress_files(self.zippath, "results", files, threads=4)
+        with zipfile.ZipFile(os.path.join(self.zippath, "results.zip")) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.namelist(), [re.sub(self.zippath + r'/\d+/\d+/\d+/', '', fln) for fln in files])
+            self.assertEqual(zipf.read("TXT/07.txt"), b"7" * 1000)
+
+    def testStoresWithoutCompression(self):
+        (files, _) = get_files_to_compress(self.zippath)
+        compress_files(self.zippath, "results", files, archive_format="zip_store")
+        with zipfile.ZipFile(os.path.join(self.zippath, "results.zip")) as zipf:
+            self.assertEqual({info.compress_type for info in zipf.infolist()}, {zipfile.ZIP_STORED})
+            self.assertEqual(zipf.read("HTML/b.html"), b"<b>")
+
+    @override_settings(ARCHIVE_VOLUME_MB=1)
+    def testSplitsIntoParts(self):
+        for i in range(3):
+            with open(os.path.join(self.zippath, "1/1/1/TXT", f"large{i}.txt"), 'wb') as flh:
+                flh.write(os.urandom(600 * 1024))
+        (files, _) = get_files_to_compress(self.zippath)
+        parts = compress_files(self.zippath, "results", files, threads=2)
+        self.assertEqual(sorted(os.listdir(self.zippath)), [os.path.basename(part) for part in parts])
+        self.assertEqual(len(parts), 3)
+        names = []
+        for part in parts:
+            with zipfile.ZipFile(part) as zipf:
+                self.assertIsNone(zipf.testzip())
+                names.extend(zipf.namelist())
+        self.assertEqual(len(names), len(files))
+
+    def testProducesFormatsFromRawDocuments(self):
+        doc = "<title>Title</title><nitf:body><p>First</p></nitf:body>"
+        os.makedirs(os.path.join(self.zippath, "1/1/3/RAW"))
+        with open(get_raw_path(os.path.join(self.zippath, "1/1/3"), "doc"), 'w') as flh:
+            flh.write(doc)
+        (files, _) = get_files_to_compress(self.zippath)
+        compress_files(self.zippath, "results", files, formats=["HTML", "TXT", "TXT Only"])
+        with zipfile.ZipFile(os.path.join(self.zippath, "results.zip")) as zipf:
+            self.assertEqual(sorted(zipf.namelist()), ["HTML/b.html", "HTML/doc.html", "TXT Only/doc.txt",
+                                                       "TXT/a.txt", "TXT/b.txt", "TXT/doc.txt"])
+            self.assertEqual(zipf.read("HTML/doc.html"), doc.encode("utf-8"))
+            self.assertEqual(zipf.read("TXT/doc.txt"), doc.encode("utf-8"))
+            self.assertEqual(zipf.read("TXT Only/doc.txt"), remove_html(doc).encode("utf-8"))
+
+    @override_settings(COMPRESS_CHECKPOINT_MB=0)
+    def testResumesFromCheckpoint(self):
+        (files, _) = get_files_to_compress(self.zippath)
+        checkpoints = []
+        def stop_after_second(num_compressed, num_files):
+            checkpoints.append((num_compressed, num_files))
+            if num_compressed == 2:
+                raise OSError("stopped")
+        with self.assertRaises(OSError):
+            compress_files(self.zippath, "results", files, progress=stop_after_second)
+        compress_files(self.zippath, "results", files, progress=lambda *args: checkpoints.append(args))
+        self.assertEqual(checkpoints, [(1, 3), (2, 3), (3, 3)])
+        with zipfile.ZipFile(os.path.join(self.zippath, "results.zip")) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(sorted(zipf.namelist()), ["HTML/b.html", "TXT/a.txt", "TXT/b.txt"])
+
+    def testFinishesAfterStopDuringCleanup(self):
+        (files, _) = get_files_to_compress(self.zippath)
+        compress_files(self.zippath, "results", files)
+        # the processor was stopped after removing some of the non-compressed files
+        os.makedirs(os.path.join(self.zippath, "1/1/1/TXT"))
+        with open(os.path.join(self.zippath, "1/1/1/TXT/a.txt"), 'w') as flh:
+            flh.write("a")
+        (files, _) = get_files_to_compress(self.zippath)
+        self.assertEqual(files, [os.path.join(self.zippath, "1/1/1/TXT/a.txt")])
+        self.assertEqual(compress_files(self.zippath, "results", files), [os.path.join(self.zippath, "results.zip")])
+        self.assertEqual(os.listdir(self.zippath), ["results.zip"])
+        with zipfile.ZipFile(os.path.join(self.zippath, "results.zip")) as zipf:
+            self.assertEqual(sorted(zipf.namelist()), ["HTML/b.html", "TXT/a.txt", "TXT/b.txt"])
+        # or before the search was saved
+        self.assertEqual(get_files_to_compress(self.zippath), ([], 0))
+        self.assertEqual(compress_files(self.zippath, "results", []), [os.path.join(self.zippath, "results.zip")])
+
+    @skipUnless(zstandard, "the zstandard package is not installed")
+    def testCompressesTarZst(self):
+        (files, _) = get_files_to_compress(self.zippath)
+        compress_files(self.zippath, "results", files, threads=2, archive_format="tar.zst")
+        self.assertEqual(os.listdir(self.zippath), ["results.tar.zst"])
+        with open(os.path.join(self.zippath, "results.tar.zst"), 'rb') as flh:
+            with tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(flh), mode='r|') as tar:
+                contents = {member.name: tar.extractfile(member).read() for member in tar}
+        self.assertEqual(contents, {"TXT/a.txt": b"a", "TXT/b.txt": b"bb", "HTML/b.html": b"<b>"})
+
+    @skipUnless(zstandard, "the zstandard package is not installed")
+    def testReplacesStaleTarZstParts(self):
+        os.makedirs(os.path.join(self.zippath, TAR_PARTS_DIR))
+        with open(os.path.join(self.zippath, TAR_PARTS_DIR, "results.tar.zst.1"), 'wb') as flh:
+            flh.write(b"partial")
+        (files, _) = get_files_to_compress(self.zippath)
+        self.assertEqual(len(files), 3)
+        compress_files(self.zippath, "results", files, archive_format="tar.zst")
+        self.assertEqual(os.listdir(self.zippath), ["results.tar.zst"])
+        with open(os.path.join(self.zippath, "results.tar.zst"), 'rb') as flh:
+            with tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(flh), mode='r|') as tar:
+                self.assertEqual(sorted(tar.getnames()), ["HTML/b.html", "TXT/a.txt", "TXT/b.txt"])
+
+
+class CompressSearchesTestCase(SimpleTestCase):
+
+    @override_settings(COMPRESS_IO_BUDGET_MB=1)
+    @patch("textassembler_processor.management.commands.compress_searches.get_files_to_compress")
+    def testListsWaitingSearchOnce(self, get_files):
+        get_files.return_value = (["a.txt"], 1024 * 1024)
+        command = CompressCommand()
+        command.running = {1: (None, None, 1024)}
+        command.cur_search = SimpleNamespace(search_id=2, date_submitted=timezone.now())
+        self.assertTrue(command.start_compression())
+        self.assertTrue(command.start_compression())
+        get_files.assert_called_once()
+        with patch.object(CompressCommand, "claim_search", return_value=True) as claim_search:
+            command.running = {}
+            self.assertFalse(command.start_compression())
+        claim_search.assert_called_once_with(1)
+        self.assertEqual(command.waiting, {})
+
+    @patch("textassembler_processor.management.commands.compress_searches.save_progress")
+    def testSavesWorkerProgressInMainProcess(self, save_progress):
+        command = CompressCommand()
+        command.progress = multiprocessing.Queue()
+        def saved(*args):
+            command.terminate = True
+        save_progress.side_effect = saved
+        with multiprocessing.Pool(1, initializer=init_progress_worker, initargs=(command.progress,)) as pool:
+            pool.apply(send_progress, (12, 5, 10))
+            command.save_pool_progress()
+        save_progress.assert_called_once_with(12, 5, 10)
+
+
+class ArchiveWriterTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.base_path = self.tmp_dir.name
+
+    def addPage(self, staging, skip_value, names):
+        for name in names:
+            staging.archive.add(name, name.encode("utf-8") * 10)
+        staging.prepare(skip_value)
+
+    def testFinishesZipFromSavedPages(self):
+        staging = PageStaging(self.base_path, ArchiveWriter(self.base_path))
+        staging.recover(0)
+        self.addPage(staging, 10, ["TXT/a.txt", "HTML/a.html"])
+        staging.commit()
+        self.addPage(staging, 20, ["TXT/b.txt"])
+        staging.abort() # stopped before knowing if the search record was saved
+        staging.archive.add("TXT/c.txt", b"c") # a page that was still being downloaded
+        staging.archive.close()
+
+        # the search record still has the skip value from before the second page
+        staging = PageStaging(self.base_path, ArchiveWriter(self.base_path))
+        staging.recover(10)
+        self.addPage(staging, 20, ["TXT/d.txt"])
+        staging.commit()
+        staging.archive.close()
+
+        compress_files(self.base_path, "results", get_files_to_compress(self.base_path)[0])
+        self.assertFalse(os.path.exists(os.path.join(self.base_path, ARCHIVE_DIR)))
+        with zipfile.ZipFile(os.path.join(self.base_path, "results.zip")) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.namelist(), ["TXT/a.txt", "HTML/a.html", "TXT/d.txt"])
+            self.assertEqual(zipf.read("TXT/d.txt"), b"TXT/d.txt" * 10)
+
+    def testSplitsIntoVolumes(self):
+        staging = PageStaging(self.base_path, ArchiveWriter(self.base_path, volume_bytes=200))
+        staging.recover(0)
+        self.addPage(staging, 10, [f"TXT/{i}.txt" for i in range(4)])
+        staging.commit()
+        for i in range(4, 8):
+            staging.archive.add(f"TXT/{i}.txt", b"x" * 100)
+        staging.abort() # the second page was not finished
+        self.assertFalse(os.path.exists(staging.archive.get_body_path(3)))
+        staging.archive.close()
+
+        files = compress_files(self.base_path, "results", [])
+        self.assertEqual([os.path.basename(fln) for fln in files], ["results_part001.zip", "results_part002.zip"])
+        names = []
+        for fln in files:
+            with zipfile.ZipFile(fln) as zipf:
+                self.assertIsNone(zipf.testzip())
+                names.extend(zipf.namelist())
+        self.assertEqual(names, [f"TXT/{i}.txt" for i in range(4)])
+
+    def testLargeArchiveUsesZip64(self):
+        archive = ArchiveWriter(self.base_path).open(0)
+        for i in range(70000):
+            archive.add(f"TXT/{i}.txt", b"")
+        archive.prepare(70000)
+        archive.commit()
+        archive.finalize(os.path.join(self.base_path, "results.zip"))
+        with zipfile.ZipFile(os.path.join(self.base_path, "results.zip")) as zipf:
+            self.assertEqual(len(zipf.infolist()), 70000)
+            self.assertEqual(zipf.read("TXT/69999.txt"), b"")
+
+
+class SegmentStoreTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.base_path = self.tmp_dir.name
+
+    def addPage(self, staging, skip_value, names):
+        for name in names:
+            staging.segments.add(f"urn:contentItem:{name}", name, f"<p>{name}</p>")
+        staging.prepare(skip_value)
+
+    def testLooksUpSavedDocuments(self):
+        staging = PageStaging(self.base_path, segments=SegmentStore(self.base_path, volume_bytes=20))
+        staging.recover(0)
+        self.addPage(staging, 10, ["a", "b", "c"])
+        staging.commit()
+        staging.segments.add("urn:contentItem:d", "d", "<p>d</p>") # a page that was not finished
+        staging.abort()
+        staging.close()
+
+        staging = PageStaging(self.base_path, segments=SegmentStore(self.base_path, volume_bytes=20))
+        staging.recover(10)
+        self.addPage(staging, 20, ["e"])
+        staging.commit()
+        staging.close()
+
+        reader = SegmentReader(self.base_path)
+        self.addCleanup(reader.close)
+        self.assertEqual([entry[1] for entry in reader.read_index()], ["a", "b", "c", "e"])
+        self.assertEqual(reader.get("urn:contentItem:e"), "<p>e</p>")
+        self.assertEqual(reader.get("urn:contentItem:b"), "<p>b</p>")
+        self.assertIsNone(reader.get("urn:contentItem:d"))
+        self.assertTrue(os.path.isfile(reader.store.get_body_path(2)))
+
+    def testCompressesSegments(self):
+        staging = PageStaging(self.base_path, segments=SegmentStore(self.base_path))
+        staging.recover(0)
+        self.addPage(staging, 10, ["a", "b"])
+        staging.commit()
+        staging.close()
+
+        (files, total_bytes) = get_files_to_compress(self.base_path)
+        self.assertEqual(total_bytes, 16)
+        compress_files(self.base_path, "results", files, threads=2, formats=["HTML", "TXT Only"])
+        self.assertEqual(os.listdir(self.base_path), ["results.zip"])
+        with zipfile.ZipFile(os.path.join(self.base_path, "results.zip")) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.namelist(), ["HTML/a.html", "TXT Only/a.txt", "HTML/b.html", "TXT Only/b.txt"])
+            self.assertEqual(zipf.read("HTML/b.html"), b"<p>b</p>")
+
+
+class NITFTestCase(SimpleTestCase):
+
+    def assertSameText(self, doc):
+        self.assertEqual(remove_html(doc), remove_html_soup(doc))
+
+    def testCorpusMatchesBeautifulSoup(self):
+        for doc in generate_corpus(50, 5):
+            self.assertSameText(doc)
+
+    def testExtractsTitleHeadlineAndBody(self):
+        doc = ("<title>Title</title><nitf:hedline><nitf:hl1>Head &amp; line</nitf:hl1></nitf:hedline>"
+               "<nitf:body><p>First</p>\n<p>caf&eacute; &#8220;q&#8221; &#150;</p></nitf:body>")
+        self.assertEqual(remove_html(doc), "Title\n\nHead & line\n\nFirst\ncafé “q” –")
+        self.assertSameText(doc)
+
+    def testMarkupEdgeCases(self):
+        docs = [
+            "<title>Same</title><h1>Same</h1><nitf:body>text</nitf:body>",
+            "<title>A <b>mixed</b> title</title><h1><span>Nested</span></h1><nitf:body>x</nitf:body>",
+            "<title>T</title><nitf:body><p>   </p>\n\n<pre>  </pre><!-- note --><br>after</br></nitf:body>",
+            "<nitf:body><p>unclosed <i>tags</nitf:body> trailing</p>",
+            "<nitf:body>bare & ampersand &unknown; <a href=unquoted>link</a></nitf:body>",
+            "<!DOCTYPE html><html><title>T</title><script>var a = '<b>';</script><nitf:body>b</nitf:body></html>",
+            "no markup at all",
+            "",
+        ]
+        for doc in docs:
+            self.assertSameText(doc)
+
+
+class MockAPITestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = MockAPIServer(results=30, paragraphs=2, latency=0, latency_per_result=0,
+                                    limits={"search": (5, 50, 500), "download": (2, 50, 500), "sources": (5, 50, 500)}).start()
+        self.addCleanup(self.server.stop)
+        token = requests.post(f"{self.server.url}/oauth/v2/token", data={"grant_type": "client_credentials"}).json()
+        self.headers = {"Authorization": f"Bearer {token['access_token']}"}
+
+    def download(self, skip, top=20):
+        return requests.get(f"{self.server.url}/v1/News", headers=self.headers,
+                            params={"$search": "term", "$expand": "Document", "$top": top, "$skip": skip})
+
+    def testRequiresToken(self):
+        resp = requests.get(f"{self.server.url}/v1/News", params={"$search": "term"})
+        self.assertEqual(resp.status_code, 401)
+
+    def testDownloadPages(self):
+        first = self.download(0).json()
+        last = self.download(20).json()
+        self.assertEqual(first["@odata.count"], 30)
+        self.assertEqual([len(first["value"]), len(last["value"])], [20, 10])
+        self.assertIn("<nitf:body", first["value"][0]["Document"]["Content"])
+        ids = [result["ResultId"] for result in first["value"] + last["value"]]
+        self.assertEqual(len(set(ids)), 30)
+
+    def testRateLimits(self):
+        resp = self.download(0)
+        self.assertEqual(resp.headers["X-RateLimit-Limit"], "2/50/500")
+        self.assertEqual(resp.headers["X-RateLimit-Remaining"], "1/49/499")
+        self.assertEqual(self.download(0).status_code, 200)
+        resp = self.download(0)
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["X-RateLimit-Remaining"], "0/48/498")
+
+        # other types of calls have their own limits
+        resp = requests.get(f"{self.server.url}/v1/News", headers=self.headers, params={"$search": "term", "$expand": "PostFilters"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("PostFilters", resp.json()["value"][0])
+
+    def testInjectedErrors(self):
+        self.server.options.error_rate_5xx = 1.0
+        self.assertIn(self.download(0).status_code, (500, 502, 503))
+        self.server.options.error_rate_5xx = 0.0
+        self.server.options.error_rate_429 = 1.0
+        resp = self.download(0)
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["X-RateLimit-Remaining"], "2/50/500")
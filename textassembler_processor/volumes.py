@@ -0,0 +1,205 @@
+'''
+Append-only files that follow the pages of a search, used for the zip file built while
+a search is downloaded (see archive.py) and the documents of a search (see segments.py).
+
+The results are appended to [store]/[name].body, and a line describing each of them is
+appended to [store]/[name].idx. Before the search record is updated for a page, the body
+and index are flushed to disk and their sizes are added to [store]/[name].ckpt with the
+skip value the search will have. When the search is picked up again, the body and index
+are truncated to the sizes saved for the skip value on the search record, removing any
+results from a page that was not saved.
+
+When a volume size is given, a new body ([store]/[name].002.body, etc.) is started once
+the current one would go over it.
+'''
+import os
+import json
+import logging
+
+class VolumeWriter: # pylint: disable=too-many-instance-attributes
+    '''
+    Body and index files of a search that results are appended to as they are downloaded
+    '''
+
+    def __init__(self, store_path, name, volume_bytes=0):
+        '''
+        Params:
+            store_path (string): Directory of the files, i.e. [STORAGE_LOCATION]/[Search ID]/.archive
+            name (string): Name of the files in the directory
+            volume_bytes (int): Size to start a new volume at, 0 to keep everything in one body
+        '''
+        self.store_path = store_path
+        self.name = name
+        self.volume_bytes = volume_bytes
+        self.index_path = os.path.join(self.store_path, f"{name}.idx")
+        self.checkpoint_path = os.path.join(self.store_path, f"{name}.ckpt")
+        self.body = None
+        self.index = None
+        self.volumes = [0] # sizes of the volumes written before the current one
+        self.committed = {"skip_value": 0, "volumes": [0], "index": 0} # sizes as of the last saved page
+        self.prepared = None # sizes for the page waiting on the search record to be saved
+
+    def get_body_path(self, volume):
+        '''
+        Path of the body of a volume of the store (numbered from 1)
+        '''
+        return os.path.join(self.store_path, f"{self.name}.body" if volume == 1 else f"{self.name}.{volume:03}.body")
+
+    def open(self, skip_value=None):
+        '''
+        Open the store to add results to, removing anything added after the page
+        the search record was last saved with
+        Params:
+            skip_value (int): The skip value currently saved on the search record,
+                or None to keep everything that was saved by a page
+        '''
+        os.makedirs(self.store_path, exist_ok=True)
+        self.committed = self.find_checkpoint(skip_value)
+        self.prepared = None
+        self.restore(self.committed)
+        self.write_checkpoints([self.committed])
+        return self
+
+    def restore(self, checkpoint):
+        '''
+        Truncate the volumes and index to the sizes in the checkpoint
+        '''
+        if self.body is not None:
+            self.body.close()
+        volume = len(checkpoint["volumes"]) + 1
+        while os.path.isfile(self.get_body_path(volume)):
+            logging.warning(f"Removing {self.get_body_path(volume)} added after the last saved page.")
+            os.remove(self.get_body_path(volume))
+            volume = volume + 1
+        for (volume, size) in enumerate(checkpoint["volumes"], 1):
+            self.body = open_file(self.get_body_path(volume))
+            truncate_file(self.body, size)
+            if volume < len(checkpoint["volumes"]):
+                self.body.close()
+        self.volumes = list(checkpoint["volumes"][:-1])
+        if self.index is None:
+            self.index = open_file(self.index_path)
+        truncate_file(self.index, checkpoint["index"])
+
+    def close(self):
+        '''
+        Close the files of the store
+        '''
+        for flh in (self.body, self.index):
+            if flh is not None:
+                flh.close()
+        self.body = None
+        self.index = None
+
+    def find_checkpoint(self, skip_value):
+        '''
+        Get the sizes of the volumes and index saved for the given skip value
+        '''
+        found = {"skip_value": 0, "volumes": [0], "index": 0}
+        if not os.path.isfile(self.checkpoint_path):
+            return found
+        with open(self.checkpoint_path) as flh:
+            for line in flh:
+                try:
+                    checkpoint = json.loads(line)
+                except ValueError:
+                    break # the last line was not completely written
+                if skip_value is None or checkpoint["skip_value"] <= skip_value:
+                    found = checkpoint
+        return found
+
+    def write_checkpoints(self, checkpoints):
+        '''
+        Replace the checkpoint file with the given checkpoints
+        '''
+        with open(self.checkpoint_path + ".tmp", 'w') as flh:
+            for checkpoint in checkpoints:
+                flh.write(json.dumps(checkpoint) + "\n")
+            flh.flush()
+            os.fsync(flh.fileno())
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def next_volume(self):
+        '''
+        Finish writing the current volume and start the next one
+        '''
+        self.body.flush()
+        os.fsync(self.body.fileno())
+        self.volumes.append(self.body.tell())
+        self.body.close()
+        self.body = open_file(self.get_body_path(len(self.volumes) + 1))
+        truncate_file(self.body, 0)
+
+    def get_sizes(self):
+        '''
+        Get the current sizes of the volumes and index
+        '''
+        return {"volumes": self.volumes + [self.body.tell()], "index": self.index.tell()}
+
+    def prepare(self, skip_value):
+        '''
+        Make sure the results added for the page are on disk and record the sizes of
+        the store for the page. This must be done before the search record is updated
+        with the skip_value.
+        '''
+        self.sync()
+        self.prepared = dict(self.get_sizes(), skip_value=skip_value)
+        self.write_checkpoints([self.committed, self.prepared])
+
+    def checkpoint(self, members):
+        '''
+        Make sure the files added so far are on disk and record the sizes of the store,
+        so compression can resume from here if the processor is stopped
+        Params:
+            members (int): Number of the files being compressed that have been added
+        '''
+        self.sync()
+        self.committed = dict(self.get_sizes(), skip_value=self.committed["skip_value"], members=members)
+        self.write_checkpoints([self.committed])
+
+    def sync(self):
+        '''
+        Write the volume and index to disk
+        '''
+        for flh in (self.body, self.index):
+            flh.flush()
+            os.fsync(flh.fileno())
+
+    def commit(self):
+        '''
+        The search record was saved, so the prepared page is now part of the search
+        '''
+        if self.prepared is not None:
+            self.committed = self.prepared
+            self.prepared = None
+
+    def abort(self):
+        '''
+        Remove the results added for a page that will not be saved. If the page was
+        already prepared, it is left to be kept or removed when the search is picked up
+        again, since it is not known if the search record was saved.
+        '''
+        if self.body is None or self.prepared is not None:
+            return
+        self.body.flush()
+        self.index.flush()
+        self.restore(self.committed)
+
+
+def open_file(file_path):
+    '''
+    Open a file of the store for writing at its end, creating it if needed
+    '''
+    flh = os.fdopen(os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+    flh.seek(0, os.SEEK_END)
+    return flh
+
+def truncate_file(flh, size):
+    '''
+    Remove anything written to the file after the given size
+    '''
+    flh.seek(0, os.SEEK_END)
+    if flh.tell() != size:
+        logging.warning(f"Removing {flh.tell() - size} byte(s) added to {flh.name} after the last saved page.")
+        flh.truncate(size)
+        flh.seek(size)
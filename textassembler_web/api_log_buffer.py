@@ -0,0 +1,73 @@
+'''
+Buffered writes to the api_log table.
+
+Logging every API call with its own INSERT puts a database write on the request path
+of every search page and every page of downloads. The rows are instead collected in
+memory and written with a single bulk_create once API_LOG_BATCH_SIZE rows have been
+collected, API_LOG_FLUSH_SECONDS after the oldest row was added, or when the process
+exits (the queue processor also flushes once its workers have stopped).
+'''
+import atexit
+import logging
+import threading
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+class APILogBuffer:
+    '''
+    Rows for the api_log table waiting to be written
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock() # add flushes while holding the lock
+        self.rows = []
+        self.timer = None
+
+    def add(self, **fields):
+        '''
+        Add a row to be written, with the current time as the request date
+        '''
+        api_log = apps.get_model('textassembler_processor', 'api_log')
+        fields.setdefault("request_date", timezone.now())
+        with self.lock:
+            self.rows.append(api_log(**fields))
+            if len(self.rows) >= settings.API_LOG_BATCH_SIZE or settings.API_LOG_FLUSH_SECONDS <= 0:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(settings.API_LOG_FLUSH_SECONDS, self.flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        '''
+        Write all of the rows collected so far
+        '''
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            rows = self.rows
+            self.rows = []
+            if not rows:
+                return
+            api_log = apps.get_model('textassembler_processor', 'api_log')
+            try:
+                api_log.objects.bulk_create(rows)
+            except DatabaseError as exc:
+                # the log is only used for statistics, so the calls are not worth stopping for
+                logging.warning(f"Unable to write {len(rows)} API log record(s). {exc}")
+
+    def flush_from_timer(self):
+        '''
+        Flush from the timer thread, which has its own database connection
+        '''
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+API_LOG = APILogBuffer()
+atexit.register(API_LOG.flush)
@@ -5,27 +5,41 @@ import logging
 import base64
 import datetime
 import json
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
-from django.apps import apps
 from django.utils import timezone
-from django.db import OperationalError
+from django.db import transaction, DatabaseError
 from .utilities import log_error
 from .filters import get_enum_namespace, get_format_type
-from .models import api_limits, CallTypeChoice
+from .models import api_tokens
+from .result_stream import ResultStream
+from .api_log_buffer import API_LOG
+from .rate_limiter import get_rate_limiter
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+TOKEN = (None, None, None) # (access token, expiration time, issued time) last used in the process
 
 class LNAPI:
     '''
     API for Lexis Nexis
     '''
 
-    def __init__(self):
+    def __init__(self, session=None):
         '''
         Initialize the object and authenticate against the API
+        Params:
+            session (requests.Session): Session to make the calls with, defaults to the
+                                        session shared by every LNAPI in the process
         '''
-        self.api_log = apps.get_model('textassembler_processor', 'api_log')
+        self.session = session if session is not None else get_session()
         self.access_token = None
         self.expiration_time = None
+        self.issued_time = None
 
         self.api_url = settings.LN_API_URL
         if not self.api_url.endswith("/"):
@@ -37,25 +51,59 @@ class LNAPI:
         '''
         Authenticate against the LexisNexis API to obtain an access token, if we already have one
         that has not expired, do nothing.
+        The token is shared by every process (web application and processors) through the
+        api_tokens table, and is refreshed TOKEN_REFRESH_SECONDS (or half of its lifetime,
+        if that is shorter) before it expires.
         '''
 
         # Do not get a new token since the current one is still valid
-        if self.access_token is not None and self.expiration_time is not None and timezone.now() <= self.expiration_time:
+        if self.access_token is not None and token_is_valid(self.expiration_time, self.issued_time):
+            return ""
+
+        # Use the token another LNAPI in the process already has
+        (access_token, expiration_time, issued_time) = TOKEN
+        if access_token is not None and token_is_valid(expiration_time, issued_time):
+            (self.access_token, self.expiration_time, self.issued_time) = (access_token, expiration_time, issued_time)
             return ""
 
+        try:
+            with transaction.atomic():
+                # Lock the stored token so only one process requests a new one at a time
+                api_tokens.objects.get_or_create(client_id=settings.LN_CLIENT_ID)
+                stored = api_tokens.objects.select_for_update().get(client_id=settings.LN_CLIENT_ID)
+                # the token is saved as soon as it is issued
+                if stored.access_token is not None and token_is_valid(stored.expiration_time, stored.update_date):
+                    self.set_token(stored.access_token, stored.expiration_time, stored.update_date)
+                    return ""
+
+                error = self.request_token()
+                if not error:
+                    stored.access_token = self.access_token
+                    stored.expiration_time = self.expiration_time
+                    stored.save()
+                return error
+        except DatabaseError as exc:
+            logging.warning(f"Unable to use the stored access token. {exc}")
+            return self.request_token()
+
+    def request_token(self):
+        '''
+        Request a new access token from the API
+        returns: error message if the token could not be obtained
+        '''
         logging.info("Obtaining new access token")
         data = {'grant_type': 'client_credentials',
                 'scope': settings.LN_SCOPE}
 
-        access_token_response = requests.post(settings.LN_TOKEN_URL, \
+        access_token_response = self.session.post(settings.LN_TOKEN_URL, \
             data=data, verify=True, \
             auth=(settings.LN_CLIENT_ID, settings.LN_CLIENT_SECRET), \
             timeout=settings.LN_TIMEOUT)
 
         if access_token_response.status_code == requests.codes.ok: #pylint: disable=no-member
             tokens = access_token_response.json()
-            self.access_token = tokens['access_token']
-            self.expiration_time = timezone.now() + datetime.timedelta(seconds=int(tokens['expires_in']))
+            now = timezone.now()
+            self.set_token(tokens['access_token'], now + datetime.timedelta(seconds=int(tokens['expires_in'])), now)
         else:
             results = access_token_response.json()
             log_error(f"Error occurred obtaining access token. Return code: {access_token_response.status_code}. Response:", results)
@@ -65,48 +113,51 @@ class LNAPI:
             return error
         return ""
 
-    def check_when_available(self, limit_type='search'): # pylint:disable=too-many-return-statements, no-self-use
+    def set_token(self, access_token, expiration_time, issued_time=None):
+        '''
+        Use the access token for this and any new LNAPI in the process
+        '''
+        global TOKEN # pylint: disable=global-statement
+        self.access_token = access_token
+        self.expiration_time = expiration_time
+        self.issued_time = issued_time
+        TOKEN = (access_token, expiration_time, issued_time)
+
+    def check_when_available(self, limit_type='search'): # pylint: disable=no-self-use
         '''
-        Note: Disabling too many return statements since it keeps the code more readable
         Note: Disabling no self use because other classes use it and it makes more
         sence and class function that importing it as a utility separately
 
-        Check how many seconds until the given service API is available to call
+        Check when the given service API is available to call
         returns: datetime when it is available again
         '''
-        service = CallTypeChoice.SRH
-        if limit_type == 'download':
-            service = CallTypeChoice.DWL
-        if limit_type == 'sources':
-            service = CallTypeChoice.SRC
-
-        limits = api_limits.objects.get(limit_type=service)
-        (in_run_window, start_time) = is_in_run_window()
-
-        # If it is for sources or search, or within the run window for downloads: check if available now
-        if limit_type != 'download' or in_run_window:
-            if limits.remaining_per_minute > 0 and limits.remaining_per_hour > 0 and limits.remaining_per_day > 0:
-                return timezone.now()
-            if limits.remaining_per_day == 0 and limits.reset_on_day < timezone.now():
-                return timezone.now()
-            if limits.remaining_per_hour == 0 and limits.reset_on_hour < timezone.now():
-                return timezone.now()
-            if limits.remaining_per_minute == 0 and limits.reset_on_minute < timezone.now():
-                return timezone.now()
-        # Else calculate time remaining to wait
-        start_time = timezone.make_aware(start_time) if not timezone.is_aware(start_time) else start_time
-        all_dates = [limits.reset_on_day, limits.reset_on_hour, limits.reset_on_minute, start_time]
+        avail_time = get_rate_limiter(limit_type).next_available()
+
+        # Downloads are also limited to the run window, so if the limits reset outside
+        # of it the next download is at the start of the following run window
         if limit_type == 'download':
-            return max(all_dates)
-        if limits.remaining_per_day == 0:
-            return limits.reset_on_day
-        if limits.remaining_per_hour == 0:
-            return limits.reset_on_hour
-        if limits.remaining_per_minute == 0:
-            return limits.reset_on_minute
+            avail_time = get_next_run_time(avail_time)
+        return avail_time
 
-        # Failsafe, should never get to this point
-        return timezone.now()
+    def calls_remaining(self, limit_type='search'): # pylint: disable=no-self-use
+        '''
+        Get the number of calls that can still be made to the given service before
+        reaching the lowest of the min/hour/day limits. A limit that has already reset
+        counts as its full limit (or as a single call if the limit is not known).
+        returns: int number of calls remaining
+        '''
+        return get_rate_limiter(limit_type).calls_remaining()
+
+    def reserve(self, limit_type='search'): # pylint: disable=no-self-use
+        '''
+        Reserve a call to the given service out of the remaining limits, so that calls made
+        at the same time by other threads do not go over the limits. The reserved call is
+        used by passing reserved=True to api_call (or download).
+        returns: bool if a call was reserved
+        '''
+        if self.check_when_available(limit_type) > timezone.now():
+            return False
+        return get_rate_limiter(limit_type).acquire()
 
     def api_update_rate_limit(self, limit_type='search'):
         '''
@@ -119,36 +170,42 @@ class LNAPI:
 
         headers = {"Authorization": "Bearer " + self.access_token}
         resp = None
+        start_time = time.time()
 
         # Call the API
         if limit_type.lower() == 'search':
             url = self.api_url + "News"
-            resp = requests.get(url, params=None, headers=headers, timeout=settings.LN_TIMEOUT)
+            resp = self.session.get(url, params=None, headers=headers, timeout=settings.LN_TIMEOUT)
 
         elif limit_type.lower() == 'download':
             url = self.api_url + "News"
-            resp = requests.get(url, params={"$expand": "Document"}, headers=headers, timeout=settings.LN_TIMEOUT)
+            resp = self.session.get(url, params={"$expand": "Document"}, headers=headers, timeout=settings.LN_TIMEOUT)
 
         elif limit_type.lower() == 'sources':
             url = self.api_url + "Sources"
-            resp = requests.get(url, params=None, headers=headers, timeout=settings.LN_TIMEOUT)
+            resp = self.session.get(url, params=None, headers=headers, timeout=settings.LN_TIMEOUT)
 
         # Log the API call
-        self.api_log.objects.create(
+        API_LOG.add(
             request_url=resp.url,
             request_type="GET",
             response_code=resp.status_code,
             num_results=0,
-            is_download=True if limit_type.lower() == 'download' else False)
+            is_download=True if limit_type.lower() == 'download' else False,
+            response_seconds=time.time() - start_time,
+            response_bytes=len(resp.content))
 
         # Update the limits
-        update_limits(limit_type, resp.headers)
+        get_rate_limiter(limit_type.lower()).update(resp.headers, save=True)
 
         return None
 
-    def api_call(self, req_type='GET', resource='News', params=None):
+    def api_call(self, req_type='GET', resource='News', params=None, stream=False, reserved=False): # pylint: disable=too-many-locals, too-many-arguments, too-many-branches
         '''
         Calls the API given the request type, resource, and parameters. Returns the response
+        If stream is set, a successful response is returned as a ResultStream that decodes
+        the results as they are read instead of loading the full response at once.
+        If reserved is set, the call was already reserved out of the limits with reserve.
         '''
 
         is_download = True if "$expand" in params and params['$expand'] == "Document" else False
@@ -157,40 +214,64 @@ class LNAPI:
         service = 'sources' if resource == 'Sources' else service
 
         # Make sure we are within the API throttling limits
-        avail_time = self.check_when_available(service)
-        if avail_time > timezone.now():
+        if not reserved and not self.reserve(service):
+            avail_time = self.check_when_available(service)
             return {"error_message":f"There are no LexisNexis {service} remaining for the current min/hour/day. Next available at {avail_time}"}
 
-        error_message = self.authenticate()
-        if error_message:
-            return {"error_message": error_message}
-
-        headers = {"Authorization": "Bearer " + self.access_token}
-        url = self.api_url + resource
+        limiter = get_rate_limiter(service)
+        resp = None
+        start_time = time.time()
+        try:
+            error_message = self.authenticate()
+            if error_message:
+                return {"error_message": error_message}
+
+            headers = {"Authorization": "Bearer " + self.access_token}
+            url = self.api_url + resource
+
+            if req_type == "GET":
+                resp = self.session.get(url, params=params, headers=headers, timeout=settings.LN_TIMEOUT, stream=stream)
+            if req_type == "POST":
+                resp = self.session.post(url, params=params, headers=headers, timeout=settings.LN_TIMEOUT, stream=stream)
+        finally:
+            # The limits are in the headers so they can be updated before the response is read.
+            # If the API was never reached, the call is given back.
+            limiter.release(resp.headers if resp is not None and resp.status_code == requests.codes.ok else None, # pylint: disable=no-member
+                            used=resp is not None)
+
+        if stream and resp.status_code == requests.codes.ok: # pylint: disable=no-member
+            # The call is logged once the response has been read
+            results = ResultStream(resp, on_complete=lambda metadata: API_LOG.add(
+                request_url=resp.url,
+                request_type=req_type,
+                response_code=resp.status_code,
+                num_results=metadata.get("@odata.count", 0),
+                is_download=is_download,
+                response_seconds=time.time() - start_time,
+                response_bytes=results.num_bytes))
+            return results
 
-        if req_type == "GET":
-            resp = requests.get(url, params=params, headers=headers, timeout=settings.LN_TIMEOUT)
-        if req_type == "POST":
-            resp = requests.post(url, params=params, headers=headers, timeout=settings.LN_TIMEOUT)
+        results = None
+        try:
+            results = resp.json()
+        except json.decoder.JSONDecodeError:
+            results = "[Could not parse response]"
 
         # Log the API call
-        result_count = resp.json()["@odata.count"] if resp.status_code == requests.codes.ok and "@odata.count" in resp.json().keys() else 0  #pylint: disable=no-member
-        self.api_log.objects.create(
+        result_count = 0
+        if resp.status_code == requests.codes.ok and isinstance(results, dict) and "@odata.count" in results: #pylint: disable=no-member
+            result_count = results["@odata.count"]
+        API_LOG.add(
             request_url=resp.url,
             request_type=req_type,
             response_code=resp.status_code,
             num_results=result_count,
-            is_download=is_download)
-
-        results = None
-        try:
-            results = resp.json()
-        except json.decoder.JSONDecodeError:
-            results = "[Could not parse response]"
+            is_download=is_download,
+            response_seconds=time.time() - start_time,
+            response_bytes=len(resp.content))
 
         # Check response code
         if resp.status_code == requests.codes.ok: # pylint: disable=no-member
-            update_limits(service, resp.headers)
             return results
         else:
             error_message = "An unexpected API error occurred."
@@ -223,29 +304,84 @@ class LNAPI:
 
         return self.api_call(resource='News', params=params)
 
-    def download(self, term="", set_filters=None, sort_order="Date", download_cnt=50, skip=0): # pylint: disable=too-many-arguments
+    def download(self, term="", set_filters=None, sort_order="Date", download_cnt=50, skip=0, # pylint: disable=too-many-arguments
+                 stream=False, reserved=False):
         '''
         Download the full-text results from the API given the search term and filters.
+        If stream is set, the results are returned as a ResultStream to iterate through.
+        If reserved is set, the call was already reserved with reserve('download').
         @return API results with full text
         '''
-        filters = convert_filters_to_query_string(set_filters)
+        params = get_download_params(term, set_filters, sort_order)
+        return self.download_page(params, download_cnt, skip, stream=stream, reserved=reserved)
 
-        # Always provide the $exand=Document so we get the full text result
-        params = {"$search":term, "$expand": "Document", "$top": download_cnt, "$skip": skip}
+    def download_page(self, params, download_cnt=50, skip=0, stream=False, reserved=False): # pylint: disable=too-many-arguments
+        '''
+        Download a page of full-text results given the parameters from get_download_params,
+        which do not need to be built again for each page of the same search.
+        @return API results with full text
+        '''
+        page_params = {"$search": params["$search"], "$expand": params["$expand"], "$top": download_cnt, "$skip": skip}
+        page_params.update(params)
+        return self.api_call(resource='News', params=page_params, stream=stream, reserved=reserved)
 
-        if filters:
-            params['$filter'] = filters
-        if sort_order:
-            params["$orderby"] = sort_order
+def get_download_params(term="", set_filters=None, sort_order="Date"):
+    '''
+    Build the parameters to download the full-text results for the search term and filters,
+    other than the page to get ($top and $skip)
+    '''
+    filters = convert_filters_to_query_string(set_filters)
 
-        return self.api_call(resource='News', params=params)
+    # Always provide the $exand=Document so we get the full text result
+    params = {"$search":term, "$expand": "Document"}
+
+    if filters:
+        params['$filter'] = filters
+    if sort_order:
+        params["$orderby"] = sort_order
+    return params
+
+def token_is_valid(expiration_time, issued_time=None):
+    '''
+    Check if a token expiring at the given time can still be used, leaving
+    TOKEN_REFRESH_SECONDS to refresh it before it expires. For a token that does not
+    last much longer than that, only half of its lifetime is left to refresh it, so
+    a new token is not requested for every call.
+    '''
+    if expiration_time is None:
+        return False
+    refresh = datetime.timedelta(seconds=settings.LN_TOKEN_REFRESH_SECONDS)
+    if issued_time is not None:
+        refresh = min(refresh, (expiration_time - issued_time) / 2)
+    return timezone.now() + refresh < expiration_time
+
+def get_session():
+    '''
+    Get the HTTP session shared by all of the API calls in the process. Keeping the
+    connections open between calls saves a new TCP and TLS handshake for every page.
+    Connection failures (before the request is sent) are retried, but reads are not
+    since the call may have already counted against the API limits.
+    returns: requests.Session
+    '''
+    global SESSION # pylint: disable=global-statement
+    with SESSION_LOCK:
+        if SESSION is None:
+            retries = Retry(total=settings.LN_CONNECT_RETRIES, connect=settings.LN_CONNECT_RETRIES, read=0,
+                            status=0, redirect=False, backoff_factor=0.5, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=settings.LN_POOL_SIZE, pool_maxsize=settings.LN_POOL_SIZE,
+                                  max_retries=retries)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            SESSION = session
+        return SESSION
 
 def is_in_run_window():
     '''
     Calculate the datetime run window for the download processor
     returns: (bool, datetime) if we are in the run window or not and when the start time is
     '''
-    now = datetime.datetime.now()
+    now = timezone.localtime().replace(tzinfo=None)
     in_window, start_time = check_window(now)
 
     if not in_window:
@@ -255,89 +391,61 @@ def is_in_run_window():
             "End time: 6 am Monday"
         )
         logging.debug(message)
-        return (False, start_time)
-    return (True, timezone.make_aware(start_time))
+    return (in_window, timezone.make_aware(start_time))
 
 
 def check_window(now):
-    day_of_week = now.weekday()
-    if day_of_week == 5 or day_of_week == 6:  # sat/sun
-        start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_time = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(1)
-        all_day = True
-    elif day_of_week == 4:  # fri
-        start_time = now.replace(hour=22, minute=0, second=0, microsecond=0)
-        end_time = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(1)
-        all_day = False
-    elif day_of_week == 0:  # mon
-        start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_time = now.replace(hour=6, minute=0, second=0, microsecond=0)
-        all_day = False
-    else:
-        start_time = now + datetime.timedelta(minutes=2)
-        end_time = now - datetime.timedelta(minutes=2)
-        all_day = False
-    today = start_time <= now < end_time
-    in_window = all_day or today
-    return in_window, start_time
-
-
-def update_limits(service, headers):
     '''
-    Updates the limits in the database
+    Check if the given (local) time is in the run window
+    returns: (bool, datetime) if it is in the run window, and when the run window it is in started
+             or when the next one starts if it is not in one
     '''
-    limit_type = CallTypeChoice.SRH
-    if service == 'download':
-        limit_type = CallTypeChoice.DWL
-    if service == 'sources':
-        limit_type = CallTypeChoice.SRC
-
-    # Update the DB with the current rate limits remaining
-    limits = api_limits.objects.get(limit_type=limit_type)
-    if headers and 'X-RateLimit-Limit' in headers:
-        vals = str(headers['X-RateLimit-Limit']).split('/')
-        limits.limits_per_minute = int(vals[0])
-        limits.limits_per_hour = int(vals[1])
-        limits.limits_per_day = int(vals[2])
-    if headers and 'X-RateLimit-Reset' in headers:
-        vals = str(headers['X-RateLimit-Reset']).split('/')
-        limits.reset_on_minute = timezone.make_aware(datetime.datetime.fromtimestamp(int(vals[0])))
-        limits.reset_on_hour = timezone.make_aware(datetime.datetime.fromtimestamp(int(vals[1])))
-        limits.reset_on_day = timezone.make_aware(datetime.datetime.fromtimestamp(int(vals[2])))
-    if headers and 'X-RateLimit-Remaining' in headers:
-        vals = str(headers['X-RateLimit-Remaining']).split('/')
-        limits.remaining_per_minute = int(vals[0])
-        limits.remaining_per_hour = int(vals[1])
-        limits.remaining_per_day = int(vals[2])
-
-    # Save to the database
-    try:
-        limits.save()
-        logging.debug(f"Updated limits for {service}.")
-    except OperationalError as exc:
-        log_error(f"Unable to save the new limits to the database for {service}. Error: {exc}")
-        return
+    (start_time, end_time) = get_run_window(now)
+    return start_time <= now < end_time, start_time
+
+
+def get_run_window(now):
+    '''
+    Get the run window (10 pm Friday until 6 am Monday) the given (local) time is in, or the next one
+    if it is not in one
+    returns: (datetime, datetime) when the run window starts and ends
+    '''
+    friday = now - datetime.timedelta(days=(now.weekday() - 4) % 7)
+    start_time = friday.replace(hour=22, minute=0, second=0, microsecond=0)
+    end_time = start_time + datetime.timedelta(days=2, hours=8)
+    if now >= end_time:
+        start_time = start_time + datetime.timedelta(days=7)
+        end_time = end_time + datetime.timedelta(days=7)
+    return (start_time, end_time)
+
+
+def get_next_run_time(when):
+    '''
+    Get the first time at or after the given time that is in a run window
+    Params:
+        when (datetime): Timezone aware time
+    returns: timezone aware datetime
+    '''
+    (start_time, _) = get_run_window(timezone.localtime(when).replace(tzinfo=None))
+    return max(when, timezone.make_aware(start_time))
 
 
-def convert_filters_to_query_string(set_filters=None): # pylint: disable=too-many-branches
+def convert_filters_to_query_string(set_filters=None):
     '''
     Processes the filters and turns them into parameters for the API.
     Filters from the same field will be treated as AND
     Filters from different fields will be treated with OR
     '''
-    filters = ""
-
     logging.debug("-- Set Filters --")
     logging.debug(set_filters)
 
+    clauses = []
     for key, values in set_filters.items():
         namespace = get_enum_namespace(key)
+        field = key.replace('_', '/')
 
         values = encode_if_needed(key, values)
 
-        if filters != '':
-            filters += " and "
-
         # Handle dates separately since they have 2 values (start date and end date)
         if key == 'Date':
             if len(values[0]) > 3: # the values are stored together
@@ -346,31 +454,24 @@ def convert_filters_to_query_string(set_filters=None): # pylint: disable=too-man
                     tmp.append(val.split(" ")[0])
                     tmp.append(val.split(" ")[1])
                 values = tmp
-            filters += " ("
-            for i in range(0, len(values), 2):
-                filters += key.replace('_', '/') + " " + values[i] + " " + values[i+1] + " and "
-            filters = filters[:-5] # remove the last AND
-            filters += ")"
+            dates = [f"{field} {values[i]} {values[i+1]}" for i in range(0, len(values), 2)]
+            clauses.append(" (" + " and ".join(dates) + ")")
 
+        elif len(values) == 1:
+            clauses.append(f"{field} eq {format_filter_value(namespace, values[0])} ")
         else:
-            if len(values) == 1:
-                # The API expects strings to have single quotes around the values
-                if isinstance(values[0], int) or string_is_int(values[0]):
-                    filters += key.replace('_', '/') + " eq " + namespace + str(values[0]) + " "
-                else:
-                    filters += key.replace('_', '/') + " eq " + namespace + "'" + values[0] + "' "
-            else:
-                filters += " ("
-                for value in values:
-                    # The API expects strings to have single quotes around the values
-                    if isinstance(value, int) or string_is_int(value):
-                        filters += key.replace('_', '/') + " eq " + namespace + str(value) + " or "
-                    else:
-                        filters += key.replace('_', '/') + " eq " + namespace + "'" + value + "' or "
-                filters = filters[:-4] # remove the last OR
-                filters += ")"
-
-    return filters
+            clauses.append(" (" + " or ".join(f"{field} eq {format_filter_value(namespace, value)}" for value in values) + ")")
+
+    return " and ".join(clauses)
+
+
+def format_filter_value(namespace, value):
+    '''
+    Format a filter value for the API, which expects strings to have single quotes around the values
+    '''
+    if isinstance(value, int) or string_is_int(value):
+        return namespace + str(value)
+    return namespace + "'" + value + "'"
 
 
 def encode_if_needed(field, values=None):
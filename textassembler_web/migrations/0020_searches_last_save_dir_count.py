@@ -0,0 +1,18 @@
+# Generated by Django 2.2.9 on 2026-10-17 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_web', '0019_auto_20191206_0907'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searches',
+            name='last_save_dir_count',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.9 on 2026-10-17 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_web', '0020_searches_last_save_dir_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='preview_cache',
+            fields=[
+                ('cache_key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('results', models.TextField()),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('last_used', models.DateTimeField(auto_now_add=True)),
+                ('hits', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='preview_cache_statistics',
+            fields=[
+                ('stat_date', models.DateField(primary_key=True, serialize=False)),
+                ('hits', models.IntegerField(default=0)),
+                ('misses', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
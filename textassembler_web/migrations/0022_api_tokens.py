@@ -0,0 +1,22 @@
+# Generated by Django 2.2.9 on 2026-10-17 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_web', '0021_preview_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='api_tokens',
+            fields=[
+                ('client_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('access_token', models.TextField(null=True)),
+                ('expiration_time', models.DateTimeField(null=True)),
+                ('update_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.9 on 2026-10-17 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_web', '0022_api_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searches',
+            name='archive_format',
+            field=models.CharField(choices=[('zip', 'Zip'), ('zip_store', 'Zip (not compressed)'),
+                                            ('tar.zst', 'Zstandard compressed tar')], default='zip', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.9 on 2026-10-17 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_web', '0023_searches_archive_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searches',
+            name='archive_parts',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.9 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textassembler_web', '0024_searches_archive_parts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searches',
+            name='num_files_compressed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='searches',
+            name='num_files_to_compress',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -14,6 +14,9 @@ class CallTypeChoice(Enum):
     SRH = "Search"
     DWL = "Download"
 
+# Types of files the results of a search can be compressed into
+ARCHIVE_FORMATS = [("zip", "Zip"), ("zip_store", "Zip (not compressed)"), ("tar.zst", "Zstandard compressed tar")]
+
 class sources(models.Model): # pylint: disable=invalid-name
     '''
     Searchable sources in the LexisNexis API
@@ -60,9 +63,14 @@ class searches(models.Model): # pylint: disable=invalid-name
     run_time_seconds = models.IntegerField(default=0) # number of seconds the download has been actively running (not including waiting in queue)
     retry_count = models.IntegerField(default=0) # number of times a call to the API failed
     last_save_dir = models.CharField(max_length=1024, null=True) # the last directory, relative to the save path, where a result file was saved
+    last_save_dir_count = models.IntegerField(null=True) # the number of results saved in the last_save_dir
     error_message = models.TextField(null=True)
     failed_date = models.DateTimeField(null=True) # date the search failed
     deleted = models.BooleanField(default=False) # flag the search for deletion
+    archive_format = models.CharField(max_length=20, choices=ARCHIVE_FORMATS, default="zip") # type of file to compress the results into
+    archive_parts = models.IntegerField(null=True) # number of files the results were compressed into
+    num_files_to_compress = models.IntegerField(default=0) # total number of result files being compressed
+    num_files_compressed = models.IntegerField(default=0) # number of result files compressed as of the last checkpoint
 
     def __str__(self):
         '''
@@ -115,6 +123,33 @@ class api_limits(models.Model): # pylint: disable=invalid-name
     reset_on_day = models.DateTimeField(null=True)
     update_date = models.DateTimeField(auto_now=True)
 
+class api_tokens(models.Model): # pylint: disable=invalid-name
+    '''
+    Access token for the API shared by the web application and processors
+    '''
+    client_id = models.CharField(max_length=255, primary_key=True) # client the token was issued to
+    access_token = models.TextField(null=True)
+    expiration_time = models.DateTimeField(null=True)
+    update_date = models.DateTimeField(auto_now=True)
+
+class preview_cache(models.Model): # pylint: disable=invalid-name
+    '''
+    Preview search results from the API, kept to show the same preview again without calling the API
+    '''
+    cache_key = models.CharField(max_length=64, primary_key=True) # hash of the normalized search term and filters
+    results = models.TextField() # JSON of the search (and full-text) results from the API
+    date_added = models.DateTimeField(auto_now_add=True) # used to expire the entry
+    last_used = models.DateTimeField(auto_now_add=True) # used to remove the least recently used entries
+    hits = models.IntegerField(default=0) # number of times the entry has been used
+
+class preview_cache_statistics(models.Model): # pylint: disable=invalid-name
+    '''
+    Number of previews shown from the cache (hits) or from the API (misses) per day
+    '''
+    stat_date = models.DateField(primary_key=True)
+    hits = models.IntegerField(default=0)
+    misses = models.IntegerField(default=0)
+
 class historical_searches(models.Model): # pylint: disable=invalid-name
     '''
     Used to store deleted searches for later querying for reporting purposes.
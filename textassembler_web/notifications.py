@@ -0,0 +1,147 @@
+"""
+Notifications between the web application and the background processors.
+
+Each processor (download, compress, delete) listens on a Unix datagram socket
+in NOTIFY_SOCKET_DIR. When something happens that gives a processor more work
+(i.e. a search is queued, a download completes, or a search is flagged for
+deletion) a notification is sent to that processor's socket so it can pick up
+the work right away instead of polling the database.
+
+Notifications are best-effort. If the processor is not running, or the socket
+can not be reached, nothing happens and the processor will find the work the
+next time it falls back to checking the database (QUEUE_POLL_SECONDS).
+"""
+import os
+import logging
+import select
+import socket
+import threading
+from django.conf import settings
+from django.db import transaction
+
+DOWNLOAD = "download"
+COMPRESS = "compress"
+DELETE = "delete"
+
+def get_socket_path(channel):
+    '''
+    Get the path of the socket the processor for the given channel listens on
+    '''
+    return os.path.join(settings.NOTIFY_SOCKET_DIR, f"tassembler_{channel}.sock")
+
+def notify(channel):
+    '''
+    Wake up the processor listening on the given channel. If called inside a database
+    transaction, the notification is sent once the transaction has been committed so
+    the processor will be able to see the changes.
+    '''
+    transaction.on_commit(lambda: send_notification(get_socket_path(channel)))
+
+def send_notification(path):
+    '''
+    Send a notification datagram to the given socket path, ignoring any errors
+    '''
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(b"1", path)
+    except OSError as ex:
+        # The processor is not running or already has notifications waiting to be read
+        logging.debug(f"Unable to send notification to {path}. {ex}")
+
+class QueueListener: # pylint: disable=too-many-instance-attributes
+    '''
+    Listens for notifications on the given channel in a background thread so that
+    processor threads can block until there is work to do.
+
+    To avoid missing a notification that arrives while checking the queue, take a
+    mark before checking the queue and pass it to wait:
+        mark = listener.mark()
+        ... check the queue, nothing found ...
+        listener.wait(mark, timeout)
+    '''
+
+    def __init__(self, channel):
+        self.path = get_socket_path(channel)
+        self.sock = None
+        self.generation = 0
+        self.closing = False
+        self.cond = threading.Condition()
+
+        # Used to wake up waiting threads from within this process (i.e. on SIGTERM)
+        (self.wake_recv, self.wake_send) = socket.socketpair()
+        self.wake_send.setblocking(False)
+
+        try:
+            os.makedirs(settings.NOTIFY_SOCKET_DIR, exist_ok=True)
+            if os.path.exists(self.path):
+                os.remove(self.path) # left behind from a previous run
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.bind(self.path)
+            os.chmod(self.path, 0o666) # allow the web application to send to it
+        except OSError as ex:
+            logging.warning((f"Unable to listen for notifications on {self.path}. "
+                             f"Will check for work every {settings.QUEUE_POLL_SECONDS} seconds instead. {ex}"))
+            if self.sock is not None:
+                self.sock.close()
+            self.sock = None
+
+        self.thread = threading.Thread(target=self.listen, name=f"{channel}-listener", daemon=True)
+        self.thread.start()
+
+    def listen(self):
+        '''
+        Read notifications from the sockets, waking any waiting threads for each batch received
+        '''
+        sockets = [sock for sock in (self.sock, self.wake_recv) if sock is not None]
+        while not self.closing:
+            try:
+                (readable, _, _) = select.select(sockets, [], [])
+                for sock in readable:
+                    sock.recv(64)
+            except OSError:
+                break # the sockets were closed
+            with self.cond:
+                self.generation = self.generation + 1
+                self.cond.notify_all()
+
+    def mark(self):
+        '''
+        Returns: (int) marker of the notifications received so far
+        '''
+        with self.cond:
+            return self.generation
+
+    def wait(self, mark, timeout):
+        '''
+        Block until a notification has been received since the mark was taken, or the timeout passes
+        Returns:
+            notified (bool): If a notification was received
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: self.generation != mark, timeout)
+
+    def wake(self):
+        '''
+        Wake up all waiting threads. Safe to call from a signal handler.
+        '''
+        try:
+            self.wake_send.send(b"1")
+        except OSError:
+            pass # there is already a wake-up waiting to be read
+
+    def close(self):
+        '''
+        Stop listening and remove the socket
+        '''
+        self.closing = True
+        self.wake()
+        self.thread.join(timeout=5)
+        for sock in (self.sock, self.wake_recv, self.wake_send):
+            if sock is not None:
+                sock.close()
+        if self.sock is not None and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
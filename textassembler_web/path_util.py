@@ -27,70 +27,105 @@ under the max number of sub directories settings as well.
 The maximum number of files/sub-directories per directory before it
 starts to become an efficiency issue is 10,000. So you should take that
 into consideration when setting those configurations.
+
+The current directory and the number of results saved in it are kept in
+memory and on the search record (last_save_dir, last_save_dir_count), so
+the filesystem is only touched when a new directory needs to be created.
 """
 import os
-#import logging
 from django.conf import settings
 
 
-def get_path(cur_path):
+class PathAllocator:
+    '''
+    Allocates the save location for each result file of a search
     '''
-    Get the save location for the next result file
-    given the current path being used.
+
+    def __init__(self, base_path, last_save_dir=None, file_count=None, subdirs=None):
+        '''
+        Params:
+            base_path (string): The save location for the search, i.e. [STORAGE_LOCATION]/[Search ID]
+            last_save_dir (string): The last directory used, relative to the base path (i.e. 1/1/1)
+            file_count (int): The number of results saved in the last directory. If not known,
+                it will be counted from the files on the server.
+            subdirs (list): Sub-directories to create in each directory (i.e. HTML, TXT, TXT Only)
+        '''
+        self.base_path = base_path
+        self.subdirs = subdirs or []
+        self.position = None
+        self.file_count = 0
+
+        if last_save_dir:
+            self.position = [int(part) for part in last_save_dir.split("/")]
+            self.make_dirs()
+            if file_count is None:
+                file_count = count_files(self.get_current_path())
+            self.file_count = file_count
+
+    @property
+    def last_save_dir(self):
+        '''
+        The current directory, relative to the base path
+        '''
+        return None if self.position is None else "/".join(str(part) for part in self.position)
+
+    def get_current_path(self):
+        '''
+        The full path of the current directory
+        '''
+        return os.path.join(self.base_path, self.last_save_dir)
+
+    def next_path(self):
+        '''
+        Get the save location for the next result file
+        Returns:
+            new_path (string): Save location to use
+        '''
+        if self.position is None:
+            # this is a new search
+            self.position = [1, 1, 1]
+            self.file_count = 0
+            self.make_dirs()
+        elif self.file_count >= settings.MAX_FILES_PER_DIR:
+            self.position = get_next_position(self.position)
+            self.file_count = 0
+            self.make_dirs()
+
+        self.file_count = self.file_count + 1
+        return self.get_current_path()
+
+    def make_dirs(self):
+        '''
+        Create the current directory and its sub-directories
+        '''
+        for subdir in self.subdirs or [""]:
+            os.makedirs(os.path.join(self.get_current_path(), subdir), exist_ok=True)
+
+
+def get_next_position(position):
+    '''
+    Get the directory to use after the given one is full. Moves on to the next
+    sibling directory, then to the next parent or grand-parent directory once
+    they have MAX_SUB_DIRS_PER_DIR sub-directories.
     Returns:
-        new_path (string): New save location to use
+        position (list): [grand-parent, parent, directory] numbers
     '''
+    (gparent, parent, current) = position
+    if current < settings.MAX_SUB_DIRS_PER_DIR:
+        return [gparent, parent, current + 1]
+    if parent < settings.MAX_SUB_DIRS_PER_DIR:
+        return [gparent, parent + 1, 1]
+    # The base level is not limited so there is no cap on the number of results
+    return [gparent + 1, 1, 1]
 
-    # Check if the current path is the base path, i.e. this is a new search
-    #logging.debug(f"{os.path.dirname(cur_path)} == {settings.STORAGE_LOCATION}")
-    if os.path.dirname(cur_path) == settings.STORAGE_LOCATION:
-        new_path = os.path.join(cur_path, "1/1/1")
-        if not os.path.exists(new_path):
-            os.makedirs(new_path)
-        return new_path
-
-    # See if the current directory can handle more files
-    ## Get the 1st directory in that path (i.e. HTML, TXT, TXT_Only)
-    for cur_path_dirs in os.listdir(cur_path):
-        if os.path.isdir(os.path.join(cur_path, cur_path_dirs)):
-            format_dir = os.path.join(cur_path, cur_path_dirs)
-            break
-    ## Check the number of files in the format dir
-    #logging.debug(f"Files in format_dir ({format_dir}): {len(os.listdir(format_dir))}")
-    if len(os.listdir(format_dir)) < settings.MAX_FILES_PER_DIR:
-        return cur_path
-
-    # See if the parent directory can handle more sub directories
-    parent_dir = os.path.dirname(cur_path) # go up one level
-    num_dirs_in_dir = len(os.listdir(parent_dir))
-    #logging.debug(f"Dirs in parent_dir ({parent_dir}): {num_dirs_in_dir}")
-    if num_dirs_in_dir < settings.MAX_SUB_DIRS_PER_DIR:
-        new_folder = num_dirs_in_dir + 1 # increment the last dir number used
-        new_path = os.path.join(parent_dir, str(new_folder))
-        #logging.debug(f"New path: {new_path}")
-        if not os.path.exists(new_path):
-            os.makedirs(new_path)
-        return new_path
-
-    # See if the grand-parent directory can handle more sub directories
-    gparent_dir = os.path.dirname(parent_dir)
-    num_dirs_in_dir = len(os.listdir(gparent_dir))
-    #logging.debug(f"Dirs in gparent_dir ({gparent_dir}): {num_dirs_in_dir}")
-    if num_dirs_in_dir < settings.MAX_SUB_DIRS_PER_DIR:
-        new_parent_dir = num_dirs_in_dir + 1 # increment the last dir number used
-        new_path = os.path.join(gparent_dir, str(new_parent_dir) + "/1")
-        #logging.debug(f"New path: {new_path}")
-        if not os.path.exists(new_path):
-            os.makedirs(new_path)
-        return new_path
-
-    # Last resort, create a new sub-directory in the base level
-    base_dir = os.path.dirname(gparent_dir)
-    num_dirs_in_dir = len(os.listdir(base_dir))  # num in /[Search ID]/
-    #logging.debug(f"Dirs in ggparent_dir ({base_dir}): {num_dirs_in_dir}")
-    new_ggparent_dir = os.path.join(base_dir, str(num_dirs_in_dir + 1))  # /[Search ID]/X
-    new_path = os.path.join(new_ggparent_dir, "1/1")
-    #logging.debug(f"New path: {new_path}")
-    if not os.path.exists(new_path):
-        os.makedirs(new_path)
-    return new_path
+
+def count_files(cur_path):
+    '''
+    Count the number of result files in a directory, which is the number
+    in its largest format sub-directory
+    '''
+    counts = [0]
+    for entry in os.scandir(cur_path):
+        if entry.is_dir():
+            counts.append(len(os.listdir(entry.path)))
+    return max(counts)
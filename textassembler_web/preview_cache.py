@@ -0,0 +1,88 @@
+'''
+Cache of the preview search results, so previewing the same search and filters again
+(i.e. toggling a filter off and back on) does not use another search or download call
+from the API limits.
+
+Entries are kept for PREVIEW_CACHE_SECONDS, and once there are more than
+PREVIEW_CACHE_SIZE entries the least recently used ones are removed.
+'''
+import datetime
+import hashlib
+import json
+import logging
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from .models import preview_cache, preview_cache_statistics
+
+def get_cache_key(term, set_filters):
+    '''
+    Get the key for the search term and filters. Whitespace in the term and the order
+    of the filter fields do not change the results, so they do not change the key.
+    '''
+    normalized = {
+        "term": " ".join(term.split()),
+        "filters": {key: [str(value) for value in values] for (key, values) in set_filters.items()},
+        "format": settings.PREVIEW_FORMAT,
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_cached_preview(term, set_filters):
+    '''
+    Get the cached results for the search term and filters
+    returns: the results saved with save_preview, or None if they are not cached
+    '''
+    if settings.PREVIEW_CACHE_SECONDS <= 0:
+        return None
+    cache_key = get_cache_key(term, set_filters)
+    oldest = timezone.now() - datetime.timedelta(seconds=settings.PREVIEW_CACHE_SECONDS)
+    try:
+        entry = preview_cache.objects.filter(cache_key=cache_key, date_added__gte=oldest).first()
+        if entry is None:
+            record_statistic("misses")
+            return None
+        preview_cache.objects.filter(cache_key=cache_key).update(last_used=timezone.now(), hits=F("hits") + 1)
+        record_statistic("hits")
+        return json.loads(entry.results)
+    except DatabaseError as exc:
+        # the API can still be used if the cache is not available
+        logging.warning(f"Unable to read the preview cache. {exc}")
+        return None
+
+def save_preview(term, set_filters, results):
+    '''
+    Save the results for the search term and filters, removing expired and least recently used entries
+    '''
+    if settings.PREVIEW_CACHE_SECONDS <= 0:
+        return
+    oldest = timezone.now() - datetime.timedelta(seconds=settings.PREVIEW_CACHE_SECONDS)
+    try:
+        preview_cache.objects.filter(date_added__lt=oldest).delete()
+        preview_cache.objects.update_or_create(
+            cache_key=get_cache_key(term, set_filters),
+            defaults={"results": json.dumps(results), "date_added": timezone.now(), "last_used": timezone.now(), "hits": 0})
+        evict = preview_cache.objects.order_by("-last_used").values_list("cache_key", flat=True)[settings.PREVIEW_CACHE_SIZE:]
+        if evict:
+            preview_cache.objects.filter(cache_key__in=list(evict)).delete()
+    except DatabaseError as exc:
+        logging.warning(f"Unable to save to the preview cache. {exc}")
+
+def record_statistic(field):
+    '''
+    Add a hit or miss to today's statistics
+    '''
+    today = timezone.localdate()
+    if not preview_cache_statistics.objects.filter(stat_date=today).update(**{field: F(field) + 1}):
+        preview_cache_statistics.objects.get_or_create(stat_date=today)
+        preview_cache_statistics.objects.filter(stat_date=today).update(**{field: F(field) + 1})
+
+def get_statistics(from_date, to_date):
+    '''
+    Get the number of cache hits and misses between the dates (inclusive)
+    returns:
+        hits (int): Previews shown from the cache
+        misses (int): Previews that called the API
+    '''
+    stats = preview_cache_statistics.objects.filter(stat_date__gte=from_date, stat_date__lte=to_date)
+    return (sum(stat.hits for stat in stats), sum(stat.misses for stat in stats))
@@ -0,0 +1,241 @@
+'''
+In-memory copy of the LexisNexis API limits for each type of call.
+
+The API returns the limits, the calls remaining, and when each limit resets in the
+X-RateLimit-* headers of every response, for a per minute, per hour, and per day
+window. Instead of reading and writing the api_limits table around every call, each
+process keeps the limits in a RateLimiter that works like a token bucket per window:
+a call takes a token from every window and a window is refilled to its limit when it
+resets. The headers of each response replace the local counts.
+
+The api_limits table is still how processes share the limits. A RateLimiter writes
+its state to the table when something meaningful changes (a window runs out, resets,
+or the limits change). Every LIMITS_SYNC_SECONDS otherwise, it reloads the table if
+another process has written to it since, or writes its state if it differs from what
+was last read or written.
+'''
+import datetime
+import logging
+import threading
+from django.conf import settings
+from django.db import OperationalError
+from django.utils import timezone
+from .models import api_limits, CallTypeChoice
+from .utilities import log_error
+
+WINDOWS = ("minute", "hour", "day")
+WINDOW_LENGTHS = {"minute": datetime.timedelta(minutes=1),
+                  "hour": datetime.timedelta(hours=1),
+                  "day": datetime.timedelta(days=1)}
+
+LIMITERS = {}
+LIMITERS_LOCK = threading.Lock()
+
+def get_limit_type(service):
+    '''
+    Get the api_limits type for the given service (search, download, or sources)
+    '''
+    if service == 'download':
+        return CallTypeChoice.DWL
+    if service == 'sources':
+        return CallTypeChoice.SRC
+    return CallTypeChoice.SRH
+
+def get_rate_limiter(service):
+    '''
+    Get the limiter for the given service shared by all of the API calls in the process
+    '''
+    with LIMITERS_LOCK:
+        if service not in LIMITERS:
+            LIMITERS[service] = RateLimiter(get_limit_type(service))
+        return LIMITERS[service]
+
+
+class RateLimiter: # pylint: disable=too-many-instance-attributes
+    '''
+    Limits for one type of API call
+    '''
+
+    def __init__(self, limit_type):
+        self.limit_type = limit_type
+        self.lock = threading.Lock()
+        self.limits = {}
+        self.remaining = {}
+        self.reset_on = {}
+        self.in_flight = 0 # calls that have taken a token but have not returned limits yet
+        self.changed = False # if there are changes that have not been saved to the database
+        self.synced = None # limits, remaining, and reset times last read from or written to the database
+        self.synced_at = None # when the database was last read or written
+        self.load()
+
+    def load(self):
+        '''
+        Read the limits from the database
+        '''
+        limits = api_limits.objects.get(limit_type=self.limit_type)
+        for window in WINDOWS:
+            self.limits[window] = getattr(limits, f"limit_per_{window}")
+            self.remaining[window] = getattr(limits, f"remaining_per_{window}")
+            self.reset_on[window] = getattr(limits, f"reset_on_{window}")
+        self.changed = False
+        self.synced = self.get_state()
+        self.synced_at = limits.update_date or timezone.now()
+
+    def get_state(self):
+        '''
+        Get a copy of the limits as they would be saved to the database
+        '''
+        return (dict(self.limits), {window: max(remaining, 0) for (window, remaining) in self.remaining.items()},
+                dict(self.reset_on))
+
+    def sync(self):
+        '''
+        Reload the limits if another process saved them since they were last read or written,
+        otherwise save the changes made since. Only checks the database every LIMITS_SYNC_SECONDS.
+        '''
+        now = timezone.now()
+        if self.synced_at is not None and now - self.synced_at < datetime.timedelta(seconds=settings.LN_LIMITS_SYNC_SECONDS):
+            return
+        try:
+            if api_limits.objects.filter(limit_type=self.limit_type, update_date__gt=self.synced_at).exists():
+                logging.debug(f"Reloading the {self.limit_type.value} limits saved by another process.")
+                self.load()
+            elif self.changed:
+                self.save()
+            else:
+                self.synced_at = now
+        except OperationalError as exc:
+            # keep going with the limits in memory, they will be synced again on a later call
+            logging.warning(f"Unable to sync the {self.limit_type.value} limits with the database. {exc}")
+            self.synced_at = now
+
+    def refill(self):
+        '''
+        Refill the windows that have reset. The headers of the next response will
+        give the actual reset time, until then the window is assumed to last its full length.
+        '''
+        now = timezone.now()
+        for window in WINDOWS:
+            reset_on = self.reset_on[window]
+            if reset_on is not None and reset_on <= now:
+                # allow a single call to get the limits if they are not known
+                self.remaining[window] = max(self.limits[window], 1) - self.in_flight
+                while reset_on <= now:
+                    reset_on = reset_on + WINDOW_LENGTHS[window]
+                self.reset_on[window] = reset_on
+                self.changed = True
+
+    def calls_remaining(self):
+        '''
+        Get the number of calls that can still be made before reaching the lowest
+        of the min/hour/day limits
+        '''
+        with self.lock:
+            self.sync()
+            self.refill()
+            return max(min(self.remaining.values()), 0)
+
+    def next_available(self):
+        '''
+        Get when the next call can be made: now if there are calls remaining in
+        every window, otherwise when the last of the windows that ran out resets
+        '''
+        with self.lock:
+            self.sync()
+            self.refill()
+            now = timezone.now()
+            resets = [self.reset_on[window] or now for window in WINDOWS if self.remaining[window] <= 0]
+            return max(resets + [now])
+
+    def acquire(self):
+        '''
+        Take a call out of each window. Each call that is acquired must be followed by
+        release once it has returned, with the response headers if there are any.
+        Returns:
+            acquired (bool): If a call can be made
+        '''
+        with self.lock:
+            self.sync()
+            self.refill()
+            if min(self.remaining.values()) <= 0:
+                return False
+            for window in WINDOWS:
+                self.remaining[window] = self.remaining[window] - 1
+            self.in_flight = self.in_flight + 1
+            return True
+
+    def release(self, headers=None, used=True):
+        '''
+        Finish a call taken by acquire, updating the limits from its response headers
+        Params:
+            headers (dict): Response headers
+            used (bool): If the call was made. A call that never got a response is given back to each window.
+        '''
+        with self.lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if not used:
+                for window in WINDOWS:
+                    self.remaining[window] = min(self.remaining[window] + 1, max(self.limits[window], 1))
+            self.update_from_headers(headers)
+
+    def update(self, headers, save=False):
+        '''
+        Update the limits from the headers of a call that was not acquired
+        Params:
+            headers (dict): Response headers
+            save (bool): Save the limits to the database right away
+        '''
+        with self.lock:
+            self.update_from_headers(headers)
+            if save:
+                self.save()
+
+    def update_from_headers(self, headers):
+        '''
+        Replace the limits with the X-RateLimit-* headers. The remaining counts in the headers
+        do not include the calls still in progress, so those are taken out of them.
+        '''
+        if not headers:
+            return
+        meaningful = False
+        if 'X-RateLimit-Limit' in headers:
+            vals = str(headers['X-RateLimit-Limit']).split('/')
+            for (window, val) in zip(WINDOWS, vals):
+                meaningful = meaningful or self.limits[window] != int(val)
+                self.limits[window] = int(val)
+        if 'X-RateLimit-Reset' in headers:
+            vals = str(headers['X-RateLimit-Reset']).split('/')
+            for (window, val) in zip(WINDOWS, vals):
+                reset_on = timezone.make_aware(datetime.datetime.fromtimestamp(int(val)))
+                meaningful = meaningful or self.reset_on[window] != reset_on
+                self.reset_on[window] = reset_on
+        if 'X-RateLimit-Remaining' in headers:
+            vals = str(headers['X-RateLimit-Remaining']).split('/')
+            for (window, val) in zip(WINDOWS, vals):
+                remaining = int(val) - self.in_flight
+                meaningful = meaningful or remaining <= 0 # other processes need to know it ran out
+                self.remaining[window] = remaining
+        self.changed = self.get_state() != self.synced
+        if meaningful:
+            self.save()
+        else:
+            self.sync()
+
+    def save(self):
+        '''
+        Save the limits to the database
+        '''
+        now = timezone.now()
+        values = {"update_date": now}
+        for window in WINDOWS:
+            values[f"limit_per_{window}"] = self.limits[window]
+            values[f"remaining_per_{window}"] = max(self.remaining[window], 0)
+            values[f"reset_on_{window}"] = self.reset_on[window]
+        try:
+            api_limits.objects.filter(limit_type=self.limit_type).update(**values)
+            self.changed = False
+            self.synced = self.get_state()
+            self.synced_at = now
+            logging.debug(f"Saved limits for {self.limit_type.value}.")
+        except OperationalError as exc:
+            log_error(f"Unable to save the new limits to the database for {self.limit_type.value}. Error: {exc}")
@@ -0,0 +1,167 @@
+"""
+Streaming decode of LexisNexis API responses.
+
+Download responses contain the full text of every document on the page, so rather
+than loading the whole body and decoding it at once, the response is read in
+chunks and each item of the "value" list is decoded and handed back as soon as it
+has been read. Only one item (plus a chunk of the response) is held in memory at a
+time, no matter how many results are requested per call.
+"""
+import codecs
+import json
+
+CHUNK_SIZE = 65536
+WHITESPACE = " \t\n\r"
+
+class ResultStream:
+    '''
+    Iterates over the "value" list of an API response while it is being read.
+    All other top-level fields (i.e. @odata.count) are available from the metadata
+    once the iteration has finished, or as soon as they have been read if they come
+    before the "value" list in the response.
+    '''
+
+    def __init__(self, resp, on_complete=None):
+        '''
+        Params:
+            resp (requests.Response): The response, requested with stream=True
+            on_complete (function): Called with the metadata once the response is closed
+        '''
+        self.resp = resp
+        self.on_complete = on_complete
+        self.metadata = {}
+        self.num_results = 0
+        self.num_bytes = 0
+        self.complete = False # if the full response was read
+
+    def __iter__(self):
+        try:
+            for (key, value) in iter_object_items(self.read_chunks(), "value"):
+                if key == "value":
+                    self.num_results = self.num_results + 1
+                    yield value
+                else:
+                    self.metadata[key] = value
+            self.complete = True
+        finally:
+            self.resp.close()
+            if self.on_complete is not None:
+                self.on_complete(self.metadata)
+
+    def read_chunks(self):
+        '''
+        Read the response in chunks, keeping track of the size read
+        '''
+        for chunk in self.resp.iter_content(chunk_size=CHUNK_SIZE):
+            self.num_bytes = self.num_bytes + len(chunk)
+            yield chunk
+
+    def __contains__(self, key):
+        return key in self.metadata
+
+    def __getitem__(self, key):
+        return self.metadata[key]
+
+
+class JSONBuffer:
+    '''
+    Text buffer over a stream of byte chunks that values can be decoded from
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self, min_size=0):
+        '''
+        Read chunks into the buffer until at least min_size more characters are
+        available, dropping the part that has already been decoded
+        Returns:
+            read (bool): If any more data was read
+        '''
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        start_len = len(self.text)
+        while not self.eof and (len(self.text) == start_len or len(self.text) - start_len < min_size):
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.text += self.decoder.decode(b"", final=True)
+                self.eof = True
+                break
+            self.text += self.decoder.decode(chunk)
+        return len(self.text) > start_len
+
+    def peek(self):
+        '''
+        Get the next non-whitespace character without consuming it
+        '''
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos = self.pos + 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                raise ValueError("Unexpected end of the response.")
+
+    def expect(self, chars):
+        '''
+        Consume the next non-whitespace character, which must be one of the given characters
+        '''
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of '{chars}' at position {self.pos} of the response, found '{char}'.")
+        self.pos = self.pos + 1
+        return char
+
+    def decode_value(self):
+        '''
+        Decode the next JSON value from the buffer, reading more of the stream as needed
+        '''
+        self.peek()
+        while True:
+            try:
+                (value, end) = self.json_decoder.raw_decode(self.text, self.pos)
+                # A value at the very end of the buffer could be cut off (i.e. a number)
+                # since there is always a separator after it in a complete response
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow the buffer by at least its current size so large values are not re-parsed too often
+            if not self.read_more(len(self.text) - self.pos):
+                raise ValueError("Unexpected end of the response.")
+
+
+def iter_object_items(chunks, stream_key):
+    '''
+    Decode a JSON object from a stream of byte chunks, yielding (key, value) for
+    each of its fields. The list in the stream_key field is yielded one item at a
+    time as (stream_key, item).
+    '''
+    buf = JSONBuffer(chunks)
+    buf.expect("{")
+    if buf.peek() == "}":
+        return
+    while True:
+        key = buf.decode_value()
+        buf.expect(":")
+        if key == stream_key and buf.peek() == "[":
+            buf.expect("[")
+            if buf.peek() == "]":
+                buf.expect("]")
+            else:
+                while True:
+                    yield (key, buf.decode_value())
+                    if buf.expect(",]") == "]":
+                        break
+        else:
+            yield (key, buf.decode_value())
+        if buf.expect(",}") == "}":
+            return
@@ -1 +1,8 @@
 from textassembler_web.tests import test_processing_window
+from textassembler_web.tests import test_path_util
+from textassembler_web.tests import test_result_stream
+from textassembler_web.tests import test_preview_cache
+from textassembler_web.tests import test_query_string
+from textassembler_web.tests import test_rate_limiter
+from textassembler_web.tests import test_ln_api
+from textassembler_web.tests import test_api_log_buffer
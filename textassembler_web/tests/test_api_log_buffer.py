@@ -0,0 +1,55 @@
+import threading
+from unittest.mock import patch
+from django.db import DatabaseError
+from django.test import SimpleTestCase, override_settings
+
+from textassembler_web.api_log_buffer import APILogBuffer
+from textassembler_processor.models import api_log
+
+
+def add_call(buffer, url="https://example.com/v1/News"):
+    buffer.add(request_url=url, request_type="GET", response_code=200, num_results=10, is_download=True)
+
+
+@patch.object(api_log.objects, "bulk_create")
+class APILogBufferTestCase(SimpleTestCase):
+
+    @override_settings(API_LOG_BATCH_SIZE=3, API_LOG_FLUSH_SECONDS=60)
+    def testFlushesFullBatch(self, bulk_create):
+        buffer = APILogBuffer()
+        self.addCleanup(buffer.flush)
+        add_call(buffer)
+        add_call(buffer)
+        bulk_create.assert_not_called()
+        add_call(buffer)
+        bulk_create.assert_called_once()
+        self.assertEqual(len(bulk_create.call_args[0][0]), 3)
+        self.assertEqual(buffer.rows, [])
+        self.assertIsNone(buffer.timer)
+
+    @override_settings(API_LOG_BATCH_SIZE=100, API_LOG_FLUSH_SECONDS=0.05)
+    def testFlushesAfterFlushSeconds(self, bulk_create):
+        flushed = threading.Event()
+        bulk_create.side_effect = lambda rows: flushed.set()
+        buffer = APILogBuffer()
+        add_call(buffer)
+        add_call(buffer)
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(len(bulk_create.call_args[0][0]), 2)
+        self.assertEqual(bulk_create.call_count, 1)
+
+    @override_settings(API_LOG_BATCH_SIZE=100, API_LOG_FLUSH_SECONDS=0)
+    def testLogsEachCallWithoutFlushSeconds(self, bulk_create):
+        buffer = APILogBuffer()
+        add_call(buffer)
+        add_call(buffer)
+        self.assertEqual(bulk_create.call_count, 2)
+        self.assertIsNone(buffer.timer)
+
+    @override_settings(API_LOG_BATCH_SIZE=1)
+    def testIgnoresDatabaseErrors(self, bulk_create):
+        bulk_create.side_effect = DatabaseError("gone away")
+        buffer = APILogBuffer()
+        with self.assertLogs(level="WARNING"):
+            add_call(buffer)
+        self.assertEqual(buffer.rows, [])
@@ -0,0 +1,45 @@
+import datetime
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from textassembler_web.ln_api import LNAPI, token_is_valid
+
+
+def make_token_response(access_token, expires_in):
+    return SimpleNamespace(status_code=200, json=lambda: {"access_token": access_token, "expires_in": expires_in})
+
+
+@override_settings(LN_TOKEN_REFRESH_SECONDS=300)
+class TokenRefreshTestCase(SimpleTestCase):
+
+    def testRefreshesShortTokensHalfwayThrough(self):
+        now = timezone.now()
+        self.assertFalse(token_is_valid(now + datetime.timedelta(seconds=240)))
+        self.assertTrue(token_is_valid(now + datetime.timedelta(seconds=240), now))
+        self.assertFalse(token_is_valid(now + datetime.timedelta(seconds=100), now - datetime.timedelta(seconds=140)))
+        self.assertTrue(token_is_valid(now + datetime.timedelta(hours=1), now))
+        self.assertFalse(token_is_valid(now + datetime.timedelta(seconds=299), now - datetime.timedelta(hours=1)))
+
+    @patch("textassembler_web.ln_api.TOKEN", (None, None, None))
+    @patch("textassembler_web.ln_api.transaction")
+    @patch("textassembler_web.ln_api.api_tokens")
+    def testSharesRefreshedToken(self, api_tokens, _):
+        # the stored token is about to expire, so a new one is requested and stored for the other processes
+        stored = MagicMock(access_token="old", expiration_time=timezone.now() + datetime.timedelta(seconds=60),
+                           update_date=timezone.now() - datetime.timedelta(hours=1))
+        api_tokens.objects.select_for_update.return_value.get.return_value = stored
+        session = MagicMock()
+        session.post.return_value = make_token_response("new", 240)
+
+        api = LNAPI(session)
+        self.assertEqual(api.access_token, "new")
+        self.assertEqual(stored.access_token, "new")
+        stored.save.assert_called_once()
+
+        # the next LNAPI in the process uses the new token without requesting another one,
+        # even though it expires in less than TOKEN_REFRESH_SECONDS
+        self.assertEqual(LNAPI(session).access_token, "new")
+        self.assertEqual(session.post.call_count, 1)
+        api_tokens.objects.select_for_update.assert_called_once()
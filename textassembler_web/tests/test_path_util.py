@@ -0,0 +1,41 @@
+from django.test import SimpleTestCase, override_settings
+import os
+import tempfile
+
+from textassembler_web.path_util import PathAllocator, get_next_position
+
+
+@override_settings(MAX_FILES_PER_DIR=2, MAX_SUB_DIRS_PER_DIR=2)
+class PathAllocatorTestCase(SimpleTestCase):
+
+    def testNextPosition(self):
+        self.assertEqual(get_next_position([1, 1, 1]), [1, 1, 2])
+        self.assertEqual(get_next_position([1, 1, 2]), [1, 2, 1])
+        self.assertEqual(get_next_position([1, 2, 2]), [2, 1, 1])
+        # the base level is not capped
+        self.assertEqual(get_next_position([2, 2, 2]), [3, 1, 1])
+
+    def testAllocatesDirectories(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            allocator = PathAllocator(base_path, subdirs=["HTML", "TXT"])
+            paths = [allocator.next_path() for _ in range(5)]
+            self.assertEqual([os.path.relpath(p, base_path) for p in paths],
+                             ["1/1/1", "1/1/1", "1/1/2", "1/1/2", "1/2/1"])
+            self.assertTrue(os.path.isdir(os.path.join(base_path, "1/2/1/TXT")))
+            self.assertEqual(allocator.last_save_dir, "1/2/1")
+            self.assertEqual(allocator.file_count, 1)
+
+    def testResumesFromSavedPosition(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            allocator = PathAllocator(base_path, "1/1/2", 1, subdirs=["HTML"])
+            self.assertEqual(os.path.relpath(allocator.next_path(), base_path), "1/1/2")
+            self.assertEqual(os.path.relpath(allocator.next_path(), base_path), "1/2/1")
+
+    def testCountsFilesWhenCountUnknown(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            os.makedirs(os.path.join(base_path, "1/1/1/HTML"))
+            for name in ("a", "b"):
+                open(os.path.join(base_path, "1/1/1/HTML", name), "w").close()
+            allocator = PathAllocator(base_path, "1/1/1", None, subdirs=["HTML"])
+            self.assertEqual(allocator.file_count, 2)
+            self.assertEqual(os.path.relpath(allocator.next_path(), base_path), "1/1/2")
@@ -0,0 +1,23 @@
+from django.test import SimpleTestCase, override_settings
+
+from textassembler_web.preview_cache import get_cache_key
+
+
+class PreviewCacheKeyTestCase(SimpleTestCase):
+
+    def testKeyIgnoresWhitespaceAndFilterOrder(self):
+        key = get_cache_key("climate  change", {"Source_Id": ["123"], "year(Date)": [2019]})
+        self.assertEqual(key, get_cache_key(" climate change ", {"year(Date)": ["2019"], "Source_Id": ["123"]}))
+
+    def testKeyChangesWithFilters(self):
+        key = get_cache_key("climate change", {"Source_Id": ["123"]})
+        self.assertNotEqual(key, get_cache_key("climate change", {}))
+        self.assertNotEqual(key, get_cache_key("climate change", {"Source_Id": ["123", "456"]}))
+        self.assertNotEqual(key, get_cache_key("climate", {"Source_Id": ["123"]}))
+
+    def testKeyChangesWithPreviewFormat(self):
+        with override_settings(PREVIEW_FORMAT="FULL"):
+            full = get_cache_key("climate change", {})
+        with override_settings(PREVIEW_FORMAT="EXTRACT"):
+            extract = get_cache_key("climate change", {})
+        self.assertNotEqual(full, extract)
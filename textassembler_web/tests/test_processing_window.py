@@ -1,7 +1,8 @@
 from django.test import SimpleTestCase
+from django.utils import timezone
 import datetime
 
-from textassembler_web.ln_api import check_window
+from textassembler_web.ln_api import check_window, get_run_window, get_next_run_time
 
 
 def set_weekday(now, weekday):
@@ -47,3 +48,23 @@ class ProcessingWindowTestCase(SimpleTestCase):
         now = now.replace(hour=23, minute=30)
         inside_window, _start = check_window(now)
         self.assertFalse(inside_window)
+
+    def testStartOfNextWindow(self):
+        friday = set_weekday(datetime.datetime(2020, 1, 1, 22), 4)
+        # Monday morning after the window closed, and mid-week, wait for the next Friday
+        for (weekday, hour) in ((0, 6), (1, 12), (3, 23), (4, 21)):
+            now = set_weekday(friday - datetime.timedelta(days=6), weekday).replace(hour=hour)
+            inside_window, start = check_window(now)
+            self.assertFalse(inside_window)
+            self.assertEqual(start, friday)
+        # during the window the start is when it opened
+        self.assertEqual(get_run_window(friday + datetime.timedelta(days=1)), (friday, friday + datetime.timedelta(days=2, hours=8)))
+
+    def testNextRunTime(self):
+        friday = timezone.make_aware(set_weekday(datetime.datetime(2020, 1, 1, 22), 4))
+        # a limit that resets during the window can be used right away
+        saturday = friday + datetime.timedelta(days=1)
+        self.assertEqual(get_next_run_time(saturday), saturday)
+        # a limit that resets after the window closes has to wait for the next one
+        tuesday = friday + datetime.timedelta(days=4)
+        self.assertEqual(get_next_run_time(tuesday), friday + datetime.timedelta(days=7))
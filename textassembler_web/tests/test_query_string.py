@@ -0,0 +1,26 @@
+from django.test import SimpleTestCase
+
+from textassembler_web.ln_api import convert_filters_to_query_string, get_download_params
+
+
+class QueryStringTestCase(SimpleTestCase):
+
+    def testSingleValues(self):
+        self.assertEqual(convert_filters_to_query_string({"Language": ["English"]}),
+                         "Language eq LexisNexis.ServicesApi.Language'English' ")
+        self.assertEqual(convert_filters_to_query_string({"Source_Id": [12345]}), "Source/Id eq 12345 ")
+
+    def testMultipleValuesAndFields(self):
+        self.assertEqual(convert_filters_to_query_string({"Company": ["Google", "Alphabet Inc"], "People": ["Jane Doe"]}),
+                         " (Company eq 'R29vZ2xl' or Company eq 'QWxwaGFiZXQgSW5j') and People eq 'SmFuZSBEb2U' ")
+
+    def testDates(self):
+        expected = " (Date gt 2019-01-01 and Date lt 2019-12-31)"
+        self.assertEqual(convert_filters_to_query_string({"Date": ["gt", "2019-01-01", "lt", "2019-12-31"]}), expected)
+        self.assertEqual(convert_filters_to_query_string({"Date": ["gt 2019-01-01", "lt 2019-12-31"]}), expected)
+
+    def testDownloadParams(self):
+        params = get_download_params("climate", {"year(Date)": ["2019"]}, "Date")
+        self.assertEqual(params, {"$search": "climate", "$expand": "Document",
+                                  "$filter": "year(Date) eq 2019 ", "$orderby": "Date"})
+        self.assertNotIn("$orderby", get_download_params("climate", {}, ""))
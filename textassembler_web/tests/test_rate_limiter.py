@@ -0,0 +1,95 @@
+import datetime
+from unittest.mock import patch
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from textassembler_web.models import CallTypeChoice
+from textassembler_web.rate_limiter import RateLimiter, WINDOWS
+
+
+def make_limiter(limit=10, remaining=10, reset_seconds=60):
+    with patch.object(RateLimiter, "load"):
+        limiter = RateLimiter(CallTypeChoice.DWL)
+    now = timezone.now()
+    for window in WINDOWS:
+        limiter.limits[window] = limit
+        limiter.remaining[window] = remaining
+        limiter.reset_on[window] = now + datetime.timedelta(seconds=reset_seconds)
+    limiter.synced = limiter.get_state()
+    limiter.synced_at = now
+    return limiter
+
+
+@patch.object(RateLimiter, "save")
+class RateLimiterTestCase(SimpleTestCase):
+
+    def testStopsWhenWindowRunsOut(self, _):
+        limiter = make_limiter(remaining=1)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(limiter.calls_remaining(), 0)
+        self.assertEqual(limiter.next_available(), limiter.reset_on["day"])
+
+    def testRefillsWhenWindowResets(self, _):
+        limiter = make_limiter(remaining=0, reset_seconds=-90)
+        self.assertTrue(limiter.acquire())
+        self.assertEqual(limiter.remaining["minute"], 9)
+        self.assertGreater(limiter.reset_on["minute"], timezone.now())
+        self.assertLess(limiter.reset_on["hour"], limiter.reset_on["day"])
+
+    def testReturnsReservationOnFailedCall(self, _):
+        limiter = make_limiter()
+        self.assertTrue(limiter.acquire())
+        limiter.release(used=False)
+        self.assertEqual(limiter.calls_remaining(), 10)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertTrue(limiter.acquire())
+        limiter.release()
+        self.assertEqual(limiter.calls_remaining(), 9)
+
+    def testHeadersLowerRemaining(self, save):
+        limiter = make_limiter()
+        limiter.acquire()
+        limiter.acquire()
+        # the headers do not include the call that is still in progress
+        limiter.release({"X-RateLimit-Remaining": "5/50/500"})
+        self.assertEqual(limiter.remaining, {"minute": 4, "hour": 49, "day": 499})
+        save.assert_not_called()
+        limiter.release({"X-RateLimit-Remaining": "0/49/499"})
+        self.assertEqual(limiter.calls_remaining(), 0)
+        save.assert_called_once() # other processes need to know the limit ran out
+
+    @override_settings(LN_LIMITS_SYNC_SECONDS=60)
+    @patch("textassembler_web.rate_limiter.api_limits")
+    def testSavesChangesAfterSyncSeconds(self, api_limits, save):
+        api_limits.objects.filter.return_value.exists.return_value = False
+        limiter = make_limiter()
+        limiter.update({"X-RateLimit-Remaining": "8/8/8"})
+        limiter.calls_remaining()
+        save.assert_not_called()
+        limiter.synced_at = limiter.synced_at - datetime.timedelta(seconds=61)
+        limiter.calls_remaining()
+        save.assert_called_once()
+
+    @override_settings(LN_LIMITS_SYNC_SECONDS=60)
+    @patch("textassembler_web.rate_limiter.api_limits")
+    def testReloadsLimitsSavedByAnotherProcess(self, api_limits, save):
+        api_limits.objects.filter.return_value.exists.return_value = True
+        limiter = make_limiter()
+        limiter.update({"X-RateLimit-Remaining": "8/8/8"})
+        limiter.synced_at = limiter.synced_at - datetime.timedelta(seconds=61)
+        with patch.object(RateLimiter, "load") as load:
+            limiter.calls_remaining()
+        load.assert_called_once()
+        save.assert_not_called()
+
+    @override_settings(LN_LIMITS_SYNC_SECONDS=60)
+    @patch("textassembler_web.rate_limiter.api_limits")
+    def testDoesNotSaveUnchangedLimits(self, api_limits, save):
+        api_limits.objects.filter.return_value.exists.return_value = False
+        limiter = make_limiter()
+        limiter.update({"X-RateLimit-Remaining": "10/10/10", "X-RateLimit-Limit": "10/10/10"})
+        self.assertFalse(limiter.changed)
+        limiter.synced_at = limiter.synced_at - datetime.timedelta(seconds=61)
+        limiter.calls_remaining()
+        save.assert_not_called()
@@ -0,0 +1,63 @@
+from django.test import SimpleTestCase
+import json
+
+from textassembler_web.result_stream import ResultStream, iter_object_items
+
+
+class FakeResponse:
+    '''
+    Response that returns its body in chunks of the given size
+    '''
+
+    def __init__(self, body, chunk_size):
+        self.body = body.encode("utf-8")
+        self.size = chunk_size
+        self.closed = False
+
+    def iter_content(self, chunk_size=None): # pylint: disable=unused-argument
+        for start in range(0, len(self.body), self.size):
+            yield self.body[start:start + self.size]
+
+    def close(self):
+        self.closed = True
+
+
+class ResultStreamTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.response = {
+            "@odata.context": "https://services-api.lexisnexis.com/v1/$metadata#News",
+            "value": [{"ResultId": f"urn:contentItem:{i}", "Document": {"Content": f"<p>Café {i} \"quoted\"</p>"}}
+                      for i in range(5)],
+            "@odata.count": 12345,
+        }
+
+    def testDecodesAcrossChunkBoundaries(self):
+        body = json.dumps(self.response, indent=2)
+        for chunk_size in (1, 3, 7, 64, len(body)):
+            resp = FakeResponse(body, chunk_size)
+            stream = ResultStream(resp)
+            self.assertEqual(list(stream), self.response["value"])
+            self.assertTrue(stream.complete)
+            self.assertTrue(resp.closed)
+            self.assertEqual(stream["@odata.count"], 12345)
+            self.assertEqual(stream.num_results, 5)
+            self.assertEqual(stream.num_bytes, len(body.encode("utf-8")))
+
+    def testReportsMetadataOnComplete(self):
+        completed = []
+        stream = ResultStream(FakeResponse(json.dumps(self.response), 10), on_complete=completed.append)
+        for _ in stream:
+            pass
+        self.assertEqual(completed[0]["@odata.count"], 12345)
+
+    def testEmptyValues(self):
+        self.assertEqual(list(iter_object_items([b'{"value": [], "@odata.count": 0}'], "value")),
+                         [("@odata.count", 0)])
+
+    def testTruncatedResponse(self):
+        body = json.dumps(self.response)
+        stream = ResultStream(FakeResponse(body[:len(body) // 2], 16))
+        with self.assertRaises(ValueError):
+            list(stream)
+        self.assertFalse(stream.complete)
@@ -20,5 +20,6 @@ urlpatterns = [
     url(r'^ajax/filter_val_input/(?P<filter_type>.+)$', views.get_filter_val_input, name='filter_val_input'),
     url(r'^delete/(?P<search_id>[0-9]+)/$', views.delete_search, name='delete'),
     url(r'^download/(?P<search_id>[0-9]+)/$', views.download_search, name='download'),
+    url(r'^download/(?P<search_id>[0-9]+)/(?P<part>[0-9]+)/$', views.download_search, name='download_part'),
     url(r'^delete/admin/(?P<userid>[A-Za-z0-9]+)/$', views.delete_admin_user, name='delete_admin_user'),
 ]
@@ -10,10 +10,15 @@ import math
 import smtplib
 import socket
 import datetime
+import importlib.util
+import os
 from email.message import EmailMessage
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from .models import searches, filters, download_formats, available_formats, administrative_users, api_limits, CallTypeChoice
+from .models import searches, filters, download_formats, available_formats, administrative_users, api_limits, CallTypeChoice, \
+    ARCHIVE_FORMATS
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar.zst")
 
 def log_error(error_message, json_data=None):
     '''
@@ -216,6 +221,10 @@ def build_search_info(search_obj):
     else:
         search_obj.percent_complete = round((search_obj.num_results_downloaded / search_obj.num_results_in_search) * 100, 0)
 
+    # show the progress of the compression once the results are downloaded
+    if search_obj.status == "Preparing Results for Download" and search_obj.num_files_to_compress:
+        search_obj.percent_complete = round((search_obj.num_files_compressed / search_obj.num_files_to_compress) * 100, 0)
+
     # Clear out the error message from the display if the status is not Failed
     if search_obj.status != "Failed":
         search_obj.error_message = ""
@@ -227,3 +236,24 @@ def get_is_admin(userid):
     Determine if the user is a system admin or not
     '''
     return bool(administrative_users.objects.all().filter(userid=userid))
+
+def get_archive_formats():
+    '''
+    Get the types of files the results of a search can be compressed into. The tar.zst
+    format is only available when the zstandard package is installed.
+    '''
+    return [(value, label) for (value, label) in ARCHIVE_FORMATS
+            if value != "tar.zst" or importlib.util.find_spec("zstandard") is not None]
+
+def find_archive_files(search_id):
+    '''
+    For the given search ID, it will locate the full paths for the compressed results (zip or tar.zst files),
+    in order of their part number when the results were split into more than one file
+    '''
+    filepath = os.path.join(settings.STORAGE_LOCATION, str(search_id))
+    archive_files = []
+    for root, _, files in os.walk(filepath):
+        for name in files:
+            if name.endswith(ARCHIVE_EXTENSIONS):
+                archive_files.append(os.path.join(root, name))
+    return sorted(archive_files)
@@ -10,6 +10,7 @@ from django.db.models import Q
 from django.apps import apps
 from textassembler_web.utilities import get_is_admin
 from textassembler_web.models import searches, historical_searches
+from textassembler_web.preview_cache import get_statistics
 
 def admin_statistics(request):
     '''
@@ -36,6 +37,7 @@ def admin_statistics(request):
     searches_complete, num_results_downloaded = get_completed_search_stats(from_date, to_date)
     site_searches_run, download_cnt = get_api_log_stats(from_date, to_date)
     searches_processed = get_processed_search_stats(from_date, to_date)
+    preview_cache_hits, preview_cache_misses = get_statistics(from_date.date(), to_date.date())
 
     # Build the response
     response = {
@@ -44,6 +46,8 @@ def admin_statistics(request):
         "num_results_downloaded":num_results_downloaded,
         "download_cnt":download_cnt,
         "site_searches_run":site_searches_run,
+        "preview_cache_hits":preview_cache_hits,
+        "preview_cache_misses":preview_cache_misses,
         "from_date": datetime.datetime.strftime(from_date, '%Y-%m-%d'),
         "to_date": datetime.datetime.strftime(to_date, '%Y-%m-%d')}
 
@@ -7,7 +7,8 @@ import os
 from django.http import HttpResponse
 from django.shortcuts import render, redirect
 from django.conf import settings
-from textassembler_web.utilities import log_error, create_error_message, build_search_info
+from textassembler_web.notifications import notify, DELETE
+from textassembler_web.utilities import log_error, create_error_message, build_search_info, find_archive_files
 from textassembler_web.models import searches
 
 def mysearches(request):
@@ -60,7 +61,12 @@ def set_search_info(search_obj):
         }
 
     if search_obj.date_completed_compression != None:
-        actions.append(download)
+        if search_obj.archive_parts and search_obj.archive_parts > 1:
+            # the results were split into multiple files, so each one is downloaded separately
+            for part in range(1, search_obj.archive_parts + 1):
+                actions.append(dict(download, label=f"Download Part {part}", action="download_part", part=str(part)))
+        else:
+            actions.append(download)
     actions.append(delete)
     search_obj.actions = actions
 
@@ -84,6 +90,9 @@ def delete_search(request, search_id):
         search_obj.deleted = True
         search_obj.save()
 
+        # let the deletion processor know there is a search to remove
+        notify(DELETE)
+
     except Exception as exp: # pylint: disable=broad-except
         error = create_error_message(exp, os.path.basename(__file__))
         log_error(f"Error marking search as deleted:  {search_id}. {error}", json.dumps(dict(request.POST)))
@@ -96,9 +105,11 @@ def delete_search(request, search_id):
     request.session["error_message"] = error_message
     return redirect(mysearches)
 
-def download_search(request, search_id):
+def download_search(request, search_id, part=None):
     '''
     need to download files from the server for the search
+    Params:
+        part (str): The part to download, when the results were split into multiple files
     '''
 
     # Verify that the user is logged in
@@ -119,16 +130,21 @@ def download_search(request, search_id):
 
         # make sure the search file exists (HTTP 404)
         if error_message == "":
-            zipfile = find_zip_file(search_id)
-            if zipfile is None or not os.path.exists(zipfile) or not os.access(zipfile, os.R_OK):
+            archive_files = find_archive_files(search_id)
+            archive_file = None
+            if part is None and len(archive_files) == 1:
+                archive_file = archive_files[0]
+            elif part is not None and 0 < int(part) <= len(archive_files):
+                archive_file = archive_files[int(part) - 1]
+            if archive_file is None or not os.path.exists(archive_file) or not os.access(archive_file, os.R_OK):
                 error_message = \
                     "The search results can not be located on the server. please contact a system administator."
 
         if error_message == "":
-            # download the search zip
-            with open(zipfile, 'rb') as flh:
+            # download the search zip (or tar.zst)
+            with open(archive_file, 'rb') as flh:
                 response = HttpResponse(flh.read(), content_type="application/force-download")
-                response['Content-Disposition'] = 'attachment; filename=' + os.path.basename(zipfile)
+                response['Content-Disposition'] = 'attachment; filename=' + os.path.basename(archive_file)
                 request.session["error_message"] = error_message
                 return response
     except Exception as exp: # pylint: disable=broad-except
@@ -142,15 +158,3 @@ def download_search(request, search_id):
 
     request.session["error_message"] = error_message
     return redirect(mysearches)
-
-
-def find_zip_file(search_id):
-    '''
-    For the given search ID, it will locate the full path for the zip file
-    '''
-    filepath = os.path.join(settings.STORAGE_LOCATION, search_id)
-    for root, _, files in os.walk(filepath):
-        for name in files:
-            if name.endswith("zip"):
-                return os.path.join(root, name)
-    return None
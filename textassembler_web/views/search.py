@@ -11,7 +11,10 @@ from django.conf import settings
 from textassembler_web.forms import TextAssemblerWebForm
 from textassembler_web.ln_api import LNAPI
 from textassembler_web.filters import get_available_filters, get_filter_values, get_enum_namespace, get_format_type
-from textassembler_web.utilities import log_error, create_error_message, est_days_to_complete_search, get_is_admin
+from textassembler_web.notifications import notify, DOWNLOAD
+from textassembler_web.preview_cache import get_cached_preview, save_preview
+from textassembler_web.utilities import log_error, create_error_message, est_days_to_complete_search, get_is_admin, \
+    get_archive_formats
 from textassembler_web.models import available_formats, download_formats, searches, filters, available_sort_orders
 
 def search(request): # pylint:disable=too-many-locals, too-many-branches, too-many-statements
@@ -40,6 +43,7 @@ def search(request): # pylint:disable=too-many-locals, too-many-branches, too-ma
         "error_message": "",
         "available_formats":available_formats.objects.all(),
         "available_sort_orders":available_sort_orders.objects.filter(removed__isnull=True),
+        "available_archive_formats":get_archive_formats(),
     }
 
     # Parse the POST data
@@ -53,6 +57,7 @@ def search(request): # pylint:disable=too-many-locals, too-many-branches, too-ma
         set_post_filters = dict(request.POST)['post_filters']
     if "selected-sort-order" in dict(request.POST):
         set_sort_order = int(dict(request.POST)['selected-sort-order'][0])
+    set_archive_format = request.POST.get('selected-archive-format', 'zip')
 
     # Add post filters to set_filters
     for post_filter in set_post_filters:
@@ -125,7 +130,7 @@ def search(request): # pylint:disable=too-many-locals, too-many-branches, too-ma
                     # Submit Search button selected
                     response = handle_save_search(search_user, clean['search'], set_filters,
                                                   set_formats, set_sort_order, response, set_post_filters,
-                                                  request.session['userid'])
+                                                  request.session['userid'], set_archive_format)
                     if "error_message" not in response:
                         return response
 
@@ -154,10 +159,9 @@ def search(request): # pylint:disable=too-many-locals, too-many-branches, too-ma
 
 def handle_preview_search(term, set_filters, response):
     '''
-    Gets the preview results from the API and populates the response object
+    Gets the preview results from the API (or the preview cache) and populates the response object
     '''
-    search_api = LNAPI()
-    results = search_api.search(term, set_filters)
+    (results, full_text_results) = get_preview_results(term, set_filters)
     if "value" in results:
         # add estimated number of days to complete to result set
         results['est_days_to_complete'] = est_days_to_complete_search(int(results['@odata.count']))
@@ -169,9 +173,9 @@ def handle_preview_search(term, set_filters, response):
         response['error_message'] = \
             f"Error returned from LexisNexis: {'[Not Set]' if not results['error_message'] else results['error_message']}"
 
-    elif settings.PREVIEW_FORMAT == "FULL":
+    elif full_text_results is not None:
         # Get the full-text for the 10 results to display on the page
-        results = search_api.download(term, set_filters)
+        results = full_text_results
         if "value" in results:
             results['est_days_to_complete'] = est_days_to_complete_search(int(results['@odata.count']))
             results['count'] = results['@odata.count']
@@ -184,19 +188,45 @@ def handle_preview_search(term, set_filters, response):
 
     return response
 
+def get_preview_results(term, set_filters):
+    '''
+    Get the search results, and the full-text results if PREVIEW_FORMAT is FULL, for the preview.
+    Results that were previewed recently are taken from the cache instead of the API.
+    returns:
+        results (dict): Search results from the API
+        full_text_results (dict): Full-text results from the API, None if not needed
+    '''
+    cached = get_cached_preview(term, set_filters)
+    if cached is not None:
+        logging.debug("Using the cached preview results")
+        return (cached["results"], cached["full_text_results"])
 
-def handle_save_search(userid, term, set_filters, set_formats, set_sort_order, response, set_post_filters, cur_user): # pylint: disable=too-many-arguments, too-many-locals
+    search_api = LNAPI()
+    results = search_api.search(term, set_filters)
+    full_text_results = None
+    if "error_message" not in results and settings.PREVIEW_FORMAT == "FULL":
+        full_text_results = search_api.download(term, set_filters)
+
+    # only cache successful results
+    if "error_message" not in results and (full_text_results is None or "error_message" not in full_text_results):
+        save_preview(term, set_filters, {"results": results, "full_text_results": full_text_results})
+    return (results, full_text_results)
+
+
+def handle_save_search(userid, term, set_filters, set_formats, set_sort_order, # pylint: disable=too-many-arguments, too-many-locals
+                       response, set_post_filters, cur_user, archive_format="zip"):
     '''
     Handles the search being queued for full download
     '''
-    response, est_results = validate_save(response, set_formats, set_post_filters, cur_user)
+    response, est_results = validate_save(response, set_formats, set_post_filters, cur_user, archive_format)
 
     if response["error_message"] == "":
         # Get the sort order id
         sort_order_obj = available_sort_orders.objects.get(sort_id=set_sort_order)
 
         # Save the search record
-        search_obj = searches(userid=userid, query=term, sort_order=sort_order_obj, num_results_in_search=est_results)
+        search_obj = searches(userid=userid, query=term, sort_order=sort_order_obj, num_results_in_search=est_results,
+                              archive_format=archive_format)
         search_obj.save()
 
         # Save the selected filters
@@ -216,10 +246,13 @@ def handle_save_search(userid, term, set_filters, set_formats, set_sort_order, r
             format_obj = download_formats(search_id=search_obj, format_id=format_item)
             format_obj.save()
 
+        # let the queue processor know there is a new search to download
+        notify(DOWNLOAD)
+
         response = redirect('/mysearches')
     return response
 
-def validate_save(response, set_formats, set_post_filters, cur_user):
+def validate_save(response, set_formats, set_post_filters, cur_user, archive_format="zip"):
     '''
     Perform validation before saving the search
     '''
@@ -237,6 +270,10 @@ def validate_save(response, set_formats, set_post_filters, cur_user):
         if "result_data" in response and 'search_results' not in response:
             response['search_results'] = response['result_data']
 
+    ## Verify the archive format
+    if archive_format not in [value for (value, _) in get_archive_formats()]:
+        response["error_message"] += f"The results can not be compressed as '{archive_format}', please select another format."
+
     ## Calculate estimated results for current selection
     if set_post_filters and len(set_post_filters) > 1 and not get_is_admin(cur_user):
         # The UI should enforce this doesn't happen, but just in case a user manually modified the request sent to the server